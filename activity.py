@@ -0,0 +1,87 @@
+import datetime
+import threading
+from sqlalchemy import bindparam, update
+from background import PeriodicWorker
+from extensions import db
+from models import User
+
+class ActivityTracker(PeriodicWorker):
+    """Write-behind store for ``user.last_activity``.
+
+    Requests only record a timestamp in memory; repeated activity by the same
+    user between flushes collapses into one entry, and the background thread
+    writes all pending entries with a single executemany UPDATE. Anything that
+    displays last activity should ask ``last_activity()`` first, since the
+    column can lag by up to one flush interval.
+    """
+
+    name = 'activity-tracker'
+
+    def __init__(self, interval=30):
+        super().__init__(interval)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._counters = {'touches': 0, 'flushes': 0, 'rows_written': 0}
+
+    def init_app(self, app, start=True):
+        self.interval = app.config.get('ACTIVITY_FLUSH_INTERVAL', self.interval)
+        super().init_app(app, start)
+
+    def touch(self, user_id, when=None):
+        """Record activity for ``user_id`` (now, unless ``when`` is given)"""
+        when = when or datetime.datetime.utcnow()
+        with self._pending_lock:
+            self._merge(user_id, when)
+            self._counters['touches'] += 1
+
+    def last_activity(self, user_id, default=None):
+        """Most recent activity not yet flushed, else ``default`` (the stored column)"""
+        with self._pending_lock:
+            pending = self._pending.get(user_id)
+        if pending is None or (default is not None and default > pending):
+            return default
+        return pending
+
+    def run_once(self):
+        self.flush()
+
+    def flush(self):
+        """Write pending timestamps in one batched UPDATE; returns rows written"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        user = User.__table__
+        try:
+            db.session.execute(
+                update(user).where(user.c.id == bindparam('user_id')).values(last_activity=bindparam('seen')),
+                [{'user_id': user_id, 'seen': seen} for user_id, seen in pending.items()]
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Put the entries back (keeping anything newer) so the next flush retries them
+            with self._pending_lock:
+                for user_id, seen in pending.items():
+                    self._merge(user_id, seen)
+            raise
+        with self._pending_lock:
+            self._counters['flushes'] += 1
+            self._counters['rows_written'] += len(pending)
+        return len(pending)
+
+    def _merge(self, user_id, when):
+        # Caller holds _pending_lock
+        current = self._pending.get(user_id)
+        if current is None or when > current:
+            self._pending[user_id] = when
+
+    def stats(self):
+        """Counters plus the number of users waiting to be flushed"""
+        with self._pending_lock:
+            stats = dict(self._counters)
+            stats['pending'] = len(self._pending)
+        return stats
+
+# Shared tracker instance
+activity_tracker = ActivityTracker()
@@ -1,4 +1,5 @@
 import os
+import click
 from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import current_user, login_user, logout_user, login_required
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -9,10 +10,12 @@ import secrets
 import pymysql
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter.errors import RateLimitExceeded
-from urllib.parse import quote_plus
 
 # Import extensions
 from extensions import db, login_manager, bcrypt, limiter
+from db_backend import database_uri, display_uri, engine_options, engine_uri, is_sqlite
+from db_pool import InstrumentedQueuePool
+from replicas import replica_router, BIND_PREFIX as REPLICA_BIND_PREFIX
 
 # Load environment variables
 load_dotenv()
@@ -32,38 +35,157 @@ def create_app():
     app.config['PERMANENT_SESSION_LIFETIME'] = datetime.timedelta(minutes=30)
     app.config['SESSION_REFRESH_EACH_REQUEST'] = True
 
+    # Seconds between ledger balance checkpoints (0 disables the background thread)
+    app.config['LEDGER_CHECKPOINT_INTERVAL'] = float(os.environ.get('LEDGER_CHECKPOINT_INTERVAL', 5))
+
+    # Seconds between folds of hot-account balance stripes (0 disables the background thread)
+    app.config['STRIPE_COMPACT_INTERVAL'] = float(os.environ.get('STRIPE_COMPACT_INTERVAL', 5))
+
+    # Seconds between batched writes of user.last_activity (0 disables the background thread)
+    app.config['ACTIVITY_FLUSH_INTERVAL'] = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', 30))
+
+    # Seconds between batched audit_log/login_attempt writes, and how many rows may wait
+    app.config['AUDIT_FLUSH_INTERVAL'] = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2))
+    app.config['AUDIT_MAX_BUFFER'] = int(os.environ.get('AUDIT_MAX_BUFFER', 10000))
+
+    # Leased rate limiting: share of each limit a worker takes per store call,
+    # the cap on that share, and seconds before an idle lease is handed back
+    app.config['RATELIMIT_LEASE_FRACTION'] = float(os.environ.get('RATELIMIT_LEASE_FRACTION', 0.1))
+    app.config['RATELIMIT_LEASE_MAX'] = int(os.environ.get('RATELIMIT_LEASE_MAX', 50))
+    app.config['RATELIMIT_SYNC_INTERVAL'] = float(os.environ.get('RATELIMIT_SYNC_INTERVAL', 1))
+
+    # Seconds a cached login identity is trusted without re-reading the user row
+    app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 60))
+
+    # bcrypt cost for new password/PIN hashes; pick one with `flask calibrate-bcrypt`.
+    # Existing hashes at another cost are rehashed on the next successful login or PIN check.
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+
+    # bcrypt worker pool: processes per app instance and how many jobs may wait for one.
+    # Each server worker process (WEB_CONCURRENCY of them, as gunicorn counts) creates its
+    # own pool, so by default they share the host's cores rather than taking one per core each
+    web_concurrency = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+    app.config['BCRYPT_POOL_SIZE'] = int(os.environ.get('BCRYPT_POOL_SIZE', 0)) or max(1, (os.cpu_count() or 1) // web_concurrency)
+    app.config['HASHING_MAX_QUEUE'] = int(os.environ.get('HASHING_MAX_QUEUE', 32))
+
+    # In-process trigram index for manager search (set to 0 to always search with SQL LIKE)
+    app.config['SEARCH_INDEX_ENABLED'] = os.environ.get('SEARCH_INDEX_ENABLED', '1') != '0'
+    # Seconds between background catch-ups of the index, which also builds it after
+    # startup (0 disables the thread, leaving search on SQL unless catch_up is called)
+    app.config['SEARCH_INDEX_SYNC_INTERVAL'] = float(os.environ.get('SEARCH_INDEX_SYNC_INTERVAL', 5))
+
+    # Offline PSGC address data (data/psgc_snapshot.json.gz, written by `flask refresh-psgc`);
+    # without the file, lookups go to the live API with a startup warning, or startup
+    # fails if PSGC_ALLOW_LIVE_API=0
+    app.config['PSGC_SNAPSHOT_PATH'] = os.environ.get('PSGC_SNAPSHOT_PATH')
+    app.config['PSGC_ALLOW_LIVE_API'] = os.environ.get('PSGC_ALLOW_LIVE_API', '1') != '0'
+
+    # Compact, memory-mapped copy of the snapshot shared by all workers (0 keeps it in dicts per worker)
+    app.config['PSGC_STORE_ENABLED'] = os.environ.get('PSGC_STORE_ENABLED', '1') != '0'
+    app.config['PSGC_STORE_PATH'] = os.environ.get('PSGC_STORE_PATH')
+
+    # PSGC API client: base URL (point at a stub server for testing), on-disk
+    # response cache, and seconds a response is fresh / may still be served stale
+    app.config['PSGC_API_URL'] = os.environ.get('PSGC_API_URL', 'https://psgc.gitlab.io/api')
+    app.config['PSGC_CACHE_DIR'] = os.environ.get('PSGC_CACHE_DIR')
+    app.config['PSGC_CACHE_TTL'] = float(os.environ.get('PSGC_CACHE_TTL', 24 * 3600))
+    app.config['PSGC_CACHE_STALE_TTL'] = float(os.environ.get('PSGC_CACHE_STALE_TTL', 7 * 24 * 3600))
+
+    # Seconds browsers/CDNs may reuse /api/provinces, /api/cities and /api/barangays responses
+    app.config['PSGC_RESPONSE_MAX_AGE'] = int(os.environ.get('PSGC_RESPONSE_MAX_AGE', 24 * 3600))
+
     # CSRF Protection
     csrf.init_app(app)
 
-    # Database configuration
+    # Password/PIN hashing pool. Its worker processes are forked here, before the
+    # components below start their background threads.
+    from hashing import hashing_service, HashingBusy, calibrate, MIN_LOG_ROUNDS, MAX_LOG_ROUNDS
+    hashing_service.init_app(app)
 
-    # Construct the MySQL URL from individual environment variables if DATABASE_URL is not provided
-    # Use defaults to avoid None values
-    mysql_user = os.environ.get('MYSQL_USER', '')
-    mysql_password = os.environ.get('MYSQL_PASSWORD', '')
-    mysql_host = os.environ.get('MYSQL_HOST', '')  # Default to localhost if not set
-    mysql_port = os.environ.get('MYSQL_PORT', '3306')
-    mysql_database = os.environ.get('MYSQL_DATABASE', '')
-    
-    # Make sure all values are strings
-    mysql_port = str(mysql_port)
-    
-    # Check if required parameters are set
-    if not mysql_host or not mysql_user or not mysql_database:
-        print(f"WARNING: Missing database configuration. Host: {mysql_host}, User: {mysql_user}, Database: {mysql_database}")
-    
-    db_uri = f"mysql+pymysql://{mysql_user}:{mysql_password}@{mysql_host}:{mysql_port}/{mysql_database}"
-    print(f"Database URI: {db_uri}")
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
+    # PSGC address lookups, loaded before any worker thread starts so a missing
+    # snapshot stops startup cleanly
+    import psgc_api
+    import psgc_snapshot
+    import psgc_store
+    psgc_api.init_app(app)
+    from psgc_responses import psgc_responses
+    psgc_responses.init_app(app)
+
+    # Database configuration: DATABASE_URL takes any SQLAlchemy URI (sqlite:// runs
+    # in memory); without it the MySQL URL is built from the MYSQL_* variables
+    db_uri = database_uri()
+    print(f"Database URI: {display_uri(db_uri)}")
+    app.config['SQLALCHEMY_DATABASE_URI'] = engine_uri(db_uri)
 
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # Connection pool. Pre-ping and recycling replace connections the server has
+    # closed while idle ("MySQL server has gone away"); pool_timeout bounds how
+    # long a request waits when every connection is in use.
+    pool_options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 280)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') != '0',
+        'connect_args': {'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 10))},
+    }
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(db_uri, pool_options)
+
+    # Create the tables from the models at startup (default: only for SQLite)
+    app.config['DB_CREATE_ALL'] = os.environ.get('DB_CREATE_ALL', '1' if is_sqlite(db_uri) else '0') != '0'
+
+    # Read replicas for views marked @read_only (comma-separated SQLAlchemy URIs, same
+    # pool settings as the primary), and how long a user's reads stay on the primary
+    # after a request of theirs writes, to ride out replication lag
+    replica_uris = [uri.strip() for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri.strip()]
+    app.config['SQLALCHEMY_BINDS'] = {
+        f'{REPLICA_BIND_PREFIX}{i}': dict(engine_options(uri, pool_options), url=engine_uri(uri))
+        for i, uri in enumerate(replica_uris)
+    }
+    app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
     # Initialize extensions with app
     db.init_app(app)
     login_manager.init_app(app)
     bcrypt.init_app(app)
     limiter.init_app(app)
     
+    # Sends reads in @read_only views to the replicas
+    replica_router.init_app(app)
+    
+    # Hands idle rate-limit leases back to the shared store
+    from rate_limit import lease_sync
+    lease_sync.init_app(app)
+
+    # Transfer engine (imported here because it depends on the models)
+    from transfer_engine import transfer_engine, checkpoint_writer, stripe_compactor
+    transfer_engine.init_app(app)
+    checkpoint_writer.init_app(app)
+    stripe_compactor.init_app(app)
+    
+    # Write-behind last-activity tracking
+    from activity import activity_tracker
+    activity_tracker.init_app(app)
+    
+    # Buffered audit trail
+    from audit import audit_writer
+    audit_writer.init_app(app)
+    
+    # Active login sessions (single-session enforcement)
+    from session_registry import session_registry
+    session_registry.init_app(app)
+    
+    # Snapshot cache for load_user
+    from identity_cache import identity_cache
+    identity_cache.init_app(app)
+    
+    # Trigram index for manager search
+    from search_index import search_index, search_index_sync
+    search_index.init_app(app)
+    search_index_sync.init_app(app)
+    
     # Register custom error handler for rate limiting
     @app.errorhandler(RateLimitExceeded)
     def handle_rate_limit_exceeded(e):
@@ -73,6 +195,54 @@ def create_app():
         # Otherwise, return the HTML template
         return render_template('rate_limit_error.html', message=str(e)), 429
 
+    @app.cli.command('calibrate-bcrypt')
+    @click.option('--target-ms', default=250.0, show_default=True, help='Longest acceptable time for one hash')
+    @click.option('--min-rounds', default=MIN_LOG_ROUNDS, show_default=True)
+    @click.option('--max-rounds', default=MAX_LOG_ROUNDS, show_default=True)
+    def calibrate_bcrypt(target_ms, min_rounds, max_rounds):
+        """Benchmark bcrypt on this host and recommend BCRYPT_LOG_ROUNDS."""
+        log_rounds, timings = calibrate(target_ms, min_rounds, max_rounds)
+        for rounds, ms in timings.items():
+            click.echo(f"cost {rounds:>2}: {ms:8.1f} ms")
+        if timings[log_rounds] > target_ms:
+            click.echo(f"Even the minimum cost ({min_rounds}) takes longer than {target_ms:.0f} ms on this host.")
+        click.echo(f"Recommended: BCRYPT_LOG_ROUNDS={log_rounds} (currently {app.config['BCRYPT_LOG_ROUNDS']})")
+
+    @app.cli.command('stripe-account')
+    @click.argument('account_number')
+    @click.option('--stripes', default=8, show_default=True, help='Number of balance stripes (0 turns striping off).')
+    def stripe_account(account_number, stripes):
+        """Turn hot-account balance striping on or off for an account."""
+        from models import User
+        user = User.query.filter_by(account_number=account_number).first()
+        if not user:
+            click.echo(f"No account with number {account_number}")
+            return
+        if stripes > 0:
+            transfer_engine.enable_striping(user.id, stripes)
+            click.echo(f"Account {account_number} ({user.username}) now uses {stripes} balance stripes")
+        else:
+            transfer_engine.disable_striping(user.id)
+            click.echo(f"Striping disabled for account {account_number} ({user.username})")
+
+    @app.cli.command('refresh-psgc')
+    def refresh_psgc():
+        """Rebuild the offline PSGC snapshot from the PSGC API."""
+        path = app.config['PSGC_SNAPSHOT_PATH']
+        counts = psgc_api.refresh_snapshot(path)
+        for level, count in counts.items():
+            click.echo(f"{level:<15}{count:>8}")
+        click.echo(f"Snapshot {psgc_api.snapshot.version} written to {path or psgc_snapshot.DEFAULT_PATH}")
+        if app.config['PSGC_STORE_ENABLED']:
+            click.echo(f"Compact store rebuilt at {app.config['PSGC_STORE_PATH'] or psgc_store.DEFAULT_PATH}")
+
+    # Hashing pool saturated: fail fast instead of tying up the worker
+    @app.errorhandler(HashingBusy)
+    def handle_hashing_busy(e):
+        if request.path.startswith('/api/') or request.headers.get('Accept') == 'application/json':
+            return jsonify({"error": "Service busy", "message": "Please try again shortly."}), 503, {'Retry-After': '1'}
+        return render_template('errors/503.html'), 503, {'Retry-After': '1'}
+
     return app
 
 # Create Flask app
@@ -80,10 +250,16 @@ app = create_app()
 
 # Import models - must be after db initialization
 from models import User, Transaction
+from identity_cache import identity_cache
+
+# SQLite databases (an in-memory one always starts empty) get their schema from the models
+if app.config['DB_CREATE_ALL']:
+    with app.app_context():
+        db.create_all()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return identity_cache.load(int(user_id))
 
 # Import routes after app creation
 from routes import *
@@ -115,6 +291,7 @@ if __name__ == '__main__':
     print(f"MYSQL_HOST: {os.environ.get('MYSQL_HOST')}")
     print(f"MYSQL_USER: {os.environ.get('MYSQL_USER')}")
     print(f"MYSQL_DATABASE: {os.environ.get('MYSQL_DATABASE')}")
+    print(f"DATABASE_URL: {display_uri(app.config['SQLALCHEMY_DATABASE_URI'])}")
     
     with app.app_context():
         db.create_all()
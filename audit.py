@@ -0,0 +1,133 @@
+"""Buffered writer for the ``audit_log`` and ``login_attempt`` tables.
+
+Routes call ``audit_writer.log()`` / ``audit_writer.login_attempt()``, which
+only capture the client address and user agent and append a row to an
+in-memory buffer. The background thread drains the buffer every
+``AUDIT_FLUSH_INTERVAL`` seconds (or as soon as a batch fills up) with one
+multi-row INSERT per batch, so auditing never adds a database round trip to
+the request.
+
+The buffer is bounded by ``AUDIT_MAX_BUFFER`` rows; if the database is down
+long enough for it to fill, new events are dropped and counted rather than
+letting memory grow without limit. Whatever is still buffered is written when
+the app shuts down.
+"""
+import collections
+import datetime
+import threading
+from flask import has_request_context, request
+from sqlalchemy import insert
+from background import PeriodicWorker
+from extensions import db
+from models import AuditLog, LoginAttempt
+
+class AuditWriter(PeriodicWorker):
+    """Queue of audit rows flushed in batches by a background thread"""
+
+    name = 'audit-writer'
+
+    def __init__(self, interval=2, max_buffer=10000, batch_size=100):
+        super().__init__(interval)
+        self.max_buffer = max_buffer
+        # Rows per INSERT; kept under SQLite's bound-parameter limit
+        self.batch_size = batch_size
+        self._buffers = {
+            AuditLog.__table__: collections.deque(),
+            LoginAttempt.__table__: collections.deque(),
+        }
+        self._lock = threading.Lock()
+        self._counters = {'queued': 0, 'written': 0, 'dropped': 0, 'flushes': 0, 'errors': 0}
+
+    def init_app(self, app, start=True):
+        self.interval = app.config.get('AUDIT_FLUSH_INTERVAL', self.interval)
+        self.max_buffer = app.config.get('AUDIT_MAX_BUFFER', self.max_buffer)
+        super().init_app(app, start)
+
+    def log(self, action_type, description, user_id=None, entity_type=None, entity_id=None):
+        """Queue an audit_log row for an action by ``user_id``; False if it was dropped"""
+        ip_address, user_agent = _client()
+        return self._enqueue(AuditLog.__table__, {
+            'user_id': user_id,
+            'action_type': action_type,
+            'entity_type': entity_type,
+            'entity_id': None if entity_id is None else str(entity_id),
+            'description': description,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'timestamp': datetime.datetime.utcnow(),
+        })
+
+    def login_attempt(self, user_id, success):
+        """Queue a login_attempt row (``user_id`` is None for unknown usernames)"""
+        ip_address, user_agent = _client()
+        return self._enqueue(LoginAttempt.__table__, {
+            'user_id': user_id,
+            'ip_address': ip_address or 'unknown',
+            'user_agent': user_agent,
+            'timestamp': datetime.datetime.utcnow(),
+            'success': bool(success),
+        })
+
+    def _enqueue(self, table, row):
+        with self._lock:
+            if self._pending() >= self.max_buffer:
+                self._counters['dropped'] += 1
+                return False
+            self._buffers[table].append(row)
+            self._counters['queued'] += 1
+            full_batch = len(self._buffers[table]) >= self.batch_size
+        if full_batch:
+            self.wake()
+        return True
+
+    def run_once(self):
+        self.flush()
+
+    def flush(self):
+        """Write everything buffered so far in multi-row INSERTs; returns rows written"""
+        written = 0
+        for table, buffer in self._buffers.items():
+            while True:
+                with self._lock:
+                    batch = [buffer.popleft() for _ in range(min(self.batch_size, len(buffer)))]
+                if not batch:
+                    break
+                try:
+                    db.session.execute(insert(table).values(batch))
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    with self._lock:
+                        self._counters['errors'] += 1
+                        # Put the batch back in front for the next flush, as far as it fits
+                        keep = batch[:max(0, self.max_buffer - self._pending())]
+                        buffer.extendleft(reversed(keep))
+                        self._counters['dropped'] += len(batch) - len(keep)
+                    raise
+                written += len(batch)
+                with self._lock:
+                    self._counters['written'] += len(batch)
+        with self._lock:
+            self._counters['flushes'] += 1
+        return written
+
+    def _pending(self):
+        # Caller holds _lock
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def stats(self):
+        """Counters plus the number of rows waiting to be written"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['pending'] = self._pending()
+            stats['max_buffer'] = self.max_buffer
+        return stats
+
+def _client():
+    """(ip_address, user_agent) of the current request, or (None, None) outside one"""
+    if not has_request_context():
+        return None, None
+    return request.remote_addr, (request.user_agent.string or '')[:255] or None
+
+# Shared writer instance
+audit_writer = AuditWriter()
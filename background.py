@@ -0,0 +1,76 @@
+import atexit
+import threading
+
+class PeriodicWorker:
+    """Base class for daemon threads that run a job every ``interval`` seconds.
+
+    Subclasses implement ``run_once()``; it is called inside an app context.
+    ``stop()`` runs the job one last time so buffered work is not lost on
+    shutdown; it is also registered to run at interpreter exit.
+    """
+
+    name = 'periodic-worker'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.app = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._atexit_registered = False
+
+    def init_app(self, app, start=True):
+        self.app = app
+        if start and self.interval and self.interval > 0:
+            self.start()
+
+    def start(self):
+        """Start the worker thread (no-op if it is already running)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+        if not self._atexit_registered:
+            atexit.register(self._shutdown)
+            self._atexit_registered = True
+
+    def stop(self, timeout=5):
+        """Stop the thread and run the job a final time"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.run_now()
+
+    def wake(self):
+        """Ask the worker thread to run the job now instead of at the next interval"""
+        self._wake.set()
+
+    def run_now(self):
+        """Run the job immediately on the calling thread"""
+        if self.app is None:
+            return
+        with self.app.app_context():
+            self.run_once()
+
+    def _shutdown(self):
+        try:
+            self.stop()
+        except Exception as e:
+            print(f"{self.name}: final run failed: {e}")
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.run_now()
+            except Exception as e:
+                print(f"{self.name}: {e}")
+
+    def run_once(self):
+        raise NotImplementedError
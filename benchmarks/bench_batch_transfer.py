@@ -0,0 +1,65 @@
+"""Compare N single transfers against one batch of N payments.
+
+Both runs start from the same sender balance and the same set of recipients;
+the single-transfer run goes through ``TransferEngine.transfer`` (one commit per
+payment) and the batch run through ``TransferEngine.transfer_batch``.
+
+Usage:
+    python benchmarks/bench_batch_transfer.py --payments 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from extensions import db
+from models import User, Transaction
+from transfer_engine import transfer_engine
+from bench_transfer_contention import create_accounts, total_balance, cleanup
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--payments', type=int, default=1000)
+    parser.add_argument('--recipients', type=int, default=100)
+    args = parser.parse_args()
+
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    with app.app_context():
+        ids = create_accounts(prefix, args.recipients + 2, 1000.0)
+        single_sender, batch_sender, recipient_ids = ids[0], ids[1], ids[2:]
+        funding = float(args.payments * 10)
+        User.query.filter(User.id.in_([single_sender, batch_sender])).update({'balance': funding}, synchronize_session=False)
+        db.session.commit()
+
+        accounts = dict(db.session.query(User.id, User.account_number).filter(User.id.in_(recipient_ids)).all())
+        plan = [(random.choice(recipient_ids), random.randint(1, 10)) for _ in range(args.payments)]
+        before = total_balance(ids)
+
+        started = time.perf_counter()
+        for recipient_id, amount in plan:
+            transfer_engine.transfer(single_sender, recipient_id, amount)
+        single_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        ok, result = transfer_engine.transfer_batch(batch_sender, [(accounts[r], amount) for r, amount in plan])
+        batch_elapsed = time.perf_counter() - started
+
+        after = total_balance(ids)
+        posted = Transaction.query.filter(Transaction.sender_id.in_([single_sender, batch_sender])).count()
+        cleanup(ids)
+
+    print(f"{args.payments} single transfers: {single_elapsed:.3f}s ({args.payments / single_elapsed:.0f} payments/s)")
+    print(f"1 batch of {args.payments}:        {batch_elapsed:.3f}s ({args.payments / batch_elapsed:.0f} payments/s)")
+    print(f"Speed-up: {single_elapsed / batch_elapsed:.1f}x")
+    consistent = ok and round(before, 2) == round(after, 2) and posted == 2 * args.payments
+    print("PASS: balances and transaction rows add up" if consistent else f"FAIL: batch result {result!r}")
+    return 0 if consistent else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Deposit and transfer throughput into one hot account.
+
+T threads credit the same account concurrently, half by deposit and half by
+transfer from their own funding account. Credits are ledger inserts under a
+shared checkpoint lock, so they should not serialize on the hot account. The
+run finishes with a checkpoint and checks that the hot account's balance
+equals the sum of the credits, before and after folding.
+
+Usage:
+    python benchmarks/bench_hot_account.py --threads 16 --credits 200
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from transfer_engine import transfer_engine
+from bench_transfer_contention import create_accounts, total_balance, cleanup
+
+def worker(hot_id, funding_id, credits, errors):
+    with app.app_context():
+        for i in range(credits):
+            try:
+                if i % 2:
+                    transfer_engine.deposit(hot_id, 1, funding_id)
+                else:
+                    transfer_engine.transfer(funding_id, hot_id, 1)
+            except Exception as e:
+                errors.append(repr(e))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--credits', type=int, default=200, help='credits per thread')
+    args = parser.parse_args()
+
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    with app.app_context():
+        ids = create_accounts(prefix, args.threads + 1, float(args.credits))
+        hot_id, funding_ids = ids[0], ids[1:]
+        hot_id_opening = total_balance([hot_id])
+
+    errors = []
+    pool = [threading.Thread(target=worker, args=(hot_id, funding_id, args.credits, errors)) for funding_id in funding_ids]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        before_checkpoint = total_balance([hot_id]) - hot_id_opening
+        transfer_engine.checkpoint()
+        after_checkpoint = total_balance([hot_id]) - hot_id_opening
+        cleanup(ids)
+
+    expected = args.threads * args.credits - len(errors)
+    print(f"{args.threads * args.credits} credits in {elapsed:.2f}s: {args.threads * args.credits / elapsed:.1f} credits/s, {len(errors)} errors")
+    ok = round(before_checkpoint) == round(after_checkpoint) == expected
+    print("PASS: hot account balance matches credits" if ok else f"FAIL: expected {expected}, got {before_checkpoint} / {after_checkpoint}")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
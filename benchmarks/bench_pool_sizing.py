@@ -0,0 +1,96 @@
+"""Show how connection pool size affects request latency under load.
+
+``--threads`` simulated requests run back to back, each checking a connection
+out of the pool, running ``SELECT 1`` and holding the connection for
+``--query-ms`` (standing in for query time and the rest of the request's
+database work) before returning it. The run is repeated for every size in
+``--pool-sizes`` with no overflow, and reports request latency percentiles,
+pool timeouts and the pool's own checkout-wait histogram (as served by
+``/manager/api/metrics``).
+
+By default the engine is a temporary SQLite file; point ``--url`` at MySQL to
+measure against a real server (its ``max_connections`` caps useful sizes).
+
+Usage:
+    python benchmarks/bench_pool_sizing.py --threads 32 --pool-sizes 2,4,8,16,32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from db_pool import InstrumentedQueuePool, pool_stats
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def run(url, pool_size, threads, requests_per_thread, query_ms, pool_timeout):
+    engine = create_engine(url, poolclass=InstrumentedQueuePool, pool_size=pool_size, max_overflow=0,
+                           pool_timeout=pool_timeout, pool_pre_ping=True)
+    latencies = []
+    timeouts = [0]
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def client():
+        start.wait()
+        for _ in range(requests_per_thread):
+            began = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text('SELECT 1'))
+                    time.sleep(query_ms / 1000)
+            except PoolTimeout:
+                with lock:
+                    timeouts[0] += 1
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - began) * 1000)
+
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    began = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - began
+    stats = pool_stats(engine)
+    engine.dispose()
+    return latencies, timeouts[0], elapsed, stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='SQLAlchemy URL (default: a temporary SQLite file)')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=50, help='requests per thread')
+    parser.add_argument('--query-ms', type=float, default=5.0)
+    parser.add_argument('--pool-sizes', default='2,4,8,16,32')
+    parser.add_argument('--pool-timeout', type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        print(f"{args.threads} threads x {args.requests} requests, {args.query_ms} ms per query, "
+              f"pool timeout {args.pool_timeout}s")
+        print(f"{'pool':>6}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'req/s':>10}"
+              f"{'timeouts':>10}{'wait p99 ms':>13}")
+        for size in (int(s) for s in args.pool_sizes.split(',')):
+            latencies, timeouts, elapsed, stats = run(url, size, args.threads, args.requests,
+                                                      args.query_ms, args.pool_timeout)
+            wait_p99 = stats['wait_ms']['p99']
+            print(f"{size:>6}{percentile(latencies, 0.5):>10.1f}{percentile(latencies, 0.99):>10.1f}"
+                  f"{max(latencies, default=0):>10.1f}{len(latencies) / elapsed:>10.0f}{timeouts:>10}"
+                  f"{'<=' + str(wait_p99) if wait_p99 is not None else '>5000':>13}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Compare the memory-mapped PSGC store with the per-worker snapshot dicts.
+
+Writes a synthetic snapshot the size of the real PSGC (about 42k barangays)
+and its compact store to a temporary directory, then forks ``--workers``
+processes per variant that load the data and run ``--lookups`` code lookups
+and child listings. Reports each variant's summed proportional set size
+(PSS, shared pages split between the processes mapping them) and private
+memory, plus per-lookup latency, and checks both variants return the same
+results.
+
+Usage:
+    python benchmarks/bench_psgc_store.py --workers 4
+"""
+import argparse
+import gzip
+import json
+import mmap
+import multiprocessing
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psgc_store
+from psgc_snapshot import PsgcSnapshot
+
+def synthetic(barangays=42000):
+    """Snapshot data shaped like the PSGC: regions > provinces > cities/municipalities > barangays"""
+    def name():
+        return ' '.join(''.join(random.choices(string.ascii_lowercase, k=random.randint(4, 9))).title()
+                        for _ in range(random.randint(1, 3)))
+
+    data = {'version': 'bench', 'regions': [], 'provinces': [], 'cities': [], 'municipalities': [], 'barangays': []}
+    for r in range(17):
+        region = f"{r + 1:02d}00000000"
+        data['regions'].append({'code': region, 'name': name()})
+        for p in range(5):
+            province = f"{r + 1:02d}{p + 1:02d}000000"
+            data['provinces'].append({'code': province, 'name': name(), 'regionCode': region})
+            for m in range(20):
+                code = f"{r + 1:02d}{p + 1:02d}{m + 1:02d}0000"
+                level = 'cities' if m < 2 else 'municipalities'
+                data[level].append({'code': code, 'name': name(), 'provinceCode': province, 'regionCode': region})
+    parents = [('cityCode', c) for c in data['cities']] + [('municipalityCode', m) for m in data['municipalities']]
+    for i in range(barangays):
+        field, parent = parents[i % len(parents)]
+        data['barangays'].append({'code': f"{parent['code'][:6]}{i // len(parents) + 1:04d}", 'name': name(),
+                                  field: parent['code'], 'provinceCode': parent['provinceCode']})
+    return data
+
+def memory():
+    """PSS and private memory of this process in KiB"""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0].endswith(':') and len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    return fields.get('Pss', 0), fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+
+def lookups(data, codes, count):
+    started = time.perf_counter()
+    for i in range(count):
+        barangay, city, province = codes[i % len(codes)]
+        data.get('barangays', barangay)
+        data.list('barangays', 'cityCode', city)
+        data.list('cities', 'provinceCode', province)
+    return (time.perf_counter() - started) / (count * 3) * 1e6
+
+def worker(kind, paths, codes, count, barrier, results):
+    pss, private = memory()
+    data = PsgcSnapshot.load(paths['snapshot']) if kind == 'dicts' else psgc_store.PsgcStore(paths['store'])
+    if kind == 'store':
+        # Fault in every page so the whole file is resident, as it would be on a busy host
+        for offset in range(0, len(data._buf), mmap.PAGESIZE):
+            data._buf[offset]
+    latency = lookups(data, codes, count)
+    barrier.wait()
+    after_pss, after_private = memory()
+    results.put((after_pss - pss, after_private - private, latency))
+    barrier.wait()
+
+def run(kind, paths, codes, workers, count):
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    procs = [context.Process(target=worker, args=(kind, paths, codes, count, barrier, results)) for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    measured = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    return (sum(m[0] for m in measured), sum(m[1] for m in measured), sum(m[2] for m in measured) / workers)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--barangays', type=int, default=42000)
+    args = parser.parse_args()
+
+    data = synthetic(args.barangays)
+    codes = [(b['code'], b.get('cityCode'), b['provinceCode']) for b in random.sample(data['barangays'], 1000)]
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {'snapshot': os.path.join(tmp, 'psgc.json.gz'), 'store': os.path.join(tmp, 'psgc.bin')}
+        with gzip.open(paths['snapshot'], 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+        psgc_store.build(data, paths['store'])
+        del data
+        print(f"Store file: {os.path.getsize(paths['store']) / 1024:.0f} KiB")
+
+        print(f"{'variant':<10}{'PSS KiB':>12}{'private KiB':>14}{'us/lookup':>12}   ({args.workers} workers)")
+        for kind in ('dicts', 'store'):
+            pss, private, latency = run(kind, paths, codes, args.workers, args.lookups)
+            print(f"{kind:<10}{pss:>12}{private:>14}{latency:>12.2f}")
+
+        dicts = PsgcSnapshot.load(paths['snapshot'])
+        store = psgc_store.PsgcStore(paths['store'])
+        ok = all(
+            dicts.get('barangays', b) == store.get('barangays', b)
+            and dicts.list('barangays', 'cityCode', c) == store.list('barangays', 'cityCode', c)
+            and dicts.list('cities', 'provinceCode', p) == store.list('cities', 'provinceCode', p)
+            for b, c, p in codes
+        ) and all(dicts.list(level) == store.list(level) for level in ('regions', 'provinces', 'municipalities'))
+        store.close()
+
+    print("PASS: store matches snapshot lookups" if ok else "FAIL: store and snapshot results differ")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Compare the leased rate limiter with plain fixed-window.
+
+Overhead: times ``--hits`` hits on one key with each strategy and counts the
+calls that reach the store. ``--latency-ms`` adds a delay to every store call
+to stand in for the Redis round trip (or point ``--storage`` at a real one).
+
+Accuracy: ``--workers`` limiters (one per simulated worker process) share a
+store and hit the same key from ``--threads`` threads each, making three times
+as many attempts as the limit allows. Passes if no strategy admits more than
+the limit and the leased one admits at least the limit minus one lease per
+worker.
+
+Usage:
+    python benchmarks/bench_rate_limit.py --latency-ms 0.5 --workers 4
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import STRATEGIES
+from rate_limit import LeaseSync
+
+class SlowStorage:
+    """Store proxy that counts calls and sleeps ``latency`` seconds in each"""
+
+    def __init__(self, storage, latency):
+        self.storage = storage
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.storage, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                self.calls += 1
+            if self.latency:
+                time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return call
+
+def make_limiter(strategy, storage, sync):
+    if strategy == 'leased-fixed-window':
+        limiter = STRATEGIES[strategy](storage.storage, sync)
+    else:
+        limiter = STRATEGIES[strategy](storage.storage)
+    # Swap the proxy in after construction; the constructor only accepts real stores
+    limiter.storage = storage
+    return limiter
+
+def overhead(strategy, storage, hits):
+    sync = LeaseSync()
+    limiter = make_limiter(strategy, storage, sync)
+    item = parse(f"{hits * 10} per hour")
+    calls = storage.calls
+    started = time.perf_counter()
+    for _ in range(hits):
+        limiter.hit(item, 'bench', 'overhead', strategy)
+    elapsed = time.perf_counter() - started
+    return elapsed / hits * 1e6, (storage.calls - calls) / hits
+
+def burst(strategy, storage, limit, workers, threads):
+    item = parse(f"{limit} per hour")
+    key = ('bench', 'burst', strategy)
+    storage.storage.clear(item.key_for(*key))
+    syncs = [LeaseSync() for _ in range(workers)]
+    limiters = [make_limiter(strategy, storage, sync) for sync in syncs]
+    admitted = [0]
+    lock = threading.Lock()
+    attempts = limit * 3 // (workers * threads) + 1
+
+    def hammer(limiter):
+        allowed = 0
+        for _ in range(attempts):
+            if limiter.hit(item, *key):
+                allowed += 1
+        with lock:
+            admitted[0] += allowed
+
+    pool = [threading.Thread(target=hammer, args=(limiter,)) for limiter in limiters for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return admitted[0], syncs[0].lease_size(limit)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--storage', default='memory://')
+    parser.add_argument('--latency-ms', type=float, default=0.5, help='simulated store round trip')
+    parser.add_argument('--hits', type=int, default=5000)
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    storage = SlowStorage(storage_from_string(args.storage), args.latency_ms / 1000)
+    strategies = ['fixed-window', 'leased-fixed-window']
+
+    print(f"Overhead ({args.hits} hits, {args.latency_ms} ms per store call)")
+    print(f"{'strategy':<22}{'us/hit':>10}{'calls/hit':>12}")
+    for strategy in strategies:
+        per_hit, calls = overhead(strategy, storage, args.hits)
+        print(f"{strategy:<22}{per_hit:>10.1f}{calls:>12.3f}")
+
+    print(f"\nBurst accuracy (limit {args.limit}, {args.workers} workers x {args.threads} threads)")
+    print(f"{'strategy':<22}{'admitted':>10}{'lease':>8}")
+    ok = True
+    for strategy in strategies:
+        admitted, lease = burst(strategy, storage, args.limit, args.workers, args.threads)
+        print(f"{strategy:<22}{admitted:>10}{lease:>8}")
+        ok = ok and admitted <= args.limit
+        if strategy == 'leased-fixed-window':
+            ok = ok and admitted >= args.limit - lease * args.workers
+
+    print("PASS: limits held under burst" if ok else "FAIL: admitted count outside the expected range")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Compare manager search through the trigram index against the SQL LIKE path.
+
+Seeds ``--users`` throwaway accounts and ``--details`` transactions carrying
+free-text details, then runs the same set of search terms through
+``search_index`` and through ``LIKE '%term%'`` and checks that both return
+the same ids.
+
+Usage:
+    python benchmarks/bench_search_index.py --users 100000 --details 200000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+import uuid
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from extensions import db
+from models import User, Transaction
+from search_index import search_index
+from bench_transfer_contention import cleanup
+
+WORDS = ['updated', 'email', 'address', 'region', 'province', 'city', 'barangay', 'status', 'phone', 'name']
+
+def seed_users(prefix, count, chunk=10000):
+    """Bulk insert users with random usernames; returns their ids"""
+    numbers = random.sample(range(10 ** 9), count)
+    for offset in range(0, count, chunk):
+        db.session.execute(User.__table__.insert(), [
+            {
+                'username': f"{prefix}_{''.join(random.choices(string.ascii_lowercase, k=8))}_{i}",
+                'email': f"{prefix}_{i}@bench.local",
+                'password_hash': 'x',
+                'account_number': f"8{numbers[i]:09d}",
+                'status': 'active',
+                'balance': 0.0
+            }
+            for i in range(offset, min(offset + chunk, count))
+        ])
+        db.session.commit()
+    return db.session.execute(db.select(User.id).where(User.username.startswith(prefix + '_'))).scalars().all()
+
+def seed_details(ids, count, chunk=10000):
+    for offset in range(0, count, chunk):
+        db.session.execute(Transaction.__table__.insert(), [
+            {
+                'transaction_id': str(uuid.uuid4()),
+                'sender_id': random.choice(ids),
+                'receiver_id': random.choice(ids),
+                'amount': None,
+                'transaction_type': 'user_edit',
+                'details': ' '.join(random.choices(WORDS, k=4)) + f" ref {random.randint(0, 10 ** 8)}"
+            }
+            for _ in range(offset, min(offset + chunk, count))
+        ])
+        db.session.commit()
+
+def like_users(term):
+    return set(db.session.execute(db.select(User.id).where(db.or_(
+        User.username.contains(term, autoescape=True), User.account_number.contains(term, autoescape=True)
+    ))).scalars())
+
+def like_details(term):
+    return set(db.session.execute(
+        db.select(Transaction.id).where(Transaction.details.contains(term, autoescape=True))
+    ).scalars())
+
+def timed(fn, term, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(term)
+    return result, (time.perf_counter() - started) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--details', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help='keep benchmark rows afterwards')
+    args = parser.parse_args()
+
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    with app.app_context():
+        started = time.perf_counter()
+        ids = seed_users(prefix, args.users)
+        seed_details(ids, args.details)
+        print(f"Seeded {len(ids)} users and {args.details} detail rows in {time.perf_counter() - started:.1f}s")
+
+        search_index.reset()
+        started = time.perf_counter()
+        search_index.catch_up()
+        print(f"Index build: {time.perf_counter() - started:.2f}s")
+
+        sample = random.choice(ids)
+        username = db.session.get(User, sample).username
+        terms = [username[len(prefix) + 1:len(prefix) + 6], '0042', 'zzqx', 'barangay stat', 'ref 1234']
+
+        ok = True
+        print(f"{'term':<16}{'hits':>8}{'LIKE ms':>10}{'index ms':>10}")
+        for term in terms:
+            user_fields = ('username', 'account_number')
+            expected, like_time = timed(like_users, term, args.repeat)
+            found, index_time = timed(lambda t: search_index.user_ids(t, user_fields), term, args.repeat)
+            detail_expected, detail_like = timed(like_details, term, args.repeat)
+            detail_found, detail_index = timed(search_index.transaction_ids, term, args.repeat)
+            hits = len(expected) + len(detail_expected)
+            print(f"{term!r:<16}{hits:>8}{(like_time + detail_like) * 1000:>10.1f}{(index_time + detail_index) * 1000:>10.1f}")
+            ok = ok and found == expected and detail_found == detail_expected
+
+        if not args.keep:
+            cleanup(ids)
+            search_index.reset()
+
+    print("PASS: index results match LIKE" if ok else "FAIL: index and LIKE results differ")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Export a very large statement and check that memory use stays flat.
+
+Seeds ``--rows`` transactions between two throwaway accounts, streams the
+statement through ``statements.export`` (gzip on) without keeping any of it,
+and samples the process RSS while doing so. The run passes if every row was
+exported and RSS grew by less than ``--max-rss-mb`` during the export.
+
+Usage:
+    python benchmarks/bench_statement_export.py --rows 1000000 --max-rss-mb 64
+"""
+import argparse
+import datetime
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from extensions import db
+from models import Transaction
+import statements
+from bench_transfer_contention import create_accounts, cleanup
+
+def rss_mb():
+    """Current resident set size in MB (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def seed(sender_id, receiver_id, rows, chunk=10000):
+    """Bulk insert ``rows`` transfers, alternating direction, one chunk at a time"""
+    started = datetime.datetime(2020, 1, 1)
+    for offset in range(0, rows, chunk):
+        db.session.execute(Transaction.__table__.insert(), [
+            {
+                'transaction_id': str(uuid.uuid4()),
+                'sender_id': sender_id if i % 2 else receiver_id,
+                'receiver_id': receiver_id if i % 2 else sender_id,
+                'amount': 1.0 + i % 100,
+                'transaction_type': 'transfer',
+                'timestamp': started + datetime.timedelta(seconds=i)
+            }
+            for i in range(offset, min(offset + chunk, rows))
+        ])
+        db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--format', choices=sorted(statements.FORMATS), default='csv')
+    parser.add_argument('--max-rss-mb', type=float, default=64.0, help='allowed RSS growth during the export')
+    parser.add_argument('--keep', action='store_true', help='keep benchmark rows afterwards')
+    args = parser.parse_args()
+
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    with app.app_context():
+        ids = create_accounts(prefix, 2, 0.0)
+        started = time.perf_counter()
+        seed(ids[0], ids[1], args.rows)
+        print(f"Seeded {args.rows} transactions in {time.perf_counter() - started:.1f}s")
+        db.session.remove()
+
+    peak = [0.0]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.05):
+            peak[0] = max(peak[0], rss_mb())
+
+    with app.app_context():
+        baseline = rss_mb()
+        peak[0] = baseline
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+
+        # Decompress as we go to count lines without holding the output
+        decompressor = zlib.decompressobj(31)
+        compressed = lines = 0
+        started = time.perf_counter()
+        for chunk in statements.export(ids[0], args.format, compress=True):
+            compressed += len(chunk)
+            lines += decompressor.decompress(chunk).count(b'\n')
+        lines += decompressor.flush().count(b'\n')
+        elapsed = time.perf_counter() - started
+
+        done.set()
+        sampler.join()
+        peak[0] = max(peak[0], rss_mb())
+        if not args.keep:
+            cleanup(ids)
+
+    exported = lines - (1 if args.format == 'csv' else 0)
+    growth = peak[0] - baseline
+    print(f"Exported {exported} rows as {args.format} in {elapsed:.1f}s ({exported / elapsed:.0f} rows/s), {compressed / 1024 / 1024:.1f} MB gzipped")
+    print(f"RSS before: {baseline:.1f} MB  peak: {peak[0]:.1f} MB  growth: {growth:.1f} MB (ceiling {args.max_rss_mb:.0f} MB)")
+
+    ok = exported == args.rows and growth < args.max_rss_mb
+    print("PASS: all rows exported within the memory ceiling" if ok else "FAIL: missing rows or memory ceiling exceeded")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""Credit throughput into one hot account at different stripe counts.
+
+For each stripe count, T threads deposit into the same account concurrently
+while one more thread keeps paying out of it. Payouts take the exclusive lock
+on the account's checkpoint, which every unstriped credit has to wait for;
+with N stripes, credits take a shared lock on one of N ``balance_stripe``
+rows instead and no longer queue behind the payouts. The lock contention this
+removes is MySQL's row locking; SQLite serializes all writers anyway, so
+there the run only checks correctness.
+
+After each run the stripes and the checkpoint are folded and striping is
+turned off again; the account's balance must equal deposits minus payouts
+at every step.
+
+Usage:
+    python benchmarks/bench_striped_deposits.py --threads 16 --deposits 200 --stripes 0 2 4 8 16
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from transfer_engine import transfer_engine
+from bench_transfer_contention import create_accounts, total_balance, cleanup
+
+def depositor(account_id, admin_id, deposits, errors):
+    with app.app_context():
+        for _ in range(deposits):
+            try:
+                transfer_engine.deposit(account_id, 1, admin_id)
+            except Exception as e:
+                errors.append(repr(e))
+
+def payer(account_id, payee_id, done, payouts, errors):
+    with app.app_context():
+        while not done.is_set():
+            try:
+                if transfer_engine.transfer(account_id, payee_id, 1):
+                    payouts[0] += 1
+            except Exception as e:
+                errors.append(repr(e))
+
+def run(stripes, threads, deposits):
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    with app.app_context():
+        hot_id, admin_id = create_accounts(prefix, 2, 0.0)
+        if stripes:
+            transfer_engine.enable_striping(hot_id, stripes)
+
+    errors, payouts, done = [], [0], threading.Event()
+    pool = [threading.Thread(target=depositor, args=(hot_id, admin_id, deposits, errors)) for _ in range(threads)]
+    payout_thread = threading.Thread(target=payer, args=(hot_id, admin_id, done, payouts, errors))
+    started = time.perf_counter()
+    payout_thread.start()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    payout_thread.join()
+
+    with app.app_context():
+        # Folding and draining stripes must not create or destroy money
+        balances = [total_balance([hot_id])]
+        transfer_engine.compact()
+        transfer_engine.checkpoint()
+        balances.append(total_balance([hot_id]))
+        if stripes:
+            transfer_engine.disable_striping(hot_id)
+            balances.append(total_balance([hot_id]))
+        cleanup([hot_id, admin_id])
+
+    expected = threads * deposits - payouts[0] - len(errors)
+    ok = all(round(balance) == expected for balance in balances)
+    return threads * deposits / elapsed, payouts[0], len(errors), ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--deposits', type=int, default=200, help='deposits per thread')
+    parser.add_argument('--stripes', type=int, nargs='+', default=[0, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    all_ok = True
+    print(f"{'stripes':>8} {'deposits/s':>12} {'payouts':>8} {'errors':>8}  balance check")
+    for stripes in args.stripes:
+        rate, payouts, errors, ok = run(stripes, args.threads, args.deposits)
+        all_ok = all_ok and ok
+        print(f"{stripes:>8} {rate:>12.1f} {payouts:>8} {errors:>8}  {'ok' if ok else 'MISMATCH'}")
+    return 0 if all_ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
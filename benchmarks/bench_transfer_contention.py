@@ -0,0 +1,125 @@
+"""Multi-threaded contention benchmark for the transfer engine.
+
+Creates a pool of throwaway accounts plus one "merchant" account that receives
+most of the traffic, hammers them with concurrent transfers and checks that the
+total amount of money in the pool is unchanged afterwards.
+
+Usage:
+    python benchmarks/bench_transfer_contention.py --threads 16 --transfers 200
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from extensions import db
+from models import User, Transaction, LedgerEntry, BalanceCheckpoint, BalanceStripe
+from transfer_engine import transfer_engine
+import ledger
+
+def create_accounts(prefix, count, balance):
+    """Create benchmark accounts and return their ids"""
+    users = []
+    for i in range(count):
+        user = User(
+            username=f"{prefix}_{i}",
+            email=f"{prefix}_{i}@bench.local",
+            account_number=f"9{random.randint(0, 999999999):09d}",
+            status='active',
+            balance=balance
+        )
+        user.password_hash = 'x'
+        users.append(user)
+    db.session.add_all(users)
+    db.session.commit()
+    return [u.id for u in users]
+
+def total_balance(ids):
+    """Sum of the accounts' ledger balances in pesos"""
+    return ledger.to_major(sum(ledger.balance_of(account_id) for account_id in ids))
+
+def cleanup(ids):
+    Transaction.query.filter(db.or_(Transaction.sender_id.in_(ids), Transaction.receiver_id.in_(ids))).delete(synchronize_session=False)
+    LedgerEntry.query.filter(LedgerEntry.account_id.in_(ids)).delete(synchronize_session=False)
+    BalanceCheckpoint.query.filter(BalanceCheckpoint.user_id.in_(ids)).delete(synchronize_session=False)
+    BalanceStripe.query.filter(BalanceStripe.user_id.in_(ids)).delete(synchronize_session=False)
+    User.query.filter(User.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+def worker(ids, merchant_id, transfers, hot_ratio, latencies, errors):
+    with app.app_context():
+        for _ in range(transfers):
+            sender_id = random.choice(ids)
+            recipient_id = merchant_id if random.random() < hot_ratio else random.choice(ids)
+            if recipient_id == sender_id:
+                continue
+            # Whole-peso amounts keep the check exact even on FLOAT columns
+            amount = random.randint(1, 50)
+            started = time.perf_counter()
+            try:
+                transfer_engine.transfer(sender_id, recipient_id, amount)
+            except Exception as e:
+                errors.append(repr(e))
+            latencies.append(time.perf_counter() - started)
+        db.session.remove()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--transfers', type=int, default=200, help='transfers per thread')
+    parser.add_argument('--hot-ratio', type=float, default=0.8, help='share of transfers sent to the merchant account')
+    parser.add_argument('--keep', action='store_true', help='keep benchmark rows afterwards')
+    args = parser.parse_args()
+
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    with app.app_context():
+        ids = create_accounts(prefix, args.accounts, 1000.0)
+        merchant_id = ids[0]
+        before = total_balance(ids)
+
+    transfer_engine.reset_stats()
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(target=worker, args=(ids, merchant_id, args.transfers, args.hot_ratio, latencies, errors))
+        for _ in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        after = total_balance(ids)
+        committed = Transaction.query.filter(Transaction.sender_id.in_(ids)).count()
+        if not args.keep:
+            cleanup(ids)
+
+    stats = transfer_engine.stats()
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+
+    print(f"Threads: {args.threads}  Attempts: {len(latencies)}  Elapsed: {elapsed:.2f}s")
+    print(f"Committed: {stats['committed']}  Rejected: {stats['rejected']}  Failed: {stats['failed']}")
+    print(f"Retries: {stats['retries']} (deadlocks {stats['deadlocks']}, lock timeouts {stats['lock_timeouts']})")
+    print(f"Throughput: {stats['committed'] / elapsed:.1f} transfers/s  p50 {p50 * 1000:.1f}ms  p99 {p99 * 1000:.1f}ms")
+    print(f"Total balance before: {before:.2f}  after: {after:.2f}")
+
+    ok = round(before, 2) == round(after, 2) and committed == stats['committed']
+    if errors:
+        print(f"{len(errors)} errors, first: {errors[0]}")
+    print("PASS: no money lost" if ok else "FAIL: balances or transaction count do not add up")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
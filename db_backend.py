@@ -0,0 +1,91 @@
+"""Database backend selection.
+
+``DATABASE_URL`` may be any SQLAlchemy URI; without it the MySQL URI is built
+from the ``MYSQL_*`` variables. SQLite needs no server, so the app, the
+benchmarks and load tests can run on a laptop or CI box:
+
+- ``sqlite:////abs/path/bank.db`` (or a relative ``sqlite:///bank.db``, which
+  Flask-SQLAlchemy puts in the instance folder) for a file
+- ``sqlite://`` for an in-memory database shared by every thread of the process
+
+SQLite databases get their schema from the models when the app starts
+(``DB_CREATE_ALL``), since an in-memory one always starts empty. ``engine_uri``
+turns ``sqlite://`` into a named shared-cache memory database that a hidden
+connection keeps alive, so pooled connections can be replaced (recycled,
+invalidated) without losing it. A file allows concurrent readers.
+
+An in-memory database is limited to one pooled connection: threads take
+turns, and code must never need a second connection while it holds one
+(e.g. ``db.engine.begin()`` inside a request), which would wait out
+``DB_POOL_TIMEOUT`` and fail. Everything in the app runs on ``db.session``.
+"""
+import os
+import sqlite3
+import uuid
+from sqlalchemy.engine import make_url
+
+# Connections holding each named in-memory database open, by database name
+_keepalive = {}
+
+def database_uri():
+    """``DATABASE_URL``, or the MySQL URI built from ``MYSQL_*``"""
+    uri = os.environ.get('DATABASE_URL', '').strip()
+    if uri:
+        return uri
+
+    # Use defaults to avoid None values
+    mysql_user = os.environ.get('MYSQL_USER', '')
+    mysql_password = os.environ.get('MYSQL_PASSWORD', '')
+    mysql_host = os.environ.get('MYSQL_HOST', '')
+    mysql_port = str(os.environ.get('MYSQL_PORT', '3306'))
+    mysql_database = os.environ.get('MYSQL_DATABASE', '')
+
+    # Check if required parameters are set
+    if not mysql_host or not mysql_user or not mysql_database:
+        print(f"WARNING: Missing database configuration. Host: {mysql_host}, User: {mysql_user}, Database: {mysql_database}")
+
+    return f"mysql+pymysql://{mysql_user}:{mysql_password}@{mysql_host}:{mysql_port}/{mysql_database}"
+
+def backend_name(uri):
+    """Dialect name of ``uri``: 'mysql', 'sqlite', 'postgresql', ..."""
+    return make_url(uri).get_backend_name()
+
+def is_sqlite(uri):
+    return backend_name(uri) == 'sqlite'
+
+def is_memory(uri):
+    """True for an in-memory SQLite URI (``sqlite://`` or one made by ``engine_uri``)"""
+    url = make_url(uri)
+    return is_sqlite(uri) and (url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory')
+
+def engine_uri(uri):
+    """URI to give the engine for ``uri``: a named, shared-cache database for in-memory SQLite
+
+    Every connection to the name sees the same database, which lives as long as
+    one of them is open; the keep-alive connection opened here is that one.
+    """
+    if not is_memory(uri) or make_url(uri).query.get('mode') == 'memory':
+        return uri
+    # An absolute name, which Flask-SQLAlchemy leaves alone rather than moving into the instance folder
+    name = f'file:/simple-banking-{uuid.uuid4().hex}?mode=memory&cache=shared'
+    _keepalive[name] = sqlite3.connect(name, uri=True, check_same_thread=False)
+    return f'sqlite:///{name}&uri=true'
+
+def engine_options(uri, options):
+    """Engine options for ``uri``, given the pool options used for a database server"""
+    if is_memory(uri):
+        # Shared-cache connections lock whole tables and fail at once ("database
+        # table is locked") rather than wait, even to read, so the pool hands out
+        # one connection at a time (waiting up to pool_timeout); recycling is
+        # harmless but pointless in memory
+        options = {key: value for key, value in options.items() if key != 'connect_args'}
+        options.update(pool_size=1, max_overflow=0, pool_recycle=-1, connect_args={'check_same_thread': False})
+        return options
+    if is_sqlite(uri):
+        # The connect arguments are for network drivers (pymysql's connect_timeout)
+        return {key: value for key, value in options.items() if key != 'connect_args'}
+    return dict(options)
+
+def display_uri(uri):
+    """``uri`` with the password masked, for logs"""
+    return make_url(uri).render_as_string(hide_password=True)
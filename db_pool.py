@@ -0,0 +1,128 @@
+"""Instrumented connection pool.
+
+``InstrumentedQueuePool`` is a drop-in ``QueuePool`` (set as the engine's
+``poolclass``) that records, for every checkout, how long the caller waited
+for a connection and how many connections were checked out and in overflow at
+that moment. The histograms, plus connect/invalidate/timeout counters, are
+served by ``/manager/api/metrics`` under ``pool``.
+"""
+import bisect
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+# Bucket upper bounds: wait times in milliseconds, connection counts as-is
+WAIT_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+class Histogram:
+    """Counts of observations per bucket (the last bucket is everything above the bounds)"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        # Caller holds the owning PoolMetrics lock
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (None if above all bounds)"""
+        if not self.total:
+            return 0
+        rank = q * self.total
+        seen = 0
+        for bound, count in zip(self.bounds + (None,), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        labels = [f'<={bound}' for bound in self.bounds] + [f'>{self.bounds[-1]}']
+        return {
+            # A list, not a dict: jsonify sorts keys, which would scramble the bucket order
+            'buckets': [[label, count] for label, count in zip(labels, self.counts)],
+            'count': self.total,
+            'mean': round(self.sum / self.total, 3) if self.total else 0,
+            'max': round(self.max, 3),
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+class PoolMetrics:
+    """Histograms and counters for one engine's pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wait_ms = Histogram(WAIT_BUCKETS_MS)
+        self.checked_out = Histogram(COUNT_BUCKETS)
+        self.overflow = Histogram(COUNT_BUCKETS)
+        self.counters = {'checkouts': 0, 'timeouts': 0, 'connects': 0, 'invalidations': 0}
+
+    def record_checkout(self, wait, checked_out, overflow):
+        with self._lock:
+            self.counters['checkouts'] += 1
+            self.wait_ms.observe(wait * 1000)
+            self.checked_out.observe(checked_out)
+            self.overflow.observe(max(0, overflow))
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'wait_ms': self.wait_ms.snapshot(),
+                'checked_out': self.checked_out.snapshot(),
+                'overflow': self.overflow.snapshot(),
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records checkout wait time and occupancy in ``self.metrics``"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+        # A recreated pool inherits the listeners along with the event dispatch
+        if '_dispatch' not in kwargs:
+            event.listen(self, 'connect', lambda *a: self.metrics.count('connects'))
+            event.listen(self, 'invalidate', lambda *a: self.metrics.count('invalidations'))
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            self.metrics.count('timeouts')
+            raise
+        self.metrics.record_checkout(time.perf_counter() - started, self.checkedout(), self.overflow())
+        return connection
+
+    def recreate(self):
+        # dispose() swaps in a new pool; keep the history
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+def pool_stats(engine):
+    """Current occupancy plus recorded histograms for ``engine``'s pool"""
+    pool = engine.pool
+    stats = {'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                     overflow=max(0, pool.overflow()))
+    metrics = getattr(pool, 'metrics', None)
+    if metrics is not None:
+        stats.update(metrics.snapshot())
+    return stats
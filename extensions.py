@@ -9,8 +9,9 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-# Initialize SQLAlchemy
-db = SQLAlchemy()
+# Initialize SQLAlchemy; the session class routes @read_only reads to replicas (see replicas.py)
+from replicas import RoutingSession
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Initialize Login Manager
 login_manager = LoginManager()
@@ -22,9 +23,13 @@ bcrypt = Bcrypt()
 # Initialize rate limiter
 storage_uri = os.environ.get('REDIS_URL', 'memory://')
 
+# Registers the 'leased-fixed-window' strategy (see rate_limit.py)
+import rate_limit
+
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
     storage_uri=storage_uri,
-    strategy="fixed-window",  # can be 'fixed-window', 'fixed-window-elastic-expiry', 'moving-window'
+    # can be 'leased-fixed-window', 'fixed-window', 'moving-window', 'sliding-window-counter'
+    strategy=os.environ.get('RATELIMIT_STRATEGY', 'leased-fixed-window'),
 ) 
\ No newline at end of file
@@ -1,9 +1,15 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, FloatField, RadioField, SelectField, HiddenField
+from wtforms import StringField, PasswordField, SubmitField, FloatField, RadioField, SelectField, HiddenField, TextAreaField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, NumberRange, Optional, Length, Regexp
 from models import User
+import psgc_api
 import re
 
+def whole_centavos(form, field):
+    """Reject amounts with a fraction of a centavo, which the ledger cannot hold"""
+    if field.data is not None and round(field.data, 2) != field.data:
+        raise ValidationError('Amount cannot have more than two decimal places.')
+
 def validate_password_strength(form, field):
     """
     Validate that the password meets strength requirements:
@@ -80,7 +86,7 @@ class TransferForm(FlaskForm):
                               default='username')
     recipient_username = StringField('Recipient Username', validators=[Optional()])
     recipient_account = StringField('Recipient Account Number', validators=[Optional()])
-    amount = FloatField('Amount', validators=[DataRequired(), NumberRange(min=0.01, message="Amount must be greater than 0")])
+    amount = FloatField('Amount', validators=[DataRequired(), NumberRange(min=0.01, message="Amount must be greater than 0"), whole_centavos])
     pin = PasswordField('6-digit PIN', validators=[
         DataRequired(),
         Regexp(r'^\d{6}$', message="PIN must be exactly 6 digits")
@@ -119,6 +125,43 @@ class TransferForm(FlaskForm):
                 
         return True
 
+class BatchTransferForm(FlaskForm):
+    MAX_PAYMENTS = 1000
+
+    payments = TextAreaField('Payments', validators=[DataRequired()],
+                             description='One payment per line: account_number,amount')
+    pin = PasswordField('6-digit PIN', validators=[
+        DataRequired(),
+        Regexp(r'^\d{6}$', message="PIN must be exactly 6 digits")
+    ])
+    submit = SubmitField('Send Batch')
+
+    def validate_payments(self, payments):
+        """Parse the payment lines into ``self.parsed_payments``"""
+        parsed = []
+        for line_number, line in enumerate(payments.data.splitlines(), start=1):
+            line = line.strip()
+            if not line:
+                continue
+            parts = [part.strip() for part in line.split(',')]
+            if len(parts) != 2 or not parts[0].isdigit():
+                raise ValidationError(f'Line {line_number}: expected "account_number,amount".')
+            try:
+                amount = float(parts[1])
+            except ValueError:
+                raise ValidationError(f'Line {line_number}: "{parts[1]}" is not a valid amount.')
+            if round(amount, 2) != amount:
+                raise ValidationError(f'Line {line_number}: amount cannot have more than two decimal places.')
+            if amount < 0.01:
+                raise ValidationError(f'Line {line_number}: amount must be greater than 0.')
+            parsed.append((parts[0], amount))
+
+        if not parsed:
+            raise ValidationError('Enter at least one payment.')
+        if len(parsed) > self.MAX_PAYMENTS:
+            raise ValidationError(f'A batch can contain at most {self.MAX_PAYMENTS} payments.')
+        self.parsed_payments = parsed
+
 class ResetPasswordRequestForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
     submit = SubmitField('Request Password Reset')
@@ -160,7 +203,7 @@ class ResetPinForm(FlaskForm):
 
 class DepositForm(FlaskForm):
     account_number = StringField('Account Number', validators=[DataRequired()])
-    amount = FloatField('Amount', validators=[DataRequired(), NumberRange(min=0.01, message="Amount must be greater than 0")])
+    amount = FloatField('Amount', validators=[DataRequired(), NumberRange(min=0.01, message="Amount must be greater than 0"), whole_centavos])
     pin = PasswordField('PIN', validators=[DataRequired(), Length(min=6, max=6, message="PIN must be exactly 6 digits")])
     submit = SubmitField('Deposit')
     
@@ -201,11 +244,12 @@ class UserEditForm(FlaskForm):
     city_code = HiddenField('City Code')
     barangay_code = HiddenField('Barangay Code')
     
-    # Display fields
-    region_name = SelectField('Region', choices=[], validators=[Optional()])
-    province_name = SelectField('Province', choices=[], validators=[Optional()])
-    city_name = SelectField('City/Municipality', choices=[], validators=[Optional()])
-    barangay_name = SelectField('Barangay', choices=[], validators=[Optional()])
+    # Display fields; their options are loaded on demand in the browser, so the
+    # selected codes are checked by the validators below instead of against choices
+    region_name = SelectField('Region', choices=[], validators=[Optional()], validate_choice=False)
+    province_name = SelectField('Province', choices=[], validators=[Optional()], validate_choice=False)
+    city_name = SelectField('City/Municipality', choices=[], validators=[Optional()], validate_choice=False)
+    barangay_name = SelectField('Barangay', choices=[], validators=[Optional()], validate_choice=False)
     
     phone = StringField('Phone Number', validators=[Optional()])
     
@@ -227,6 +271,30 @@ class UserEditForm(FlaskForm):
             user = User.query.filter_by(email=email.data).first()
             if user is not None:
                 raise ValidationError('This email is already in use. Please use a different email address.')
+
+    def validate_region_name(self, field):
+        if field.data and psgc_api.get_region_by_code(field.data) is None:
+            raise ValidationError('Please select a valid region.')
+
+    def validate_province_name(self, field):
+        if field.data:
+            province = psgc_api.get_province_by_code(field.data)
+            if province is None or province.get('regionCode') != self.region_name.data:
+                raise ValidationError('Please select a province in the selected region.')
+
+    def validate_city_name(self, field):
+        if field.data:
+            place = psgc_api.get_city_or_municipality(field.data)
+            # Cities in regions without provinces (e.g. NCR) only carry a region code
+            if place is None or (place.get('provinceCode') or None) != (self.province_name.data or None) \
+                    or place.get('regionCode', self.region_name.data) != self.region_name.data:
+                raise ValidationError('Please select a city or municipality in the selected province.')
+
+    def validate_barangay_name(self, field):
+        if field.data:
+            barangay = psgc_api.get_barangay_by_code(field.data)
+            if barangay is None or self.city_name.data not in (barangay.get('cityCode'), barangay.get('municipalityCode')):
+                raise ValidationError('Please select a barangay in the selected city or municipality.')
     
     def validate(self, extra_validators=None):
         return super(UserEditForm, self).validate()
@@ -236,6 +304,11 @@ class ConfirmTransferForm(FlaskForm):
     recipient_account = HiddenField('Recipient Account Number')
     amount = HiddenField('Amount')
     transfer_type = HiddenField('Transfer Type')
+    # One key per confirmation page; retries of the same POST reuse it
+    idempotency_key = HiddenField('Idempotency Key', validators=[
+        DataRequired(),
+        Regexp(r'^[0-9a-fA-F-]{36}$', message="Invalid idempotency key")
+    ])
     submit = SubmitField('Confirm Transfer')
 
 class ChangePasswordForm(FlaskForm):
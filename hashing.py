@@ -0,0 +1,234 @@
+"""bcrypt hashing offloaded to a bounded process pool.
+
+Password and PIN hashing is deliberately slow CPU work. Running it on the
+request thread lets a burst of logins or transfers pin every web worker, so
+the service runs it in a pool of worker processes, with a cap on how many
+jobs may be waiting. Every app instance (each gunicorn worker) has its own
+pool, so ``BCRYPT_POOL_SIZE`` defaults to the host's cores divided by
+``WEB_CONCURRENCY``; with N server workers and P processes each, the host
+runs N x P bcrypt processes. When the cap is reached,
+new work is rejected straight away with ``HashingBusy`` (served as a 503)
+instead of queueing behind requests that will time out anyway.
+
+The worker processes are forked by ``start()`` while the app is being
+created, before any other thread exists, so no child inherits a lock held by
+another thread. Workers only import this module and ``bcrypt``. The pool is
+never re-forked later from a threaded process: if it breaks, or if the
+server forks the app into worker processes after creating it (gunicorn
+``--preload``), hashing runs on the calling thread instead, with the same
+queue cap, and a warning is printed. bcrypt releases the GIL, so those
+threads still hash in parallel.
+"""
+import collections
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+# Flask-Bcrypt's default cost
+DEFAULT_LOG_ROUNDS = 12
+
+# Range calibrate() searches; below 10 is too weak for passwords, above 16 too slow for logins
+MIN_LOG_ROUNDS = 10
+MAX_LOG_ROUNDS = 16
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+def _hash(secret, log_rounds):
+    return bcrypt.hashpw(secret.encode('utf-8'), bcrypt.gensalt(log_rounds)).decode('utf-8')
+
+def _check(hashed, secret):
+    return bcrypt.checkpw(secret.encode('utf-8'), hashed.encode('utf-8'))
+
+class HashingService:
+    """Bounded process pool for bcrypt hash/check with latency metrics"""
+
+    def __init__(self, workers=None, max_queue=None, timeout=30, log_rounds=DEFAULT_LOG_ROUNDS):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue if max_queue is not None else self.workers * 8
+        self.timeout = timeout
+        self.log_rounds = log_rounds
+        self._pool = None
+        self._pool_pid = None
+        # Process that has already warned about running without its own pool
+        self._warned_pid = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {'completed': 0, 'rejected': 0, 'errors': 0, 'inline': 0}
+        # Recent latencies in seconds, for the metrics endpoint
+        self._wait_times = collections.deque(maxlen=1024)
+        self._run_times = collections.deque(maxlen=1024)
+
+    def init_app(self, app):
+        self.workers = app.config.get('BCRYPT_POOL_SIZE') or self.workers
+        self.max_queue = app.config.get('HASHING_MAX_QUEUE', self.workers * 8)
+        self.timeout = app.config.get('HASHING_TIMEOUT', self.timeout)
+        self.log_rounds = app.config.get('BCRYPT_LOG_ROUNDS', self.log_rounds)
+        self.start()
+
+    def start(self):
+        """Fork the worker processes now; call before the app starts any thread"""
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                return
+            # fork starts workers without re-importing the app's entry point
+            method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+            pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+            # With fork, the first job launches every worker at once
+            pool.submit(int).result()
+            self._pool = pool
+            self._pool_pid = os.getpid()
+
+    def hash(self, secret):
+        """bcrypt hash of ``secret`` at the configured cost"""
+        return self._run(_hash, secret, self.log_rounds)
+
+    def check(self, hashed, secret):
+        """True if ``secret`` matches ``hashed``"""
+        if not hashed:
+            return False
+        return self._run(_check, hashed, secret)
+
+    def needs_rehash(self, hashed):
+        """True if ``hashed`` was made at a different cost than the configured one"""
+        return cost_of(hashed) != self.log_rounds
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._counters['rejected'] += 1
+                raise HashingBusy('Hashing queue is full')
+            self._in_flight += 1
+            pool = self._get_pool()
+
+        submitted = time.monotonic()
+        if pool is None:
+            try:
+                return self._finish(*_timed(fn, *args), submitted, inline=True)
+            except Exception:
+                self._count_error()
+                raise
+            finally:
+                self._release()
+
+        try:
+            future = pool.submit(_timed, fn, *args)
+        except BaseException as e:
+            self._release()
+            self._count_error(pool if isinstance(e, BrokenProcessPool) else None)
+            raise
+        # A job that outlives its caller still holds its slot until a worker finishes it
+        future.add_done_callback(self._release)
+        try:
+            result, run_time = future.result(self.timeout)
+        except TimeoutError:
+            # Drop the job if no worker has picked it up yet
+            future.cancel()
+            self._count_error()
+            raise
+        except BrokenProcessPool:
+            self._count_error(pool)
+            raise
+        except Exception:
+            self._count_error()
+            raise
+        return self._finish(result, run_time, submitted)
+
+    def _finish(self, result, run_time, submitted, inline=False):
+        total = time.monotonic() - submitted
+        with self._lock:
+            self._counters['completed'] += 1
+            if inline:
+                self._counters['inline'] += 1
+            self._run_times.append(run_time)
+            self._wait_times.append(max(0.0, total - run_time))
+        return result
+
+    def _release(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _count_error(self, broken_pool=None):
+        with self._lock:
+            self._counters['errors'] += 1
+            # A worker died; later callers hash on their own thread
+            if broken_pool is not None and broken_pool is self._pool:
+                print("hashing: worker pool broke; hashing on request threads from now on")
+                self._pool = None
+
+    def _get_pool(self):
+        # Caller holds _lock. None means hash on the calling thread: a pool
+        # inherited through fork() belongs to the parent, and replacing it
+        # would mean forking a process that is running other threads.
+        pid = os.getpid()
+        if self._pool is not None and self._pool_pid == pid:
+            return self._pool
+        if self._pool is not None and self._warned_pid != pid:
+            self._warned_pid = pid
+            print(f"WARNING: hashing: worker pool was created in process {self._pool_pid}, which forked this one "
+                  f"(gunicorn --preload?); process {pid} hashes on request threads")
+        return None
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """Queue depth, rejection counts and latency percentiles in milliseconds"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['workers'] = self.workers
+            stats['in_flight'] = self._in_flight
+            stats['queue_depth'] = max(0, self._in_flight - self.workers)
+            stats['max_queue'] = self.max_queue
+            stats['log_rounds'] = self.log_rounds
+            stats['hash_ms'] = _percentiles(self._run_times)
+            stats['queue_wait_ms'] = _percentiles(self._wait_times)
+        return stats
+
+def cost_of(hashed):
+    """Work factor of a bcrypt hash such as ``$2b$12$...``; None if unrecognised"""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def calibrate(target_ms, min_rounds=MIN_LOG_ROUNDS, max_rounds=MAX_LOG_ROUNDS, samples=3):
+    """Time bcrypt on this host and pick the highest cost whose hash fits in ``target_ms``.
+
+    Returns ``(log_rounds, timings)`` where ``timings`` maps each cost tried to
+    its median time in milliseconds. Never returns less than ``min_rounds``.
+    """
+    timings = {}
+    chosen = min_rounds
+    for log_rounds in range(min_rounds, max_rounds + 1):
+        runs = sorted(_timed(_hash, 'calibration-secret', log_rounds)[1] for _ in range(samples))
+        timings[log_rounds] = round(runs[len(runs) // 2] * 1000, 1)
+        if timings[log_rounds] > target_ms:
+            break
+        chosen = log_rounds
+    return chosen, timings
+
+def _timed(fn, *args):
+    started = time.monotonic()
+    result = fn(*args)
+    return result, time.monotonic() - started
+
+def _percentiles(samples):
+    if not samples:
+        return {'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    ordered = sorted(samples)
+    return {
+        'p50': round(ordered[len(ordered) // 2] * 1000, 2),
+        'p95': round(ordered[int(len(ordered) * 0.95)] * 1000, 2),
+        'max': round(ordered[-1] * 1000, 2),
+    }
+
+# Shared service instance
+hashing_service = HashingService()
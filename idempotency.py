@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# How long a finished request is remembered (retries after this are new requests)
+DEFAULT_TTL = 24 * 60 * 60
+# How long a request may stay "pending" before a retry is allowed to run it again
+PENDING_TTL = 5 * 60
+
+PENDING = 'pending'
+DONE = 'done'
+
+class MemoryIdempotencyStore:
+    """In-process idempotency store with TTL eviction.
+
+    Only safe when every retry reaches the same worker process; use the Redis
+    store when running more than one worker.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, pending_ttl=PENDING_TTL):
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + 60
+
+    def begin(self, key):
+        """Claim ``key``. Returns None if the caller should do the work,
+        otherwise the stored record of the earlier request."""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+            self._entries[key] = (now + self.pending_ttl, {'state': PENDING})
+            return None
+
+    def complete(self, key, result):
+        """Store the final result for ``key``"""
+        record = dict(result, state=DONE)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, record)
+
+    def release(self, key):
+        """Forget a claimed key so the request can be retried (used on errors)"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _sweep(self, now):
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        self._next_sweep = now + 60
+
+class RedisIdempotencyStore:
+    """Idempotency store shared by all workers through Redis (SET NX EX)"""
+
+    def __init__(self, url, ttl=DEFAULT_TTL, pending_ttl=PENDING_TTL, prefix='idempotency:'):
+        import redis  # Optional dependency, only needed when REDIS_URL is set
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.prefix = prefix
+
+    def begin(self, key):
+        name = self.prefix + key
+        if self.client.set(name, json.dumps({'state': PENDING}), nx=True, ex=self.pending_ttl):
+            return None
+        stored = self.client.get(name)
+        if stored is None:
+            # Expired between SET and GET; try once more
+            return self.begin(key)
+        return json.loads(stored)
+
+    def complete(self, key, result):
+        self.client.set(self.prefix + key, json.dumps(dict(result, state=DONE)), ex=self.ttl)
+
+    def release(self, key):
+        self.client.delete(self.prefix + key)
+
+def create_store(url=None):
+    """Pick the Redis store for redis:// URLs, otherwise the in-process store"""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisIdempotencyStore(url)
+    return MemoryIdempotencyStore()
+
+# Shared store, backed by the same REDIS_URL as the rate limiter
+idempotency_store = create_store(os.environ.get('REDIS_URL'))
@@ -0,0 +1,229 @@
+"""Cached identity loader for Flask-Login.
+
+``load_user`` runs on every request, but almost all requests only need the
+handful of fields used for authorization and session checks. The cache keeps
+an immutable snapshot of those fields per user id for ``IDENTITY_CACHE_TTL``
+seconds and hands out a ``CachedUser`` proxy built from it; the full ORM row
+is loaded only when a request touches anything else (or writes).
+
+Entries are invalidated whenever a commit changes one of the snapshot fields
+(login, logout, force logout, activation, role changes, edits), through an
+invalidation bus: the Redis bus broadcasts to every worker via pub/sub, the
+local bus only reaches the current process. The TTL bounds staleness if a
+message is missed.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from extensions import db
+from models import User
+
+# Load environment variables
+load_dotenv()
+
+# Credential hashes stay out of the cache: check_pin/check_password load the user row
+IdentitySnapshot = namedtuple('IdentitySnapshot', [
+    'id', 'username', 'account_number', 'status', 'is_admin', 'is_manager',
+    'current_session_id', 'force_password_change', 'has_pin'
+])
+
+# Columns whose changes invalidate a snapshot (has_pin is derived from pin_hash)
+SNAPSHOT_COLUMNS = tuple(field for field in IdentitySnapshot._fields if field != 'has_pin') + ('pin_hash',)
+
+class CachedUser(UserMixin):
+    """``current_user`` served from a snapshot, loading the ORM user on demand.
+
+    Snapshot fields are answered from the cache until the ORM user has been
+    loaded; after that, and for every other attribute, method or assignment,
+    the proxy forwards to the ORM user.
+    """
+
+    def __init__(self, snapshot, user=None):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_user', user)
+
+    # User methods that only read snapshot fields run on the proxy itself
+    is_session_valid = User.is_session_valid
+    update_activity = User.update_activity
+
+    @property
+    def is_active(self):
+        return self.status == 'active'
+
+    def get_id(self):
+        return str(self._snapshot.id)
+
+    def __getattr__(self, name):
+        if self._user is None and name in IdentitySnapshot._fields:
+            return getattr(self._snapshot, name)
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def _load(self):
+        if self._user is None:
+            object.__setattr__(self, '_user', db.session.get(User, self._snapshot.id))
+        return self._user
+
+    def __repr__(self):
+        return f'<CachedUser {self._snapshot.username}>'
+
+class LocalInvalidationBus:
+    """Delivers invalidations inside this process only"""
+
+    def __init__(self):
+        self._handlers = []
+
+    def subscribe(self, handler):
+        self._handlers.append(handler)
+
+    def publish(self, user_id):
+        for handler in self._handlers:
+            handler(user_id)
+
+class RedisInvalidationBus:
+    """Broadcasts invalidations to every worker over a Redis pub/sub channel"""
+
+    def __init__(self, url, channel='identity:invalidate'):
+        import redis  # Optional dependency, only needed when REDIS_URL is set
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self._handlers = []
+        self._thread = None
+
+    def subscribe(self, handler):
+        self._handlers.append(handler)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name='identity-invalidation', daemon=True)
+            self._thread.start()
+
+    def publish(self, user_id):
+        # Evict locally straight away rather than waiting for our own message
+        self._deliver(user_id)
+        try:
+            self.client.publish(self.channel, str(user_id))
+        except Exception as e:
+            # Other workers fall back to the TTL
+            print(f"identity-invalidation: publish failed: {e}")
+
+    def _deliver(self, user_id):
+        for handler in self._handlers:
+            handler(user_id)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Messages may have been missed while disconnected
+                self._deliver(None)
+                for message in pubsub.listen():
+                    self._deliver(int(message['data']))
+            except Exception as e:
+                print(f"identity-invalidation: {e}")
+                time.sleep(1)
+
+def create_bus(url=None):
+    """Pick the Redis bus for redis:// URLs, otherwise the in-process bus"""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisInvalidationBus(url)
+    return LocalInvalidationBus()
+
+class IdentityCache:
+    """TTL cache of ``IdentitySnapshot``s keyed by user id"""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.bus = None
+        self._entries = {}
+        # Bumped on every eviction so a load racing with an invalidation is not cached
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self._listening = False
+
+    def init_app(self, app, bus=None):
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', self.ttl)
+        self.bus = bus or create_bus(os.environ.get('REDIS_URL'))
+        self.bus.subscribe(self._evict)
+        if not self._listening:
+            event.listen(User, 'after_update', self._on_user_write)
+            event.listen(User, 'after_delete', self._on_user_delete)
+            event.listen(Session, 'after_commit', self._on_commit)
+            event.listen(Session, 'after_rollback', self._on_rollback)
+            self._listening = True
+
+    def load(self, user_id):
+        """Return a ``CachedUser`` for ``user_id``, or None if there is no such user"""
+        if not self.ttl or self.ttl <= 0:
+            return db.session.get(User, user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._counters['hits'] += 1
+                return CachedUser(entry[1])
+            self._counters['misses'] += 1
+            generation = (self._epoch, self._generations.get(user_id, 0))
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = IdentitySnapshot(*(getattr(user, field) for field in IdentitySnapshot._fields))
+        with self._lock:
+            if (self._epoch, self._generations.get(user_id, 0)) == generation:
+                self._entries[user_id] = (now + self.ttl, snapshot)
+        return CachedUser(snapshot, user)
+
+    def invalidate(self, user_id):
+        """Drop ``user_id`` from the cache in every worker"""
+        if self.bus is not None:
+            self.bus.publish(user_id)
+        else:
+            self._evict(user_id)
+
+    def _evict(self, user_id):
+        # user_id None means "everything" (e.g. after a pub/sub reconnect)
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                self._epoch += 1
+            else:
+                self._entries.pop(user_id, None)
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._counters['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        return stats
+
+    # Changes are collected per session and published once they commit
+
+    def _on_user_write(self, mapper, connection, target):
+        state = db.inspect(target)
+        if any(getattr(state.attrs, column).history.has_changes() for column in SNAPSHOT_COLUMNS):
+            self._on_user_delete(mapper, connection, target)
+
+    def _on_user_delete(self, mapper, connection, target):
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault('identity_invalidations', set()).add(target.id)
+
+    def _on_commit(self, session):
+        for user_id in session.info.pop('identity_invalidations', ()):
+            self.invalidate(user_id)
+
+    def _on_rollback(self, session):
+        session.info.pop('identity_invalidations', None)
+
+# Shared cache instance
+identity_cache = IdentityCache()
@@ -5,22 +5,22 @@ import subprocess
 from werkzeug.security import generate_password_hash
 import datetime
 import psgc_api
+from sqlalchemy.engine import make_url
+from db_backend import database_uri, backend_name, display_uri
 import traceback  # For detailed error tracing
 
 # Load environment variables
 load_dotenv()
 
-def init_mysql_database():
+def init_mysql_database(uri):
     """Initialize the MySQL database directly in Python instead of using schema.sql."""
-    # Use defaults to avoid None values
-    mysql_user = os.environ.get('MYSQL_USER')
-    mysql_password = os.environ.get('MYSQL_PASSWORD')
-    mysql_host = os.environ.get('MYSQL_HOST')
-    mysql_port = os.environ.get('MYSQL_PORT')
-    mysql_database = os.environ.get('MYSQL_DATABASE')
-    
-    # Convert port to string to avoid type issues
-    mysql_port = str(mysql_port)
+    # Connection details come from the same URI the app uses (DATABASE_URL or MYSQL_*)
+    url = make_url(uri)
+    mysql_user = url.username
+    mysql_password = url.password
+    mysql_host = url.host
+    mysql_port = str(url.port or 3306)
+    mysql_database = url.database
     
     # Try to connect to MySQL server without database (to create it if needed)
     try:
@@ -100,7 +100,11 @@ def init_mysql_database():
                   FOREIGN KEY (receiver_id) REFERENCES user (id),
                   INDEX idx_sender (sender_id),
                   INDEX idx_receiver (receiver_id),
-                  INDEX idx_timestamp (timestamp)
+                  INDEX idx_timestamp (timestamp),
+                  INDEX idx_sender_timestamp (sender_id, timestamp),
+                  INDEX idx_receiver_timestamp (receiver_id, timestamp),
+                  INDEX idx_type_timestamp (transaction_type, timestamp),
+                  INDEX idx_amount (amount)
                 ) ENGINE=InnoDB
                 """)
                 
@@ -376,8 +380,14 @@ def init_flask_app_db():
 
 if __name__ == "__main__":
     print("== Simple Banking App Database Initialization ==")
-    print("\nStep 1: Initializing MySQL database schema directly...")
-    mysql_success = init_mysql_database()
+    db_uri = database_uri()
+    if backend_name(db_uri) == 'mysql':
+        print("\nStep 1: Initializing MySQL database schema directly...")
+        mysql_success = init_mysql_database(db_uri)
+    else:
+        # Other backends (e.g. SQLite) get their schema from the models in step 2
+        print(f"\nStep 1: Skipped for {display_uri(db_uri)} (not MySQL)")
+        mysql_success = True
     
     if mysql_success:
         print("\nStep 2: Initializing Flask application database...")
@@ -0,0 +1,306 @@
+"""Append-only double-entry ledger.
+
+Every money movement is written as ledger entries in integer centavos: a
+negative (debit) leg and a positive (credit) leg that sum to zero per
+transaction. Entries are never updated or deleted. An account's balance is
+its ``BalanceCheckpoint`` plus the entries posted after the checkpoint, and
+the checkpoint writer folds new entries into the checkpoint periodically so
+that tail stays short.
+
+Locking rules (all taken on ``balance_checkpoint`` rows, never on ``user``):
+  * debits take an exclusive lock on the payer's checkpoint, so two debits of
+    the same account cannot both pass the balance check;
+  * credits take a shared lock, so any number of credits to one account can
+    run concurrently;
+  * folding a checkpoint takes an exclusive lock, so it waits for in-flight
+    credits and never skips an entry that commits late.
+
+Hot accounts (``User.balance_stripes > 0``) also have ``BalanceStripe`` rows:
+extra checkpoints ("lanes") numbered from 1, each with its own tail of
+entries marked with that ``stripe``. A credit to such an account takes the
+shared lock on a random stripe instead of the checkpoint, so a stream of
+credits never waits for the account's debits or checkpoint folds. Debits
+always post on lane 0 (the checkpoint). Stripes only ever grow between
+folds, so a debit holding the checkpoint lock may read them unlocked: a
+credit it misses can only make the balance it checks lower than the real
+one. Moving stripe money into the checkpoint (``drain_stripes``) locks the
+checkpoint first and then the stripes.
+"""
+import datetime
+from sqlalchemy import and_, func, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import User, LedgerEntry, BalanceCheckpoint, BalanceStripe
+
+# Entries with no account belong to the bank's cash account (the other leg of deposits)
+CASH_ACCOUNT = None
+
+def to_minor(amount):
+    """Pesos (float) to centavos (int)"""
+    return int(round(amount * 100))
+
+def to_major(minor):
+    """Centavos (int) to pesos (float)"""
+    return minor / 100.0
+
+def round_amount(amount):
+    """Pesos rounded to whole centavos: the amount the ledger actually posts"""
+    return to_major(to_minor(amount))
+
+def lock_accounts(account_ids, exclusive):
+    """Lock the checkpoint rows of ``account_ids`` in ascending id order"""
+    account_ids = sorted({a for a in account_ids if a is not CASH_ACCOUNT})
+    if not account_ids:
+        return
+    ensure_checkpoints(account_ids)
+    checkpoint = BalanceCheckpoint.__table__
+    if exclusive:
+        # A no-op UPDATE takes a row lock on MySQL and the write lock on SQLite
+        db.session.execute(
+            update(checkpoint)
+            .where(checkpoint.c.user_id.in_(account_ids))
+            .values(user_id=checkpoint.c.user_id)
+        )
+    else:
+        db.session.execute(
+            select(checkpoint.c.user_id)
+            .where(checkpoint.c.user_id.in_(account_ids))
+            .order_by(checkpoint.c.user_id)
+            .with_for_update(read=True)
+        )
+
+def ensure_checkpoints(account_ids):
+    """Create opening checkpoints (from the legacy ``user.balance``) where missing"""
+    existing = set(db.session.execute(
+        select(BalanceCheckpoint.user_id).where(BalanceCheckpoint.user_id.in_(account_ids))
+    ).scalars())
+    missing = [a for a in account_ids if a not in existing]
+    if not missing:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(
+                BalanceCheckpoint.__table__.insert().from_select(
+                    ['user_id', 'balance', 'last_entry_id', 'updated_at'],
+                    select(User.id, func.round(User.balance * 100), literal(0), func.now()).where(User.id.in_(missing))
+                )
+            )
+    except IntegrityError:
+        # Another transaction created them first
+        pass
+
+def balance_of(account_id):
+    """Current balance of an account in centavos"""
+    checkpoint = BalanceCheckpoint.__table__
+    row = db.session.execute(
+        select(User.balance, User.balance_stripes, checkpoint.c.balance.label('checkpoint'), checkpoint.c.last_entry_id)
+        .select_from(User.__table__.outerjoin(checkpoint, checkpoint.c.user_id == User.id))
+        .where(User.id == account_id)
+    ).first()
+    if row is None:
+        return 0
+    if row.checkpoint is None:
+        base, last_entry_id = to_minor(row.balance or 0.0), 0
+    else:
+        base, last_entry_id = row.checkpoint, row.last_entry_id
+    delta = db.session.execute(
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+        .where(LedgerEntry.account_id == account_id, LedgerEntry.stripe == 0, LedgerEntry.id > last_entry_id)
+    ).scalar()
+    striped = stripes_balance(account_id) if row.balance_stripes else 0
+    return int(base + delta + striped)
+
+def balances_of(account_ids):
+    """Balances in centavos of many accounts (``{account_id: balance}``), for listings.
+
+    One query reads every checkpoint with its lane-0 tail summed per account,
+    and one more reads the stripes when any of the accounts is striped.
+    """
+    account_ids = sorted(set(account_ids))
+    if not account_ids:
+        return {}
+    checkpoint = BalanceCheckpoint.__table__
+    entry = LedgerEntry.__table__
+    tails = (
+        select(entry.c.account_id, func.sum(entry.c.amount).label('amount'))
+        .select_from(entry.outerjoin(checkpoint, checkpoint.c.user_id == entry.c.account_id))
+        .where(entry.c.account_id.in_(account_ids), entry.c.stripe == 0,
+               entry.c.id > func.coalesce(checkpoint.c.last_entry_id, 0))
+        .group_by(entry.c.account_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(User.id, User.balance, User.balance_stripes, checkpoint.c.balance.label('checkpoint'),
+               func.coalesce(tails.c.amount, 0).label('tail'))
+        .select_from(
+            User.__table__
+            .outerjoin(checkpoint, checkpoint.c.user_id == User.id)
+            .outerjoin(tails, tails.c.account_id == User.id)
+        )
+        .where(User.id.in_(account_ids))
+    ).all()
+    balances = {}
+    for row in rows:
+        base = to_minor(row.balance or 0.0) if row.checkpoint is None else row.checkpoint
+        balances[row.id] = int(base + row.tail)
+    striped = [row.id for row in rows if row.balance_stripes]
+    for account_id, amount in stripes_balances(striped).items():
+        balances[account_id] += amount
+    return balances
+
+def stripes_balance(account_id):
+    """Sum of an account's stripes, including entries not yet folded into them"""
+    return stripes_balances([account_id]).get(account_id, 0)
+
+def stripes_balances(account_ids):
+    """``stripes_balance`` of many accounts in one query (``{account_id: centavos}``)"""
+    if not account_ids:
+        return {}
+    stripe = BalanceStripe.__table__
+    entry = LedgerEntry.__table__
+    rows = db.session.execute(
+        select(stripe.c.user_id, stripe.c.balance, func.coalesce(func.sum(entry.c.amount), 0).label('tail'))
+        .select_from(stripe.outerjoin(entry, and_(
+            entry.c.account_id == stripe.c.user_id,
+            entry.c.stripe == stripe.c.stripe,
+            entry.c.id > stripe.c.last_entry_id
+        )))
+        .where(stripe.c.user_id.in_(account_ids))
+        .group_by(stripe.c.user_id, stripe.c.stripe, stripe.c.balance)
+    ).all()
+    balances = {}
+    for row in rows:
+        balances[row.user_id] = balances.get(row.user_id, 0) + int(row.balance + row.tail)
+    return balances
+
+def lock_stripe(account_id, stripe_number):
+    """Take the shared lock on one stripe of an account; False if it has no such stripe"""
+    stripe = BalanceStripe.__table__
+    return db.session.execute(
+        select(stripe.c.stripe)
+        .where(stripe.c.user_id == account_id, stripe.c.stripe == stripe_number)
+        .with_for_update(read=True)
+    ).first() is not None
+
+def append(entries, stripes=None):
+    """Insert ledger entries given as ``(transaction_id, account_id, amount)`` tuples.
+
+    ``amount`` is in centavos: negative for debits, positive for credits.
+    ``stripes`` maps account ids to the stripe their credits were locked on
+    (see ``lock_stripe``); every other entry posts on lane 0.
+    """
+    stripes = stripes or {}
+    now = datetime.datetime.utcnow()
+    db.session.execute(LedgerEntry.__table__.insert(), [
+        {
+            'transaction_id': transaction_id,
+            'account_id': account_id,
+            'amount': amount,
+            'entry_type': 'debit' if amount < 0 else 'credit',
+            'stripe': stripes.get(account_id, 0) if amount > 0 else 0,
+            'created_at': now
+        }
+        for transaction_id, account_id, amount in entries
+    ])
+
+def accounts_behind_checkpoint(limit=500):
+    """Ids of accounts that have entries newer than their checkpoint"""
+    checkpoint = BalanceCheckpoint.__table__
+    return db.session.execute(
+        select(LedgerEntry.account_id)
+        .select_from(LedgerEntry.__table__.outerjoin(checkpoint, checkpoint.c.user_id == LedgerEntry.account_id))
+        .where(LedgerEntry.account_id.isnot(None), LedgerEntry.stripe == 0,
+               LedgerEntry.id > func.coalesce(checkpoint.c.last_entry_id, 0))
+        .group_by(LedgerEntry.account_id)
+        .limit(limit)
+    ).scalars().all()
+
+def fold_checkpoint(account_id):
+    """Fold an account's new lane-0 entries into its checkpoint and refresh ``user.balance``.
+
+    ``user.balance`` is only a materialized copy for listings and reports; the
+    ledger is the source of truth. Returns True if anything was folded.
+    """
+    lock_accounts([account_id], exclusive=True)
+    checkpoint = db.session.execute(
+        select(BalanceCheckpoint.balance, BalanceCheckpoint.last_entry_id)
+        .where(BalanceCheckpoint.user_id == account_id)
+    ).first()
+    if checkpoint is None:
+        return False
+    delta, last_entry_id = db.session.execute(
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0), func.max(LedgerEntry.id))
+        .where(LedgerEntry.account_id == account_id, LedgerEntry.stripe == 0, LedgerEntry.id > checkpoint.last_entry_id)
+    ).one()
+    if last_entry_id is None:
+        return False
+    db.session.execute(
+        update(BalanceCheckpoint.__table__)
+        .where(BalanceCheckpoint.user_id == account_id)
+        .values(balance=int(checkpoint.balance + delta), last_entry_id=last_entry_id, updated_at=datetime.datetime.utcnow())
+    )
+    materialize(account_id)
+    return True
+
+def fold_stripe(account_id, stripe_number):
+    """Fold the new entries of one stripe into it; True if anything was folded.
+
+    Takes the stripe's exclusive lock only, so credits landing on the
+    account's other stripes carry on meanwhile.
+    """
+    stripe = BalanceStripe.__table__
+    where = (stripe.c.user_id == account_id, stripe.c.stripe == stripe_number)
+    # Same no-op UPDATE as an exclusive checkpoint lock
+    if db.session.execute(update(stripe).where(*where).values(user_id=stripe.c.user_id)).rowcount == 0:
+        return False
+    current = db.session.execute(select(stripe.c.balance, stripe.c.last_entry_id).where(*where)).one()
+    delta, last_entry_id = db.session.execute(
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0), func.max(LedgerEntry.id))
+        .where(LedgerEntry.account_id == account_id, LedgerEntry.stripe == stripe_number,
+               LedgerEntry.id > current.last_entry_id)
+    ).one()
+    if last_entry_id is None:
+        return False
+    db.session.execute(
+        update(stripe).where(*where)
+        .values(balance=int(current.balance + delta), last_entry_id=last_entry_id, updated_at=datetime.datetime.utcnow())
+    )
+    return True
+
+def add_stripes(account_id, count):
+    """Give an account ``count`` empty stripes (it must have none)"""
+    lock_accounts([account_id], exclusive=True)
+    # Entries left over from earlier stripes were drained into the checkpoint
+    last_entry_id = db.session.execute(
+        select(func.coalesce(func.max(LedgerEntry.id), 0)).where(LedgerEntry.account_id == account_id)
+    ).scalar()
+    now = datetime.datetime.utcnow()
+    db.session.execute(BalanceStripe.__table__.insert(), [
+        {'user_id': account_id, 'stripe': number, 'balance': 0, 'last_entry_id': last_entry_id, 'updated_at': now}
+        for number in range(1, count + 1)
+    ])
+    db.session.execute(update(User.__table__).where(User.id == account_id).values(balance_stripes=count))
+    return True
+
+def drain_stripes(account_id):
+    """Move everything in an account's stripes into its checkpoint and remove them"""
+    lock_accounts([account_id], exclusive=True)
+    stripe = BalanceStripe.__table__
+    db.session.execute(update(stripe).where(stripe.c.user_id == account_id).values(user_id=stripe.c.user_id))
+    total = stripes_balance(account_id)
+    db.session.execute(stripe.delete().where(stripe.c.user_id == account_id))
+    # Lane 0 ignores stripe entries, so the checkpoint takes them over as a lump sum
+    db.session.execute(
+        update(BalanceCheckpoint.__table__)
+        .where(BalanceCheckpoint.user_id == account_id)
+        .values(balance=BalanceCheckpoint.balance + total, updated_at=datetime.datetime.utcnow())
+    )
+    db.session.execute(update(User.__table__).where(User.id == account_id).values(balance_stripes=0))
+    return True
+
+def materialize(account_id):
+    """Copy an account's ledger balance to ``user.balance``; always True"""
+    db.session.execute(
+        update(User.__table__).where(User.id == account_id).values(balance=to_major(balance_of(account_id)))
+    )
+    return True
@@ -1,11 +1,15 @@
-from extensions import db, bcrypt
+from extensions import db
+from hashing import hashing_service
+from session_registry import session_registry
+from replicas import read_only
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import datetime
 import random
 import string
-import uuid
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import set_committed_value
 
 def generate_account_number():
     """Generate a random 10-digit account number"""
@@ -33,7 +37,10 @@ class User(UserMixin, db.Model):
     # Add pin_hash for storing hashed 6-digit PIN
     pin_hash = db.Column(db.String(128), nullable=True)
     account_number = db.Column(db.String(10), unique=True, default=generate_account_number)
+    # Opening balance, then a copy materialized from the ledger by the checkpoint writer.
+    # Read balances through available_balance; never update this column directly.
     balance = db.Column(db.Float, default=1000.0)  # Match schema.sql default of 1000.0
+    balance_stripes = db.Column(db.Integer, default=0)  # >0 spreads credits over BalanceStripe lanes (hot accounts)
     status = db.Column(db.String(20), default='pending')  # 'active', 'deactivated', or 'pending'
     is_admin = db.Column(db.Boolean, default=False)  # Admin status
     is_manager = db.Column(db.Boolean, default=False)  # Manager status (can manage admins)
@@ -46,30 +53,51 @@ class User(UserMixin, db.Model):
     current_session_id = db.Column(db.String(128), nullable=True)  # Current active session
     last_login = db.Column(db.DateTime, nullable=True)  # Last login timestamp
     last_activity = db.Column(db.DateTime, nullable=True)  # Last activity timestamp
+    # When username/account_number last changed, so every worker's search index sees renames
+    identity_updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
     
-    def check_pin(self, pin):
-        """Check the user's 6-digit PIN."""
-        if not self.pin_hash:
-            return False
-        return bcrypt.check_password_hash(self.pin_hash, pin)
-    
+    @validates('username', 'account_number')
+    def stamp_identity_change(self, key, value):
+        self.identity_updated_at = datetime.datetime.utcnow()
+        return value
+
     def set_session(self, session_id):
         """Set the current active session ID"""
         self.current_session_id = session_id
         self.last_login = datetime.datetime.utcnow()
         self.last_activity = datetime.datetime.utcnow()
+        session_registry.after_commit(db.session, 'register', self.id, session_id)
     
     def clear_session(self):
         """Clear the current session"""
+        session_registry.after_commit(db.session, 'revoke', self.id, self.current_session_id)
         self.current_session_id = None
     
     def update_activity(self):
-        """Update last activity timestamp"""
-        self.last_activity = datetime.datetime.utcnow()
+        """Record activity now; written to last_activity by the activity tracker"""
+        from activity import activity_tracker  # Import here to avoid circular imports
+        activity_tracker.touch(self.id)
+    
+    @property
+    def last_seen(self):
+        """Last activity, including activity not yet flushed to the database"""
+        from activity import activity_tracker  # Import here to avoid circular imports
+        return activity_tracker.last_activity(self.id, self.last_activity)
     
     def is_session_valid(self, session_id):
-        """Check if the provided session ID matches the current active session"""
-        return self.current_session_id == session_id
+        """Check if the provided session ID matches the current active session.
+
+        Asks the session registry first. A shared (Redis) registry answers for
+        every worker; the in-process one only knows dead sessions, so otherwise
+        the current_session_id column decides (read fresh, as another worker
+        may have changed it) and the registry is seeded with its answer.
+        """
+        valid = session_registry.validate(self.id, session_id)
+        if valid is not None:
+            return valid
+        current_session_id = db.session.query(User.current_session_id).filter(User.id == self.id).scalar()
+        session_registry.seed(self.id, session_id, current_session_id)
+        return current_session_id == session_id
 
     @property
     def is_active(self):
@@ -95,22 +123,59 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
     
     def set_password(self, password):
-        # Use bcrypt for secure password hashing with salt
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        # Use bcrypt for secure password hashing with salt (runs in the hashing pool)
+        self.password_hash = hashing_service.hash(password)
     
     def check_password(self, password):
         # Use bcrypt to verify password
-        return bcrypt.check_password_hash(self.password_hash, password)
+        if not hashing_service.check(self.password_hash, password):
+            return False
+        # Upgrade hashes made at another cost while we have the plaintext
+        if hashing_service.needs_rehash(self.password_hash):
+            self._store_rehash('password_hash', hashing_service.hash(password))
+        return True
 
     def set_pin(self, pin):
         """Set the user's 6-digit PIN (hashed)."""
-        self.pin_hash = bcrypt.generate_password_hash(pin).decode('utf-8')
+        self.pin_hash = hashing_service.hash(pin)
+
+    @property
+    def has_pin(self):
+        """True once the user has set a PIN"""
+        return bool(self.pin_hash)
 
     def check_pin(self, pin):
-        """Check the user's 6-digit PIN."""
-        if not self.pin_hash:
+        """Check the user's 6-digit PIN (rehashing it if the bcrypt cost has changed)."""
+        if not hashing_service.check(self.pin_hash, pin):
             return False
-        return bcrypt.check_password_hash(self.pin_hash, pin)
+        if hashing_service.needs_rehash(self.pin_hash):
+            self._store_rehash('pin_hash', hashing_service.hash(pin))
+        return True
+
+    def _store_rehash(self, column, new_hash):
+        """Queue an upgraded hash on the caller's transaction.
+
+        ``UPDATE ... WHERE id = ? AND <column> = <old hash>`` runs on the
+        session's own connection without marking the user dirty, so it is
+        committed with the request's next commit (and dropped on rollback) and
+        a password or PIN changed meanwhile is left alone. The upgrade is only
+        an optimisation: if it is lost, the next successful check tries again.
+        """
+        try:
+            # Without autoflush, so the caller's own pending changes are not flushed here
+            with db.session.no_autoflush:
+                updated = db.session.execute(
+                    db.update(User)
+                    .where(User.id == self.id, getattr(User, column) == getattr(self, column))
+                    .values({column: new_hash})
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+        except SQLAlchemyError as e:
+            print(f"Could not store rehashed {column} for user {self.id}: {e}")
+            return
+        if updated:
+            # Match the row without marking the object (and the session) dirty
+            set_committed_value(self, column, new_hash)
     
     @property
     def is_active(self):
@@ -120,51 +185,74 @@ class User(UserMixin, db.Model):
 
     # Then update the transfer_money method
     def transfer_money(self, recipient, amount):
-        # Allow transfers if: 
-        # 1. User has sufficient balance
-        # 2. Amount is positive
-        # 3. User is either active OR an admin OR a manager
-        if self.balance >= amount and amount > 0 and (self.status == 'active' or self.is_admin or self.is_manager):
-            self.balance -= amount
-            recipient.balance += amount
-            transaction = Transaction(
-                transaction_id=f"{uuid.uuid4()}",  # Generate a UUID for the transaction_id
-                sender_id=self.id,
-                receiver_id=recipient.id,
-                amount=amount,
-                transaction_type='transfer',
-                timestamp=datetime.datetime.utcnow()
-            )
-            db.session.add(transaction)
-            return True
+        """Transfer money to recipient through the transfer engine (commits on success)"""
+        from transfer_engine import transfer_engine  # Import here to avoid circular imports
+
+        # Allow transfers if:
+        # 1. Amount is positive
+        # 2. User is either active OR an admin OR a manager
+        # 3. User has sufficient balance (checked atomically by the engine)
+        if amount > 0 and (self.status == 'active' or self.is_admin or self.is_manager):
+            return transfer_engine.transfer(self.id, recipient.id, amount)
         return False
 
     # Also update the deposit method
     def deposit(self, amount, admin_user):
-        """Process an over-the-counter deposit by an admin"""
+        """Process an over-the-counter deposit by an admin (commits on success)"""
+        from transfer_engine import transfer_engine  # Import here to avoid circular imports
+
         if amount <= 0:
             return False
-            
-        # Add amount to user's balance
-        self.balance += amount
-        
-        # Create a transaction record (from admin to user)
-        transaction = Transaction(
-            transaction_id=f"{uuid.uuid4()}",  # Generate a UUID for the transaction_id
-            sender_id=admin_user.id,
-            receiver_id=self.id,
-            amount=amount,
-            transaction_type='deposit',
-            timestamp=datetime.datetime.utcnow()
-        )
-        db.session.add(transaction)
-        return True
+        return transfer_engine.deposit(self.id, amount, admin_user.id)
+
+    @property
+    def available_balance(self):
+        """Current balance from the ledger (checkpoint plus newer entries)"""
+        import ledger  # Import here to avoid circular imports
+        return ledger.to_major(ledger.balance_of(self.id))
+
+    @staticmethod
+    def available_balances(users):
+        """``{user.id: available_balance}`` for a listing, in two queries instead of two per user"""
+        import ledger  # Import here to avoid circular imports
+        return {account_id: ledger.to_major(minor) for account_id, minor in ledger.balances_of(u.id for u in users).items()}
     
+    @read_only
     def get_recent_transactions(self, limit=10):
-        sent = self.transactions_sent.filter(Transaction.transaction_type != 'user_edit').order_by(Transaction.timestamp.desc()).limit(limit).all()
-        received = self.transactions_received.filter(Transaction.transaction_type != 'user_edit').order_by(Transaction.timestamp.desc()).limit(limit).all()
-        all_transactions = sorted(sent + received, key=lambda x: x.timestamp, reverse=True)
-        return all_transactions[:limit]
+        return self.get_transaction_page(limit=limit)[0]
+
+    def get_transaction_page(self, cursor=None, limit=20):
+        """One page of this account's history, newest first.
+
+        Runs a single query: a UNION ALL of the sent and received branches,
+        each served by its (sender_id/receiver_id, timestamp) index and cut
+        off at ``limit + 1`` rows, so a page costs the same no matter how long
+        the history is. ``cursor`` is the opaque string returned for the
+        previous page. Returns ``(transactions, next_cursor)``.
+        """
+        from pagination import decode_cursor, older_than, next_cursor  # Import here to avoid circular imports
+
+        position = decode_cursor(cursor) if cursor else None
+
+        def branch(*criteria):
+            query = db.select(Transaction.id, Transaction.timestamp).where(
+                Transaction.transaction_type != 'user_edit', *criteria
+            )
+            if position:
+                query = query.where(older_than(Transaction.timestamp, Transaction.id, position))
+            return query.order_by(Transaction.timestamp.desc(), Transaction.id.desc()).limit(limit + 1).subquery()
+
+        sent = branch(Transaction.sender_id == self.id)
+        # Skip rows already returned by the sent branch (e.g. an admin depositing to themselves)
+        received = branch(Transaction.receiver_id == self.id,
+                          db.or_(Transaction.sender_id.is_(None), Transaction.sender_id != self.id))
+        both = db.union_all(db.select(sent), db.select(received)).subquery()
+        page = db.select(both.c.id).order_by(both.c.timestamp.desc(), both.c.id.desc()).limit(limit + 1).subquery()
+
+        rows = Transaction.query.join(page, Transaction.id == page.c.id).options(
+            db.joinedload(Transaction.sender), db.joinedload(Transaction.receiver)
+        ).order_by(Transaction.timestamp.desc(), Transaction.id.desc()).all()
+        return next_cursor(rows, limit)
     
     def activate_account(self):
         """Activate a user account"""
@@ -195,6 +283,14 @@ class User(UserMixin, db.Model):
 
 class Transaction(db.Model):
     __tablename__ = 'transaction'
+    __table_args__ = (
+        # Account history pages walk these in (timestamp, id) order
+        db.Index('idx_sender_timestamp', 'sender_id', 'timestamp'),
+        db.Index('idx_receiver_timestamp', 'receiver_id', 'timestamp'),
+        # Manager listings: transfers newest first, and amount search
+        db.Index('idx_type_timestamp', 'transaction_type', 'timestamp'),
+        db.Index('idx_amount', 'amount'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.String(36), unique=True)  # For UUID-like values
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -211,4 +307,81 @@ class Transaction(db.Model):
         return value
 
     def __repr__(self):
-        return f'<Transaction {self.id} - {self.amount}>'
\ No newline at end of file
+        return f'<Transaction {self.id} - {self.amount}>'
+
+class LedgerEntry(db.Model):
+    """One leg of a double-entry posting, in centavos.
+
+    Debits are negative and credits positive; the legs of one transaction sum
+    to zero. Rows are only ever inserted.
+    """
+    __tablename__ = 'ledger_entry'
+    __table_args__ = (db.Index('idx_ledger_account_entry', 'account_id', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.String(36), nullable=False, index=True)  # Transaction.transaction_id
+    account_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # NULL is the bank's cash account
+    amount = db.Column(db.BigInteger, nullable=False)
+    entry_type = db.Column(db.String(6), nullable=False)  # 'debit' or 'credit'
+    stripe = db.Column(db.SmallInteger, nullable=False, default=0)  # BalanceStripe lane; 0 is the checkpoint
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<LedgerEntry {self.id} {self.account_id} {self.amount}>'
+
+class BalanceCheckpoint(db.Model):
+    """Balance of an account (centavos) including every entry up to last_entry_id"""
+    __tablename__ = 'balance_checkpoint'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    balance = db.Column(db.BigInteger, nullable=False, default=0)
+    last_entry_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BalanceCheckpoint {self.user_id} - {self.balance}@{self.last_entry_id}>'
+
+class BalanceStripe(db.Model):
+    """One extra checkpoint lane of a hot account (centavos, up to last_entry_id).
+
+    Credits to an account with ``balance_stripes > 0`` lock a random stripe
+    instead of the account's ``BalanceCheckpoint``, so they do not queue behind
+    the exclusive lock taken by its debits and checkpoint folds. The account's
+    balance is its checkpoint plus all of its stripes.
+    """
+    __tablename__ = 'balance_stripe'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    stripe = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)  # 1..balance_stripes
+    balance = db.Column(db.BigInteger, nullable=False, default=0)
+    last_entry_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BalanceStripe {self.user_id}:{self.stripe} - {self.balance}@{self.last_entry_id}>'
+
+class AuditLog(db.Model):
+    """Security-relevant action, written in batches by the audit writer"""
+    __tablename__ = 'audit_log'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True, index=True)  # Who acted
+    action_type = db.Column(db.String(50), nullable=False, index=True)
+    entity_type = db.Column(db.String(50), nullable=True)  # e.g. 'user'
+    entity_id = db.Column(db.String(36), nullable=True)
+    description = db.Column(db.Text, nullable=False)
+    ip_address = db.Column(db.String(45), nullable=True)
+    user_agent = db.Column(db.String(255), nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<AuditLog {self.action_type} by {self.user_id}>'
+
+class LoginAttempt(db.Model):
+    """One login attempt, successful or not, written in batches by the audit writer"""
+    __tablename__ = 'login_attempt'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True, index=True)  # NULL for unknown usernames
+    ip_address = db.Column(db.String(45), nullable=False, index=True)
+    user_agent = db.Column(db.String(255), nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    success = db.Column(db.Boolean, default=False)
+
+    def __repr__(self):
+        return f'<LoginAttempt {self.ip_address} {"ok" if self.success else "failed"}>'
@@ -0,0 +1,46 @@
+import base64
+import datetime
+from sqlalchemy import and_, or_
+
+def encode_cursor(timestamp, row_id):
+    """Opaque cursor for the position just after ``(timestamp, row_id)``"""
+    raw = f"{timestamp.isoformat()}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Turn a cursor back into ``(timestamp, row_id)``; raises ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|')
+        return datetime.datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+def older_than(timestamp_column, id_column, cursor):
+    """Keyset predicate for rows after ``cursor`` in (timestamp DESC, id DESC) order"""
+    timestamp, row_id = cursor
+    return or_(
+        timestamp_column < timestamp,
+        and_(timestamp_column == timestamp, id_column < row_id)
+    )
+
+def next_cursor(rows, limit):
+    """Trim the look-ahead row and return ``(rows, cursor for the next page or None)``.
+
+    Queries fetch ``limit + 1`` rows; the extra row only tells us whether
+    there is another page.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+def keyset_page(query, timestamp_column, id_column, cursor=None, limit=50):
+    """Apply keyset pagination to an ORM query ordered newest first.
+
+    Returns ``(rows, next_cursor)``; raises ValueError for a malformed cursor.
+    """
+    if cursor:
+        query = query.filter(older_than(timestamp_column, id_column, decode_cursor(cursor)))
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+    return next_cursor(rows, limit)
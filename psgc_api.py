@@ -1,88 +1,96 @@
+import os
 import requests
-import json
-from functools import lru_cache
+import psgc_http
+import psgc_snapshot
+import psgc_store
 
 # Base URL for the API
 BASE_URL = "https://psgc.gitlab.io/api"
 
-@lru_cache(maxsize=32)
+# Pooled client with a persistent response cache, for the live-API fallback and refreshes
+client = psgc_http.CachingClient(BASE_URL)
+
+# Offline data loaded by init_app(): the memory-mapped store, or the snapshot
+# dicts if the store is disabled; when present, no lookup touches the network
+snapshot = None
+
+# Files init_app() was configured with (store path None when the store is disabled)
+_paths = {'snapshot': psgc_snapshot.DEFAULT_PATH, 'store': psgc_store.DEFAULT_PATH}
+
+def init_app(app):
+    """Load the PSGC snapshot; without one, use the live API, or refuse to start if PSGC_ALLOW_LIVE_API is off"""
+    global snapshot
+    client.init_app(app)
+    _paths['snapshot'] = app.config.get('PSGC_SNAPSHOT_PATH') or psgc_snapshot.DEFAULT_PATH
+    _paths['store'] = (app.config.get('PSGC_STORE_PATH') or psgc_store.DEFAULT_PATH) if app.config.get('PSGC_STORE_ENABLED', True) else None
+    if os.path.exists(_paths['snapshot']):
+        snapshot = _open()
+    elif app.config.get('PSGC_ALLOW_LIVE_API'):
+        snapshot = None
+        print(f"WARNING: PSGC snapshot not found at {_paths['snapshot']}; address lookups go to {client.base_url}")
+    else:
+        raise RuntimeError(f"PSGC snapshot not found at {_paths['snapshot']}. Run `flask refresh-psgc` "
+                           "(with PSGC_ALLOW_LIVE_API=1), or set PSGC_ALLOW_LIVE_API=1 to use the live PSGC API")
+
+def _open():
+    if _paths['store'] is None:
+        return psgc_snapshot.PsgcSnapshot.load(_paths['snapshot'])
+    # Rebuilt when the snapshot changes; the rename is atomic, so racing workers are harmless
+    if psgc_store.is_stale(_paths['store'], _paths['snapshot']):
+        psgc_store.build_from_snapshot(_paths['snapshot'], _paths['store'])
+    return psgc_store.PsgcStore(_paths['store'])
+
+def fetch_level(level):
+    """Full list for one PSGC level (e.g. 'barangays'), revalidated with the API"""
+    return client.get_json(level, refresh=True)
+
+def refresh_snapshot(path=None):
+    """Rebuild the snapshot (and store) from the API and switch to it; returns entries per level"""
+    global snapshot
+    if path:
+        _paths['snapshot'] = path
+    counts = psgc_snapshot.build(fetch_level, _paths['snapshot'])
+    snapshot = _open()
+    return counts
+
 def get_regions():
-    """Get all regions from the PSGC API"""
-    url = f"{BASE_URL}/regions"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
-
-@lru_cache(maxsize=32)
+    """Get all regions, sorted by name"""
+    if snapshot is not None:
+        return snapshot.list('regions')
+    return _api_regions()
+
 def get_provinces(region_code=None):
-    """Get provinces from the PSGC API, optionally filtered by region code"""
-    url = f"{BASE_URL}/provinces"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Filter by region if provided
-        if region_code:
-            data = [p for p in data if p.get('regionCode') == region_code]
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
-
-@lru_cache(maxsize=32)
+    """Get provinces, optionally filtered by region code"""
+    if snapshot is not None:
+        return snapshot.list('provinces', 'regionCode' if region_code else None, region_code)
+    return _api_provinces(region_code)
+
 def get_cities(province_code=None):
-    """Get cities from the PSGC API, optionally filtered by province code"""
-    url = f"{BASE_URL}/cities"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Filter by province if provided
-        if province_code:
-            data = [c for c in data if c.get('provinceCode') == province_code]
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
-
-@lru_cache(maxsize=32)
+    """Get cities, optionally filtered by province code"""
+    if snapshot is not None:
+        return snapshot.list('cities', 'provinceCode' if province_code else None, province_code)
+    return _api_cities(province_code)
+
 def get_municipalities(province_code=None):
-    """Get municipalities from the PSGC API, optionally filtered by province code"""
-    url = f"{BASE_URL}/municipalities"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Filter by province if provided
-        if province_code:
-            data = [m for m in data if m.get('provinceCode') == province_code]
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
-
-@lru_cache(maxsize=32)
+    """Get municipalities, optionally filtered by province code"""
+    if snapshot is not None:
+        return snapshot.list('municipalities', 'provinceCode' if province_code else None, province_code)
+    return _api_municipalities(province_code)
+
 def get_barangays(city_code=None, municipality_code=None):
-    """Get barangays from the PSGC API, filtered by city or municipality code"""
-    url = f"{BASE_URL}/barangays"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Filter by city or municipality
+    """Get barangays filtered by city or municipality code"""
+    if snapshot is not None:
         if city_code:
-            data = [b for b in data if b.get('cityCode') == city_code]
-        elif municipality_code:
-            data = [b for b in data if b.get('municipalityCode') == municipality_code]
-        else:
-            return []  # Too many to return without a filter
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
+            return snapshot.list('barangays', 'cityCode', city_code)
+        if municipality_code:
+            return snapshot.list('barangays', 'municipalityCode', municipality_code)
+        return []  # Too many to return without a filter
+    return _api_barangays(city_code, municipality_code)
 
 def get_region_by_code(code):
     """Get a specific region by code"""
+    if snapshot is not None:
+        return snapshot.get('regions', code)
     regions = get_regions()
     for region in regions:
         if region['code'] == code:
@@ -91,6 +99,8 @@ def get_region_by_code(code):
 
 def get_province_by_code(code):
     """Get a specific province by code"""
+    if snapshot is not None:
+        return snapshot.get('provinces', code)
     provinces = get_provinces()
     for province in provinces:
         if province['code'] == code:
@@ -99,6 +109,8 @@ def get_province_by_code(code):
 
 def get_city_by_code(code):
     """Get a specific city by code"""
+    if snapshot is not None:
+        return snapshot.get('cities', code)
     cities = get_cities()
     for city in cities:
         if city['code'] == code:
@@ -107,16 +119,70 @@ def get_city_by_code(code):
 
 def get_municipality_by_code(code):
     """Get a specific municipality by code"""
+    if snapshot is not None:
+        return snapshot.get('municipalities', code)
     municipalities = get_municipalities()
     for municipality in municipalities:
         if municipality['code'] == code:
             return municipality
     return None
 
+def get_city_or_municipality(code):
+    """City or municipality with ``code`` (cities are tried first), or None"""
+    return get_city_by_code(code) or get_municipality_by_code(code)
+
 def get_barangay_by_code(code):
-    """Get a specific barangay by code (requires full search)"""
-    url = f"{BASE_URL}/barangays/{code}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    return None 
\ No newline at end of file
+    """Get a specific barangay by code"""
+    if snapshot is not None:
+        return snapshot.get('barangays', code)
+    try:
+        return client.get_json(f"barangays/{code}")
+    except requests.RequestException:
+        return None
+
+# Live API fallback, used only when no snapshot is installed
+
+def _api_list(level):
+    """Full list for a level through the caching client, or [] if it cannot be fetched"""
+    try:
+        return client.get_json(level)
+    except requests.RequestException as e:
+        print(f"PSGC API request for {level} failed: {e}")
+        return []
+
+def _by_name(data):
+    return sorted(data, key=lambda x: x['name'])
+
+def _api_regions():
+    return _by_name(_api_list('regions'))
+
+def _api_provinces(region_code=None):
+    data = _api_list('provinces')
+    # Filter by region if provided
+    if region_code:
+        data = [p for p in data if p.get('regionCode') == region_code]
+    return _by_name(data)
+
+def _api_cities(province_code=None):
+    data = _api_list('cities')
+    # Filter by province if provided
+    if province_code:
+        data = [c for c in data if c.get('provinceCode') == province_code]
+    return _by_name(data)
+
+def _api_municipalities(province_code=None):
+    data = _api_list('municipalities')
+    # Filter by province if provided
+    if province_code:
+        data = [m for m in data if m.get('provinceCode') == province_code]
+    return _by_name(data)
+
+def _api_barangays(city_code=None, municipality_code=None):
+    # Filter by city or municipality
+    if city_code:
+        data = [b for b in _api_list('barangays') if b.get('cityCode') == city_code]
+    elif municipality_code:
+        data = [b for b in _api_list('barangays') if b.get('municipalityCode') == municipality_code]
+    else:
+        return []  # Too many to return without a filter
+    return _by_name(data)
@@ -0,0 +1,195 @@
+"""Caching HTTP client for the PSGC API.
+
+Responses are cached by URL in memory and on disk, so they survive restarts
+and are shared by every worker on the host. An entry is served as-is for
+``ttl`` seconds; for a further ``stale_ttl`` seconds it is still served
+immediately while one background thread revalidates it (with
+If-None-Match/If-Modified-Since, so an unchanged list costs a 304). Past that
+the caller waits for a fresh copy, and a failed fetch falls back to whatever
+is cached.
+
+Concurrent requests for the same URL share a single upstream fetch, and all
+fetches go through one pooled keep-alive ``requests.Session`` with connect and
+read timeouts.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'psgc_cache')
+
+class SingleFlight:
+    """Runs at most one call per key at a time; other callers wait for its result"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+class CachingClient:
+    """GET-only JSON client with a disk cache, stale-while-revalidate and single-flight"""
+
+    def __init__(self, base_url, cache_dir=DEFAULT_CACHE_DIR, ttl=24 * 3600, stale_ttl=7 * 24 * 3600,
+                 timeout=(3.05, 30), pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.session = _session(pool_size)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._counters = {'fresh': 0, 'stale': 0, 'fetches': 0, 'not_modified': 0, 'errors': 0}
+
+    def init_app(self, app):
+        self.base_url = (app.config.get('PSGC_API_URL') or self.base_url).rstrip('/')
+        self.cache_dir = app.config.get('PSGC_CACHE_DIR') or self.cache_dir
+        self.ttl = app.config.get('PSGC_CACHE_TTL', self.ttl)
+        self.stale_ttl = app.config.get('PSGC_CACHE_STALE_TTL', self.stale_ttl)
+        self.timeout = app.config.get('PSGC_HTTP_TIMEOUT', self.timeout)
+
+    def get_json(self, path, refresh=False):
+        """Decoded JSON for ``base_url/path``.
+
+        ``refresh`` skips the freshness check and always asks the server
+        (conditionally, when there is a cached copy). Raises
+        ``requests.RequestException`` if nothing usable is cached and the fetch fails.
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        entry = self._cached(url)
+        if entry is not None and not refresh:
+            age = time.time() - entry['fetched_at']
+            if age < self.ttl:
+                self._count('fresh')
+                return entry['data']
+            if age < self.ttl + self.stale_ttl:
+                self._count('stale')
+                self._revalidate_in_background(url)
+                return entry['data']
+        try:
+            return self._flight.do(url, lambda: self._fetch(url))['data']
+        except requests.RequestException:
+            self._count('errors')
+            if entry is None:
+                raise
+            return entry['data']
+
+    def _revalidate_in_background(self, url):
+        if self._flight.in_flight(url):
+            return
+        def revalidate():
+            try:
+                self._flight.do(url, lambda: self._fetch(url))
+            except Exception as e:
+                self._count('errors')
+                print(f"psgc-http: revalidating {url} failed: {e}")
+        threading.Thread(target=revalidate, name='psgc-revalidate', daemon=True).start()
+
+    def _fetch(self, url):
+        entry = self._cached(url)
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        self._count('fetches')
+        if response.status_code == 304 and entry is not None:
+            self._count('not_modified')
+            entry = dict(entry, fetched_at=time.time())
+        else:
+            response.raise_for_status()
+            entry = {
+                'url': url,
+                'fetched_at': time.time(),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'data': response.json(),
+            }
+        self._store(url, entry)
+        return entry
+
+    def _cached(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is not None:
+            return entry
+        try:
+            with open(self._path(url), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._entries[url] = entry
+        return entry
+
+    def _store(self, url, entry):
+        with self._lock:
+            self._entries[url] = entry
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(url)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # Still cached in memory for this process
+            print(f"psgc-http: could not write cache for {url}: {e}")
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def clear(self):
+        """Forget cached entries in memory (the disk cache is kept)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        return stats
+
+def _session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Accept'] = 'application/json'
+    return session
@@ -0,0 +1,96 @@
+"""Pre-serialized responses for the PSGC address endpoints.
+
+The province/city/barangay lists behind ``/api/provinces``, ``/api/cities``
+and ``/api/barangays`` (and the ``<option>`` fragments the edit form loads)
+only change when the snapshot is refreshed, so each list is serialized and
+gzipped once per parent code and kept as bytes. Only codes that exist in the
+snapshot are cached; any other parent code gets a 404, so the cache never
+grows past the size of the snapshot.
+
+Responses carry a strong ETag derived from the body and a long private
+``Cache-Control`` (the endpoints need a login, so shared caches must not
+keep them), letting the browser revalidate with a 304 or skip the request
+entirely. The cache is dropped whenever the snapshot version changes;
+without a snapshot (live API fallback) bodies are built per request but
+still get ETags.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import namedtuple
+from flask import Response, abort, request
+import psgc_api
+
+# Snapshot levels a parent code may belong to, for each list level
+PARENT_LEVELS = {
+    'provinces': ('regions',),
+    'cities': ('provinces',),
+    'barangays': ('cities', 'municipalities'),
+}
+
+CachedBody = namedtuple('CachedBody', ['body', 'gzipped', 'etag', 'mimetype'])
+
+class ResponseCache:
+    """Response bodies (plain and gzipped) keyed by format, level and parent code"""
+
+    def __init__(self, max_age=24 * 3600):
+        self.max_age = max_age
+        self._entries = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_age = app.config.get('PSGC_RESPONSE_MAX_AGE', self.max_age)
+
+    def respond(self, level, parent_code, build):
+        """JSON list of ``level`` entries under ``parent_code``; ``build()`` makes the payload on the first request"""
+        return self._respond(level, parent_code, 'application/json', lambda: json.dumps(
+            build(), separators=(',', ':'), ensure_ascii=False
+        ))
+
+    def respond_html(self, level, parent_code, build):
+        """HTML fragment for ``level`` entries under ``parent_code``; ``build()`` returns the markup"""
+        return self._respond(level, parent_code, 'text/html', build)
+
+    def _respond(self, level, parent_code, mimetype, render):
+        snapshot = psgc_api.snapshot
+        version = snapshot.version if snapshot is not None else None
+        if snapshot is not None and not any(snapshot.get(parent, parent_code) for parent in PARENT_LEVELS[level]):
+            abort(404)
+        key = (mimetype, level, parent_code)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = _encode(render().encode('utf-8'), mimetype)
+            if version is not None:
+                with self._lock:
+                    self._entries.setdefault(key, entry)
+        return self._response(entry)
+
+    def _response(self, entry):
+        if request.accept_encodings['gzip'] > 0:
+            response = Response(entry.gzipped, mimetype=entry.mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+            # Each encoding is a different representation, so it gets its own strong ETag
+            response.set_etag(f'{entry.etag}-gzip')
+        else:
+            response = Response(entry.body, mimetype=entry.mimetype)
+            response.set_etag(entry.etag)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.private = True
+        response.cache_control.max_age = int(self.max_age)
+        return response.make_conditional(request)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def _encode(body, mimetype):
+    return CachedBody(body, gzip.compress(body, 9, mtime=0), hashlib.sha256(body).hexdigest()[:32], mimetype)
+
+# Shared cache instance
+psgc_responses = ResponseCache()
@@ -0,0 +1,82 @@
+"""Offline snapshot of the PSGC address hierarchy.
+
+The snapshot is a gzipped JSON file holding the five PSGC levels as fetched
+from the API, trimmed to the fields the app uses. ``PsgcSnapshot`` loads it
+once at startup into dicts keyed by code and by parent code, with each child
+list already sorted by name, so every lookup is a dict access and the request
+path never needs the network.
+
+Build or refresh the file with ``flask refresh-psgc``.
+"""
+import datetime
+import gzip
+import json
+import os
+
+# Fields kept for each level; everything else in the API response is dropped
+FIELDS = ('code', 'name', 'regionCode', 'provinceCode', 'cityCode', 'municipalityCode')
+
+LEVELS = ('regions', 'provinces', 'cities', 'municipalities', 'barangays')
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'psgc_snapshot.json.gz')
+
+class PsgcSnapshot:
+    """Indexed, read-only view of one snapshot file"""
+
+    def __init__(self, data):
+        self.version = data['version']
+        self.by_code = {}
+        self.children = {}
+        for level in LEVELS:
+            entries = sorted(data[level], key=lambda entry: entry['name'])
+            self.by_code[level] = {entry['code']: entry for entry in entries}
+            self.children[level] = {None: entries}
+        # Children lists keyed by the parent field the API filters on
+        self._group('provinces', 'regionCode')
+        self._group('cities', 'provinceCode')
+        self._group('municipalities', 'provinceCode')
+        self._group('barangays', 'cityCode')
+        self._group('barangays', 'municipalityCode')
+
+    def _group(self, level, parent_field):
+        groups = self.children[level]
+        for entry in groups[None]:
+            parent = entry.get(parent_field)
+            if parent:
+                groups.setdefault((parent_field, parent), []).append(entry)
+
+    def get(self, level, code):
+        """Entry with ``code`` at ``level``, or None"""
+        return self.by_code[level].get(code)
+
+    def list(self, level, parent_field=None, parent_code=None):
+        """Entries at ``level`` sorted by name, optionally only those under a parent"""
+        if parent_field is None:
+            return self.children[level][None]
+        return self.children[level].get((parent_field, parent_code), [])
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+def build(fetch, path=DEFAULT_PATH):
+    """Fetch every level with ``fetch(level)`` and write a new snapshot file.
+
+    ``fetch`` returns the API's list for a level (e.g. ``'barangays'``). The file
+    is written next to ``path`` and renamed over it, so readers never see a
+    partial snapshot. Returns the number of entries per level.
+    """
+    data = {'version': datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')}
+    for level in LEVELS:
+        entries = fetch(level)
+        if not entries:
+            raise ValueError(f'PSGC API returned no {level}')
+        data[level] = [{field: entry[field] for field in FIELDS if entry.get(field)} for entry in entries]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return {level: len(data[level]) for level in LEVELS}
@@ -0,0 +1,184 @@
+"""Compact, memory-mapped PSGC store shared by every worker on a host.
+
+Built from the snapshot file (see ``psgc_snapshot``), the store is a single
+binary file that each worker maps read-only, so its pages live once in the OS
+page cache instead of as per-process dicts of Python strings. Layout:
+
+- header: magic, snapshot version and a table of sections
+- ``records:<level>``: fixed-size records sorted by code; ``get()`` binary
+  searches the code column
+- ``group:<level>:<field>``: (parent code, record number) pairs sorted by
+  parent code then name; ``list()`` binary searches the range for a parent
+  and returns it already in name order. ``group:<level>:*`` lists the whole
+  level by name.
+- ``strings``: UTF-8 names referenced by offset from the records
+
+Codes are stored as fixed-width ASCII, NUL padded, so byte order matches the
+order of the codes themselves.
+"""
+import bisect
+import gzip
+import json
+import mmap
+import os
+import struct
+from psgc_snapshot import LEVELS
+
+MAGIC = b'PSGCSTR1'
+
+CODE_WIDTH = 10
+
+PARENT_FIELDS = ('regionCode', 'provinceCode', 'cityCode', 'municipalityCode')
+
+# Parent fields each level is listed by (mirrors psgc_api's filters)
+GROUPS = {
+    'regions': (),
+    'provinces': ('regionCode',),
+    'cities': ('provinceCode',),
+    'municipalities': ('provinceCode',),
+    'barangays': ('cityCode', 'municipalityCode'),
+}
+
+HEADER = struct.Struct('<8s32sI')          # magic, version, number of sections
+SECTION = struct.Struct('<40sQI')          # name, offset, entry count
+RECORD = struct.Struct(f'<{CODE_WIDTH}sIH' + f'{CODE_WIDTH}s' * len(PARENT_FIELDS))
+GROUP_ENTRY = struct.Struct(f'<{CODE_WIDTH}sI')
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'psgc_store.bin')
+
+def _code(code):
+    return (code or '').encode('ascii').ljust(CODE_WIDTH, b'\0')
+
+class _Column:
+    """Sequence view of the code column of a section, for bisect"""
+
+    def __init__(self, buf, offset, stride, count):
+        self.buf = buf
+        self.offset = offset
+        self.stride = stride
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.offset + i * self.stride
+        return self.buf[start:start + CODE_WIDTH]
+
+class PsgcStore:
+    """Read-only view of a store file, with the same lookups as ``PsgcSnapshot``"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a PSGC store')
+        self.version = version.rstrip(b'\0').decode('ascii')
+        self._sections = {}
+        for i in range(count):
+            name, offset, entries = SECTION.unpack_from(self._buf, HEADER.size + i * SECTION.size)
+            self._sections[name.rstrip(b'\0').decode('ascii')] = (offset, entries)
+        self._strings = self._sections['strings'][0]
+
+    def get(self, level, code):
+        """Entry with ``code`` at ``level``, or None"""
+        if not code or len(code) > CODE_WIDTH:
+            return None
+        offset, count = self._sections[f'records:{level}']
+        key = _code(code)
+        i = bisect.bisect_left(_Column(self._buf, offset, RECORD.size, count), key)
+        if i < count and self._buf[offset + i * RECORD.size:offset + i * RECORD.size + CODE_WIDTH] == key:
+            return self._record(offset, i)
+        return None
+
+    def list(self, level, parent_field=None, parent_code=None):
+        """Entries at ``level`` sorted by name, optionally only those under a parent"""
+        section = self._sections.get(f"group:{level}:{parent_field or '*'}")
+        if section is None or (parent_field and (not parent_code or len(parent_code) > CODE_WIDTH)):
+            return []
+        offset, count = section
+        column = _Column(self._buf, offset, GROUP_ENTRY.size, count)
+        key = _code(parent_code if parent_field else None)
+        lo = bisect.bisect_left(column, key)
+        hi = bisect.bisect_right(column, key, lo)
+        records = self._sections[f'records:{level}'][0]
+        return [
+            self._record(records, GROUP_ENTRY.unpack_from(self._buf, offset + i * GROUP_ENTRY.size)[1])
+            for i in range(lo, hi)
+        ]
+
+    def _record(self, offset, i):
+        code, name_offset, name_length, *parents = RECORD.unpack_from(self._buf, offset + i * RECORD.size)
+        start = self._strings + name_offset
+        entry = {
+            'code': code.rstrip(b'\0').decode('ascii'),
+            'name': self._buf[start:start + name_length].decode('utf-8'),
+        }
+        for field, value in zip(PARENT_FIELDS, parents):
+            if value[0]:
+                entry[field] = value.rstrip(b'\0').decode('ascii')
+        return entry
+
+    def close(self):
+        self._buf.close()
+
+def build(data, path=DEFAULT_PATH):
+    """Write a store file from snapshot ``data`` (the decoded snapshot JSON)"""
+    strings = bytearray()
+    sections = []
+    chunks = []
+
+    for level in LEVELS:
+        entries = sorted(data[level], key=lambda entry: _code(entry['code']))
+        for entry in entries:
+            for field in ('code',) + PARENT_FIELDS:
+                if len(entry.get(field) or '') > CODE_WIDTH:
+                    raise ValueError(f"{level} code {entry.get(field)!r} is longer than {CODE_WIDTH} characters")
+        records = bytearray()
+        for entry in entries:
+            name = entry['name'].encode('utf-8')
+            records += RECORD.pack(_code(entry['code']), len(strings), len(name),
+                                   *(_code(entry.get(field)) for field in PARENT_FIELDS))
+            strings += name
+        sections.append((f'records:{level}', len(entries)))
+        chunks.append(records)
+
+        numbered = list(enumerate(entries))
+        for field in ('*',) + GROUPS[level]:
+            if field == '*':
+                members = [(_code(None), entry['name'], i) for i, entry in numbered]
+            else:
+                members = [(_code(entry[field]), entry['name'], i) for i, entry in numbered if entry.get(field)]
+            members.sort()
+            sections.append((f'group:{level}:{field}', len(members)))
+            chunks.append(b''.join(GROUP_ENTRY.pack(parent, i) for parent, _, i in members))
+
+    sections.append(('strings', len(strings)))
+    chunks.append(bytes(strings))
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = bytearray()
+    for (name, count), chunk in zip(sections, chunks):
+        table += SECTION.pack(name.encode('ascii'), offset, count)
+        offset += len(chunk)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, data['version'].encode('ascii'), len(sections)))
+        f.write(table)
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+def build_from_snapshot(snapshot_path, path=DEFAULT_PATH):
+    with gzip.open(snapshot_path, 'rt', encoding='utf-8') as f:
+        build(json.load(f), path)
+
+def is_stale(path, snapshot_path):
+    """True if the store at ``path`` is missing or older than the snapshot file"""
+    try:
+        return os.path.getmtime(path) < os.path.getmtime(snapshot_path)
+    except OSError:
+        return True
@@ -0,0 +1,173 @@
+"""Leased fixed-window rate limiting strategy.
+
+The stock fixed-window strategy increments a counter in the shared store
+(Redis) on every limited request. This strategy instead has each worker take
+a lease of several hits at once with a single increment, then spends the
+lease locally with no network round trip. Leased hits count against the
+global limit as soon as they are taken, so all workers together never admit
+more than the limit; a worker may refuse a little early while another worker
+is holding unspent hits. The sync thread hands idle leases back to the store
+every ``RATELIMIT_SYNC_INTERVAL`` seconds to keep that window short.
+
+Lease size is ``RATELIMIT_LEASE_FRACTION`` of the limit, capped at
+``RATELIMIT_LEASE_MAX``. Small limits such as "10 per minute" get a lease of
+one, which behaves exactly like fixed-window.
+
+Registered with ``limits`` as ``leased-fixed-window``.
+"""
+import threading
+import time
+import weakref
+from limits.strategies import STRATEGIES, RateLimiter
+from limits.util import WindowStats
+from background import PeriodicWorker
+
+# Leases are not returned this close to the end of their window, in case the
+# window expires first and the return would start the next one negative
+RETURN_MARGIN = 1.0
+
+class _Lease:
+    __slots__ = ('window_end', 'tokens', 'last_used', 'recheck_at')
+
+    def __init__(self):
+        self.window_end = 0.0
+        self.tokens = 0
+        self.last_used = 0.0
+        # Set when the store had nothing left; hits are refused locally until then
+        self.recheck_at = 0.0
+
+class LeaseSync(PeriodicWorker):
+    """Lease settings plus the thread that returns idle leases to the store"""
+
+    name = 'rate-limit-sync'
+
+    def __init__(self, interval=1, lease_fraction=0.1, max_lease=50):
+        super().__init__(interval)
+        self.lease_fraction = lease_fraction
+        self.max_lease = max_lease
+        self._limiters = weakref.WeakSet()
+
+    def init_app(self, app, start=True):
+        self.interval = app.config.get('RATELIMIT_SYNC_INTERVAL', self.interval)
+        self.lease_fraction = app.config.get('RATELIMIT_LEASE_FRACTION', self.lease_fraction)
+        self.max_lease = app.config.get('RATELIMIT_LEASE_MAX', self.max_lease)
+        super().init_app(app, start)
+
+    def register(self, limiter):
+        self._limiters.add(limiter)
+
+    def lease_size(self, amount):
+        return max(1, min(self.max_lease, int(amount * self.lease_fraction)))
+
+    def run_once(self):
+        for limiter in list(self._limiters):
+            limiter.sync()
+
+    def stats(self):
+        """Counters summed over every leased limiter in this process"""
+        totals = {}
+        for limiter in list(self._limiters):
+            for name, value in limiter.stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+class LeasedFixedWindowRateLimiter(RateLimiter):
+    """Fixed window whose hits are taken from the store in leases"""
+
+    def __init__(self, storage, sync=None):
+        super().__init__(storage)
+        self.sync_worker = sync or lease_sync
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._counters = {'local_hits': 0, 'store_calls': 0, 'leased': 0, 'returned': 0, 'refused': 0}
+        self.sync_worker.register(self)
+
+    def hit(self, item, *identifiers, cost=1):
+        key = item.key_for(*identifiers)
+        now = time.time()
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease.window_end > now:
+                if lease.tokens >= cost:
+                    lease.tokens -= cost
+                    lease.last_used = now
+                    self._counters['local_hits'] += 1
+                    return True
+                if lease.recheck_at > now:
+                    self._counters['refused'] += 1
+                    return False
+
+        size = max(cost, self.sync_worker.lease_size(item.amount))
+        count = self.storage.incr(key, item.get_expiry(), amount=size)
+        window_end = self.storage.get_expiry(key)
+        granted = max(0, min(size, item.amount - (count - size)))
+        if granted < size:
+            # Give back what the window could not cover so other workers still see it as free
+            self.storage.incr(key, item.get_expiry(), amount=granted - size)
+
+        with self._lock:
+            self._counters['store_calls'] += 1
+            self._counters['leased'] += granted
+            lease = self._leases.get(key)
+            if lease is None or lease.window_end <= now:
+                lease = self._leases[key] = _Lease()
+            lease.window_end = window_end
+            lease.tokens += granted
+            lease.last_used = now
+            if lease.tokens >= cost:
+                lease.tokens -= cost
+                return True
+            lease.recheck_at = min(window_end, now + self.sync_worker.interval)
+            self._counters['refused'] += 1
+            return False
+
+    def test(self, item, *identifiers, cost=1):
+        key = item.key_for(*identifiers)
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease.window_end > time.time() and lease.tokens >= cost:
+                return True
+        return self.storage.get(key) < item.amount - cost + 1
+
+    def get_window_stats(self, item, *identifiers):
+        key = item.key_for(*identifiers)
+        with self._lock:
+            lease = self._leases.get(key)
+            local = lease.tokens if lease is not None and lease.window_end > time.time() else 0
+        remaining = max(0, item.amount - self.storage.get(key)) + local
+        return WindowStats(self.storage.get_expiry(key), remaining)
+
+    def clear(self, item, *identifiers):
+        key = item.key_for(*identifiers)
+        with self._lock:
+            self._leases.pop(key, None)
+        return self.storage.clear(key)
+
+    def sync(self):
+        """Return leases idle for a full sync interval and forget expired windows"""
+        now = time.time()
+        returns = []
+        with self._lock:
+            for key, lease in list(self._leases.items()):
+                if lease.window_end <= now:
+                    del self._leases[key]
+                elif (lease.tokens and now - lease.last_used >= self.sync_worker.interval
+                      and lease.window_end - now > RETURN_MARGIN):
+                    returns.append((key, lease.tokens, lease.window_end - now))
+                    lease.tokens = 0
+        for key, tokens, expiry in returns:
+            self.storage.incr(key, max(1, int(expiry)), amount=-tokens)
+        with self._lock:
+            self._counters['store_calls'] += len(returns)
+            self._counters['returned'] += sum(tokens for _, tokens, _ in returns)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['keys'] = len(self._leases)
+        return stats
+
+# Shared sync worker, started from create_app
+lease_sync = LeaseSync()
+
+STRATEGIES['leased-fixed-window'] = LeasedFixedWindowRateLimiter
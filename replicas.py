@@ -0,0 +1,99 @@
+"""Read replica routing.
+
+Replicas are extra engines in ``SQLALCHEMY_BINDS`` whose keys start with
+``replica_`` (app.py builds them from ``DATABASE_REPLICA_URLS``). Queries run
+inside a function marked ``@read_only`` (the manager/admin listings and
+``User.get_recent_transactions``) go to one of them, picked per call; flushes,
+INSERT/UPDATE/DELETE statements and everything else stay on the primary.
+
+A request that writes pins that user's session to the primary for
+``REPLICA_STICKY_SECONDS``, so the pages they land on after a transfer (or a
+deposit, or an admin edit) read their own writes despite replication lag.
+Read-only functions must not write: a raw ``text()`` UPDATE inside one would
+be sent to the replica.
+"""
+import random
+import threading
+import time
+from functools import wraps
+from flask import g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+
+BIND_PREFIX = 'replica_'
+
+class ReplicaRouter:
+    """Chooses the engine for reads in ``@read_only`` scopes"""
+
+    def __init__(self, sticky_seconds=5):
+        self.sticky_seconds = sticky_seconds
+        self.keys = []
+        self._lock = threading.Lock()
+        self._counters = {'replica_scopes': 0, 'sticky_primary_scopes': 0, 'writes_pinned': 0}
+
+    def init_app(self, app):
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', self.sticky_seconds)
+        self.keys = sorted(key for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith(BIND_PREFIX))
+        if self.keys:
+            app.after_request(self._pin_after_write)
+            print(f"Routing read-only views to {len(self.keys)} replica(s)")
+
+    def choose(self):
+        """Bind key for a new read-only scope, or None to read from the primary"""
+        if not self.keys:
+            return None
+        if has_request_context() and (g.get('db_wrote') or session.get('primary_until', 0) > time.time()):
+            self._count('sticky_primary_scopes')
+            return None
+        self._count('replica_scopes')
+        return random.choice(self.keys)
+
+    def bind_key(self):
+        """Replica for the current scope, if any"""
+        return g.get('replica_key') if has_app_context() else None
+
+    def wrote(self):
+        if has_request_context():
+            g.db_wrote = True
+
+    def _pin_after_write(self, response):
+        if g.get('db_wrote'):
+            session['primary_until'] = time.time() + self.sticky_seconds
+            self._count('writes_pinned')
+        return response
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, replicas=len(self.keys))
+
+class RoutingSession(Session):
+    """``db.session`` class that sends reads in ``@read_only`` scopes to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or getattr(clause, 'is_dml', False):
+                replica_router.wrote()
+            else:
+                key = replica_router.bind_key()
+                if key is not None:
+                    return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def read_only(f):
+    """Run ``f``'s queries on a replica (nested calls share the outer choice)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not has_app_context() or 'replica_key' in g:
+            return f(*args, **kwargs)
+        g.replica_key = replica_router.choose()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.pop('replica_key', None)
+    return decorated_function
+
+# Shared router instance
+replica_router = ReplicaRouter()
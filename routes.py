@@ -1,14 +1,28 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, session
+from flask import render_template, redirect, url_for, flash, request, jsonify, session, Response, stream_with_context, abort
+from markupsafe import escape
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.urls import url_parse
 from app import app, csrf
 from extensions import db, limiter
-from forms import LoginForm, RegistrationForm, TransferForm, ResetPasswordRequestForm, ResetPasswordForm, DepositForm, UserEditForm, ConfirmTransferForm, ChangePasswordForm, SetPinForm, ResetPinForm
+from forms import LoginForm, RegistrationForm, TransferForm, ResetPasswordRequestForm, ResetPasswordForm, DepositForm, UserEditForm, ConfirmTransferForm, ChangePasswordForm, SetPinForm, ResetPinForm, BatchTransferForm
 from models import User, Transaction
+from transfer_engine import transfer_engine
+from idempotency import idempotency_store
+from activity import activity_tracker
+from audit import audit_writer
+from rate_limit import lease_sync
+from psgc_responses import psgc_responses
+from db_pool import pool_stats
+from replicas import read_only, replica_router
+from identity_cache import identity_cache
+from hashing import hashing_service
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired
 import os
 from functools import wraps
 import psgc_api
+import statements
+import transaction_search
+from pagination import keyset_page
 import datetime
 import uuid
 
@@ -43,7 +57,7 @@ def first_login_check(f):
     def decorated_function(*args, **kwargs):
         if current_user.is_authenticated:
             # Check if user needs to set PIN (first time login)
-            if not current_user.pin_hash:
+            if not current_user.has_pin:
                 flash('Please set up your 6-digit PIN before continuing.', 'warning')
                 return redirect(url_for('set_pin'))
             # Check if user needs to change password (admin-created account)
@@ -65,6 +79,10 @@ def send_password_reset_email(user):
 # Session timeout checker
 @app.before_request
 def check_session_timeout():
+    # Static files need neither session checks nor activity tracking
+    if request.path.startswith('/static'):
+        return
+    
     if current_user.is_authenticated:
         # Validate session ID
         user_session_id = session.get('user_session_id')
@@ -78,10 +96,6 @@ def check_session_timeout():
         if current_user.force_password_change and request.endpoint not in ['change_password', 'logout', 'static']:
             return redirect(url_for('change_password'))
         
-        # Skip check for static files
-        if request.path.startswith('/static'):
-            return
-        
         # Check if session is permanent
         if not session.permanent:
             session.permanent = True
@@ -101,10 +115,9 @@ def check_session_timeout():
                 session.clear()
                 return redirect(url_for('login'))
         
-        # Update last activity time in session and database
+        # Update last activity time in session; the tracker writes it to the database in batches
         session['last_active_time'] = now.isoformat()
         current_user.update_activity()
-        db.session.commit()
 
 @app.route('/')
 @app.route('/index')
@@ -133,6 +146,7 @@ def login():
         if user and user.check_password(form.password.data):
             # Check if user already has an active session
             if user.current_session_id:
+                audit_writer.login_attempt(user.id, False)
                 flash('This account is already logged in on another device. Please try again later or contact support if this is an error.', 'warning')
                 return render_template('login.html', title='Sign In', form=form)
             
@@ -148,6 +162,7 @@ def login():
             session.permanent = True
             
             login_user(user, remember=False)
+            audit_writer.login_attempt(user.id, True)
             
             # Check if user needs to change password
             if user.force_password_change:
@@ -155,7 +170,7 @@ def login():
                 return redirect(url_for('change_password'))
             
             # Check if user needs to set PIN
-            if not user.pin_hash:
+            if not user.has_pin:
                 flash('Please set your 6-digit PIN to complete account setup.', 'info')
                 return redirect(url_for('set_pin'))
             
@@ -164,6 +179,7 @@ def login():
                 next_page = url_for('index')
             return redirect(next_page)
         else:
+            audit_writer.login_attempt(user.id if user else None, False)
             flash('Invalid username or password')
     
     return render_template('login.html', title='Sign In', form=form)
@@ -173,7 +189,10 @@ def logout():
     if current_user.is_authenticated:
         # Clear the user's session in the database
         current_user.clear_session()
+        # Built before the commit expires the user, which would cost a reload
+        audit = ('logout', f'{current_user.username} logged out', current_user.id)
         db.session.commit()
+        audit_writer.log(*audit)
     
     logout_user()
     session.clear()
@@ -190,7 +209,10 @@ def register():
         user = User(username=form.username.data, email=form.email.data, status='pending')
         user.set_password(form.password.data)
         db.session.add(user)
+        db.session.flush()
+        audit = ('user_registered', f'{user.username} registered', user.id, 'user', user.id)
         db.session.commit()
+        audit_writer.log(*audit)
         flash('Your account has been registered and is awaiting admin approval.')
         flash('Please set your 6-digit PIN.')
         return redirect(url_for('set_pin', username=user.username))
@@ -200,14 +222,16 @@ def register():
 @login_required
 def set_pin():
     # If user already has a PIN and is not forced to change it, redirect to account
-    if current_user.pin_hash and not request.args.get('reset'):
+    if current_user.has_pin and not request.args.get('reset'):
         flash('You already have a PIN set. Use the reset PIN option to change it.', 'info')
         return redirect(url_for('account'))
     
     form = SetPinForm()
     if form.validate_on_submit():
         current_user.set_pin(form.pin.data)
+        audit = ('pin_set', f'{current_user.username} set their PIN', current_user.id, 'user', current_user.id)
         db.session.commit()
+        audit_writer.log(*audit)
         flash('Your PIN has been set successfully!', 'success')
         
         # If this was a forced PIN setup, redirect to account page
@@ -226,6 +250,75 @@ def account():
     transactions = current_user.get_recent_transactions()
     return render_template('account.html', title='Account', transactions=transactions)
 
+# Page size for account history; the JSON API may ask for fewer or more, up to the cap
+HISTORY_PAGE_SIZE = 20
+HISTORY_PAGE_SIZE_MAX = 100
+
+@app.route('/account/history')
+@login_required
+@first_login_check
+def account_history():
+    cursor = request.args.get('cursor')
+    try:
+        transactions, next_cursor = current_user.get_transaction_page(cursor=cursor, limit=HISTORY_PAGE_SIZE)
+    except ValueError:
+        flash('Invalid page link.')
+        return redirect(url_for('account_history'))
+    return render_template('history.html', title='Transaction History',
+                           transactions=transactions, next_cursor=next_cursor, is_first_page=not cursor)
+
+@app.route('/api/transactions')
+@login_required
+@limiter.limit("60 per minute")
+def api_transactions():
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_PAGE_SIZE_MAX)
+    try:
+        transactions, next_cursor = current_user.get_transaction_page(cursor=request.args.get('cursor'), limit=limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({
+        'items': [{
+            'transaction_id': t.transaction_id,
+            'type': t.transaction_type,
+            'direction': 'sent' if t.sender_id == current_user.id else 'received',
+            'amount': t.amount,
+            'sender': t.sender.account_number if t.sender else None,
+            'receiver': t.receiver.account_number if t.receiver else None,
+            'timestamp': t.timestamp.isoformat()
+        } for t in transactions],
+        'next_cursor': next_cursor
+    })
+
+def _statement_response(user, redirect_endpoint, **redirect_args):
+    """Stream ``user``'s statement for the requested date range and format"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in statements.FORMATS:
+        flash('Unsupported statement format.')
+        return redirect(url_for(redirect_endpoint, **redirect_args))
+    try:
+        start_at, end_before = statements.parse_date_range(request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        flash('Invalid statement date range.')
+        return redirect(url_for(redirect_endpoint, **redirect_args))
+
+    compress = request.accept_encodings['gzip'] > 0
+    response = Response(
+        stream_with_context(statements.export(user.id, fmt, start_at, end_before, compress)),
+        mimetype=statements.FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{statements.filename(user, fmt, start_at, end_before)}"'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@app.route('/account/statement')
+@login_required
+@first_login_check
+@limiter.limit("10 per hour")
+def account_statement():
+    return _statement_response(current_user, 'account_history')
+
 @app.route('/transfer', methods=['GET', 'POST'])
 @login_required
 @limiter.limit("20 per hour")
@@ -269,7 +362,7 @@ def transfer():
             flash('You cannot transfer money to yourself.')
             return redirect(url_for('transfer'))
             
-        if current_user.balance < amount:
+        if current_user.available_balance < amount:
             flash('Insufficient funds for this transfer.')
             return redirect(url_for('transfer'))
         
@@ -283,7 +376,8 @@ def transfer():
             recipient_username=recipient.username,
             recipient_account=recipient.account_number,
             amount=amount,
-            transfer_type=form.transfer_type.data
+            transfer_type=form.transfer_type.data,
+            idempotency_key=str(uuid.uuid4())
         )
         
         # Show confirmation page before completing transfer
@@ -306,7 +400,9 @@ def reset_pin():
         
         # Set new PIN
         current_user.set_pin(form.pin.data)
+        audit = ('pin_reset', f'{current_user.username} reset their PIN', current_user.id, 'user', current_user.id)
         db.session.commit()
+        audit_writer.log(*audit)
         flash('Your PIN has been reset successfully!', 'success')
         return redirect(url_for('account'))
     
@@ -322,34 +418,87 @@ def execute_transfer():
     
     form = ConfirmTransferForm()
     if form.validate_on_submit():
-        amount = float(form.amount.data)
-        
-        # Find recipient based on transfer type
-        recipient = None
-        if form.transfer_type.data == 'username':
-            recipient = User.query.filter_by(username=form.recipient_username.data).first()
-        else:  # account
-            recipient = User.query.filter_by(account_number=form.recipient_account.data).first()
-        
-        if recipient is None:
-            flash('Recipient not found.')
-            return redirect(url_for('transfer'))
-        
-        # Check if recipient account is active
-        if recipient.status != 'active' and not recipient.is_admin and not recipient.is_manager:
-            flash('The recipient account is not active.')
-            return redirect(url_for('transfer'))
-        
-        if current_user.transfer_money(recipient, amount):
-            db.session.commit()
-            flash(f'Successfully transferred ₱{amount:.2f} to {recipient.username}')
-            return redirect(url_for('account'))
-        else:
-            flash('Transfer failed. Please check your balance.')
-            return redirect(url_for('transfer'))
+        # A retried POST with the same key replays the original outcome
+        # without touching the user or transaction tables
+        key = f"transfer:{current_user.id}:{form.idempotency_key.data}"
+        previous = idempotency_store.begin(key)
+        if previous is not None:
+            if previous['state'] == 'pending':
+                flash('This transfer is already being processed.', 'info')
+                return redirect(url_for('account'))
+            flash(previous['message'])
+            return redirect(url_for(previous['endpoint']))
+
+        try:
+            message, endpoint = _execute_transfer(form)
+        except Exception:
+            idempotency_store.release(key)
+            raise
+        idempotency_store.complete(key, {'message': message, 'endpoint': endpoint})
+        flash(message)
+        return redirect(url_for(endpoint))
     
     return redirect(url_for('transfer'))
 
+def _execute_transfer(form):
+    """Run a confirmed transfer; returns (flash message, endpoint to redirect to)"""
+    amount = float(form.amount.data)
+    
+    # Find recipient based on transfer type
+    recipient = None
+    if form.transfer_type.data == 'username':
+        recipient = User.query.filter_by(username=form.recipient_username.data).first()
+    else:  # account
+        recipient = User.query.filter_by(account_number=form.recipient_account.data).first()
+    
+    if recipient is None:
+        return 'Recipient not found.', 'transfer'
+    
+    # Check if recipient account is active
+    if recipient.status != 'active' and not recipient.is_admin and not recipient.is_manager:
+        return 'The recipient account is not active.', 'transfer'
+    
+    if current_user.transfer_money(recipient, amount):
+        return f'Successfully transferred ₱{amount:.2f} to {recipient.username}', 'account'
+    return 'Transfer failed. Please check your balance.', 'transfer'
+
+@app.route('/batch_transfer', methods=['GET', 'POST'])
+@login_required
+@limiter.limit("10 per hour")
+@first_login_check
+def batch_transfer():
+    if current_user.status != 'active' and not current_user.is_admin and not current_user.is_manager:
+        flash('Your account is awaiting approval from an administrator.')
+        return redirect(url_for('index'))
+
+    form = BatchTransferForm()
+    # Shares the PIN attempt counter with single transfers
+    if 'pin_attempts' not in session:
+        session['pin_attempts'] = 0
+
+    if form.validate_on_submit():
+        # The PIN is checked once for the whole batch
+        if not current_user.check_pin(form.pin.data):
+            session['pin_attempts'] += 1
+            form.pin.errors.append("Incorrect PIN.")
+            if session['pin_attempts'] >= 3:
+                flash('You have entered an incorrect PIN 3 times. Please reset your PIN.', 'danger')
+                session['pin_attempts'] = 0
+                return redirect(url_for('reset_pin'))
+            else:
+                flash(f'Incorrect PIN. Attempt {session["pin_attempts"]}/3.', 'warning')
+            return render_template('batch_transfer.html', title='Batch Transfer', form=form)
+        session['pin_attempts'] = 0
+
+        payments = form.parsed_payments
+        ok, result = transfer_engine.transfer_batch(current_user.id, payments)
+        if ok:
+            flash(f'Successfully transferred ₱{result:.2f} to {len(payments)} recipients.')
+            return redirect(url_for('account'))
+        flash(f'Batch transfer failed: {result}')
+
+    return render_template('batch_transfer.html', title='Batch Transfer', form=form)
+
 @app.route('/reset_password_request', methods=['GET', 'POST'])
 @limiter.limit("5 per hour")
 def reset_password_request():
@@ -401,7 +550,9 @@ def change_password():
             current_user.set_password(form.new_password.data)
             # Clear force_password_change flag
             current_user.force_password_change = False
+            audit = ('password_change', f'{current_user.username} changed their password', current_user.id, 'user', current_user.id)
             db.session.commit()
+            audit_writer.log(*audit)
             flash('Your password has been changed successfully.')
             return redirect(url_for('index'))
         else:
@@ -414,6 +565,7 @@ def change_password():
 @login_required
 @admin_required
 @limiter.limit("60 per hour")
+@read_only
 def admin_dashboard():
     # Regular admins can only see regular users
     if current_user.is_manager:
@@ -423,7 +575,8 @@ def admin_dashboard():
         # Regular admins can only see regular users (not managers or other admins)
         users = User.query.filter(User.is_admin.is_(False), User.is_manager.is_(False)).all()
     
-    return render_template('admin/dashboard.html', title='Admin Dashboard', users=users)
+    return render_template('admin/dashboard.html', title='Admin Dashboard', users=users,
+                           balances=User.available_balances(users))
 
 @app.route('/admin/activate_user/<int:user_id>')
 @login_required
@@ -437,8 +590,11 @@ def activate_user(user_id):
         return redirect(url_for('admin_dashboard'))
         
     user.status = 'active'
+    username = user.username
+    audit = ('user_activated', f'{current_user.username} activated {username}', current_user.id, 'user', user_id)
     db.session.commit()
-    flash(f'Account {user.username} has been activated.')
+    audit_writer.log(*audit)
+    flash(f'Account {username} has been activated.')
     return redirect(url_for('admin_dashboard'))
 
 @app.route('/admin/deactivate_user/<int:user_id>')
@@ -453,8 +609,11 @@ def deactivate_user(user_id):
         return redirect(url_for('admin_dashboard'))
         
     user.status = 'deactivated'
+    username = user.username
+    audit = ('user_deactivated', f'{current_user.username} deactivated {username}', current_user.id, 'user', user_id)
     db.session.commit()
-    flash(f'Account {user.username} has been deactivated.')
+    audit_writer.log(*audit)
+    flash(f'Account {username} has been deactivated.')
     return redirect(url_for('admin_dashboard'))
 
 @app.route('/admin/create_account', methods=['GET', 'POST'])
@@ -467,7 +626,10 @@ def create_account():
         user = User(username=form.username.data, email=form.email.data, status='active', force_password_change=True)
         user.set_password(form.password.data)
         db.session.add(user)
+        db.session.flush()
+        audit = ('user_created', f'{current_user.username} created account {user.username}', current_user.id, 'user', user.id)
         db.session.commit()
+        audit_writer.log(*audit)
         flash('User account has been created. User will be required to change password on first login.')
         return redirect(url_for('admin_dashboard'))
     return render_template('admin/create_account.html', title='Create User Account', form=form)
@@ -519,7 +681,6 @@ def admin_deposit():
         
         # Call deposit method
         if user.deposit(amount, current_user):
-            db.session.commit()
             flash(f'Successfully deposited ₱{amount:.2f} to {user.username}')
             return redirect(url_for('admin_dashboard'))
         else:
@@ -528,6 +689,28 @@ def admin_deposit():
     
     return render_template('admin/deposit.html', title='Deposit Funds', form=form, account_details=account_details)
 
+# Placeholder option for each dependent address dropdown
+ADDRESS_PLACEHOLDERS = {
+    'provinces': '-- Select Province --',
+    'cities': '-- Select City/Municipality --',
+    'barangays': '-- Select Barangay --',
+}
+
+def _selected_choice(placeholder, code, lookup):
+    """Choices holding just the placeholder and the selected entry, if it exists"""
+    choices = [('', placeholder)]
+    entry = lookup(code) if code else None
+    if entry:
+        choices.append((entry['code'], entry['name']))
+    return choices
+
+def _city_option(code):
+    """City or municipality labelled as in the cities dropdown"""
+    city = psgc_api.get_city_by_code(code)
+    if city:
+        return {'code': city['code'], 'name': f"{city['name']} (City)"}
+    return psgc_api.get_municipality_by_code(code)
+
 @app.route('/admin/edit_user/<int:user_id>', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -543,10 +726,6 @@ def edit_user(user_id):
     
     form = UserEditForm(original_email=user.email)
     
-    # Load region choices for dropdown (always needed)
-    regions = psgc_api.get_regions()
-    form.region_name.choices = [('', '-- Select Region --')] + [(r['code'], r['name']) for r in regions]
-    
     # Always populate form on both GET and POST to maintain choices
     form.email.data = user.email if form.email.data is None else form.email.data
     form.firstname.data = user.firstname if form.firstname.data is None else form.firstname.data
@@ -556,62 +735,6 @@ def edit_user(user_id):
     form.phone.data = user.phone if form.phone.data is None else form.phone.data
     form.status.data = user.status if form.status.data is None else form.status.data
     
-    # CRITICAL: We need to populate the dependent dropdown choices
-    # for both GET and POST requests to avoid validation errors
-    
-    # Load existing region selection
-    region_code = user.region_code
-    if form.region_name.data:
-        region_code = form.region_name.data
-    
-    # If we have a region, load provinces
-    if region_code:
-        provinces = psgc_api.get_provinces(region_code)
-        form.province_name.choices = [('', '-- Select Province --')] + [(p['code'], p['name']) for p in provinces]
-        
-        # Load existing province selection
-        province_code = user.province_code
-        if form.province_name.data:
-            province_code = form.province_name.data
-        
-        # If we have a province, load cities/municipalities
-        if province_code:
-            cities = psgc_api.get_cities(province_code)
-            municipalities = psgc_api.get_municipalities(province_code)
-            city_choices = [('', '-- Select City/Municipality --')]
-            
-            # Add cities
-            for city in cities:
-                city_choices.append((city['code'], f"{city['name']} (City)"))
-            
-            # Add municipalities
-            for municipality in municipalities:
-                city_choices.append((municipality['code'], municipality['name']))
-            
-            form.city_name.choices = city_choices
-            
-            # Load existing city selection
-            city_code = user.city_code
-            if form.city_name.data:
-                city_code = form.city_name.data
-            
-            # If we have a city, load barangays
-            if city_code:
-                barangays = []
-                # Check if it's a city or municipality
-                city_info = psgc_api.get_city_by_code(city_code)
-                if city_info:
-                    barangays = psgc_api.get_barangays(city_code=city_code)
-                else:
-                    barangays = psgc_api.get_barangays(municipality_code=city_code)
-                
-                form.barangay_name.choices = [('', '-- Select Barangay --')] + [(b['code'], b['name']) for b in barangays]
-    else:
-        # If no region selected, provide empty choices for dependent fields
-        form.province_name.choices = [('', '-- Select Province --')]
-        form.city_name.choices = [('', '-- Select City/Municipality --')]
-        form.barangay_name.choices = [('', '-- Select Barangay --')]
-    
     # Only on GET request, set the selected values
     if request.method == 'GET':
         if user.region_code:
@@ -630,6 +753,13 @@ def edit_user(user_id):
             form.barangay_code.data = user.barangay_code
             form.barangay_name.data = user.barangay_code
     
+    # Regions are few enough to list in full; the dependent dropdowns only get
+    # the current selection here and load their options on demand
+    form.region_name.choices = [('', '-- Select Region --')] + [(r['code'], r['name']) for r in psgc_api.get_regions()]
+    form.province_name.choices = _selected_choice('-- Select Province --', form.province_name.data, psgc_api.get_province_by_code)
+    form.city_name.choices = _selected_choice('-- Select City/Municipality --', form.city_name.data, _city_option)
+    form.barangay_name.choices = _selected_choice('-- Select Barangay --', form.barangay_name.data, psgc_api.get_barangay_by_code)
+    
     if form.validate_on_submit():
         # Track changes to create an audit record
         changes = []
@@ -737,7 +867,10 @@ def edit_user(user_id):
             )
             db.session.add(transaction)
         
+        audit = ('user_edit', "\n".join(changes), current_user.id, 'user', user.id) if changes else None
         db.session.commit()
+        if audit:
+            audit_writer.log(*audit)
         flash('User information updated successfully!', 'success')
         return redirect(url_for('admin_dashboard'))
         
@@ -756,57 +889,73 @@ def force_logout_user(user_id):
     
     # Clear the user's session
     user.clear_session()
+    username = user.username
+    audit = ('force_logout', f'{current_user.username} logged out {username}', current_user.id, 'user', user_id)
     db.session.commit()
+    audit_writer.log(*audit)
     
-    flash(f'User {user.username} has been forcefully logged out.', 'success')
+    flash(f'User {username} has been forcefully logged out.', 'success')
     return redirect(url_for('admin_dashboard'))
 
+# Address lists for the dependent dropdowns, as [{'code', 'name'}] in display order
+
+def _province_entries(region_code):
+    return [{'code': p['code'], 'name': p['name']} for p in psgc_api.get_provinces(region_code)]
+
+def _city_entries(province_code):
+    # Cities first, then municipalities
+    result = [{'code': city['code'], 'name': f"{city['name']} (City)"} for city in psgc_api.get_cities(province_code)]
+    result += [{'code': m['code'], 'name': m['name']} for m in psgc_api.get_municipalities(province_code)]
+    return result
+
+def _barangay_entries(city_code):
+    # Check if it's a city or municipality
+    if psgc_api.get_city_by_code(city_code):
+        barangays = psgc_api.get_barangays(city_code=city_code)
+    else:
+        barangays = psgc_api.get_barangays(municipality_code=city_code)
+    return [{'code': b['code'], 'name': b['name']} for b in barangays]
+
+ADDRESS_ENTRIES = {
+    'provinces': _province_entries,
+    'cities': _city_entries,
+    'barangays': _barangay_entries,
+}
+
 # Apply rate limiting to API endpoints
 @app.route('/api/provinces/<region_code>')
 @login_required
 @admin_required
 @limiter.limit("30 per minute")
 def get_provinces(region_code):
-    provinces = psgc_api.get_provinces(region_code)
-    return jsonify([{'code': p['code'], 'name': p['name']} for p in provinces])
+    return psgc_responses.respond('provinces', region_code, lambda: _province_entries(region_code))
 
 @app.route('/api/cities/<province_code>')
 @login_required
 @admin_required
 @limiter.limit("30 per minute")
 def get_cities_and_municipalities(province_code):
-    # Check if it's a city or municipality
-    cities = psgc_api.get_cities(province_code)
-    municipalities = psgc_api.get_municipalities(province_code)
-    
-    result = []
-    
-    # Add cities
-    for city in cities:
-        result.append({'code': city['code'], 'name': f"{city['name']} (City)"})
-    
-    # Add municipalities
-    for municipality in municipalities:
-        result.append({'code': municipality['code'], 'name': municipality['name']})
-        
-    return jsonify(result)
+    return psgc_responses.respond('cities', province_code, lambda: _city_entries(province_code))
 
 @app.route('/api/barangays/<city_code>')
 @login_required
 @admin_required
 @limiter.limit("30 per minute")
 def get_barangays(city_code):
-    # Check if it's a city or municipality
-    city_info = psgc_api.get_city_by_code(city_code)
-    
-    barangays = []
-    if city_info:
-        barangays = psgc_api.get_barangays(city_code=city_code)
-    else:
-        # Must be a municipality
-        barangays = psgc_api.get_barangays(municipality_code=city_code)
-        
-    return jsonify([{'code': b['code'], 'name': b['name']} for b in barangays])
+    return psgc_responses.respond('barangays', city_code, lambda: _barangay_entries(city_code))
+
+@app.route('/api/address_options/<level>/<parent_code>')
+@login_required
+@admin_required
+@limiter.limit("30 per minute")
+def address_options(level, parent_code):
+    """Pre-rendered <option> list for a dependent address dropdown in edit_user"""
+    if level not in ADDRESS_ENTRIES:
+        abort(404)
+    def build():
+        options = [('', ADDRESS_PLACEHOLDERS[level])] + [(e['code'], e['name']) for e in ADDRESS_ENTRIES[level](parent_code)]
+        return ''.join(f'<option value="{escape(code)}">{escape(name)}</option>' for code, name in options)
+    return psgc_responses.respond_html(level, parent_code, build)
 
 # Manager routes
 @app.route('/manager')
@@ -851,7 +1000,10 @@ def create_admin():
         admin = User(username=form.username.data, email=form.email.data, status='active', is_admin=True, force_password_change=True)
         admin.set_password(form.password.data)
         db.session.add(admin)
+        db.session.flush()
+        audit = ('admin_created', f'Manager {current_user.username} created admin {admin.username}', current_user.id, 'user', admin.id)
         db.session.commit()
+        audit_writer.log(*audit)
         flash('Admin account has been created successfully!', 'success')
         return redirect(url_for('admin_list'))
     
@@ -934,7 +1086,12 @@ def toggle_admin_with_pin():
         )
         db.session.add(transaction)
     
+    audit = None
+    if action in ('promote_admin', 'remove_admin'):
+        audit = (transaction.transaction_type, transaction.details, current_user.id, 'user', user.id)
     db.session.commit()
+    if audit:
+        audit_writer.log(*audit)
     return redirect(request.referrer or url_for('manager_dashboard'))
 
 @app.route('/manager/toggle_admin/<int:user_id>')
@@ -953,24 +1110,83 @@ def toggle_admin(user_id):
 @app.route('/manager/user_list')
 @login_required
 @manager_required
+@read_only
 def user_list():
     from forms import ToggleAdminForm
     # Get all users except admins and managers
     users = User.query.filter(User.is_admin.is_(False), User.is_manager.is_(False)).all()
     form = ToggleAdminForm()  # Create form instance for CSRF
-    return render_template('manager/user_list.html', title='All Users', users=users, form=form)
+    return render_template('manager/user_list.html', title='All Users', users=users, form=form,
+                           balances=User.available_balances(users))
 
 @app.route('/manager/admin_list')
 @login_required
 @manager_required
+@read_only
 def admin_list():
     # Get all admin users except managers
     admins = User.query.filter(User.is_admin.is_(True), User.is_manager.is_(False)).all()
-    return render_template('manager/admin_list.html', title='All Admin Users', admins=admins)
+    return render_template('manager/admin_list.html', title='All Admin Users', admins=admins,
+                           balances=User.available_balances(admins))
+
+@app.route('/manager/users/<int:user_id>/statement')
+@login_required
+@manager_required
+def user_statement(user_id):
+    user = User.query.get_or_404(user_id)
+    return _statement_response(user, 'user_list')
+
+# Rows per page on the manager transaction listings
+MANAGER_PAGE_SIZE = 50
+
+def _manager_page(query):
+    """One keyset page of a manager listing plus the values its pager needs.
+
+    The total is only counted when the page is requested with ``?count=1``,
+    since counting a large filtered table costs as much as the listing did.
+    """
+    cursor = request.args.get('cursor')
+    query = query.options(db.joinedload(Transaction.sender), db.joinedload(Transaction.receiver))
+    try:
+        transactions, next_cursor = keyset_page(query, Transaction.timestamp, Transaction.id, cursor, MANAGER_PAGE_SIZE)
+    except ValueError:
+        flash('Invalid page link; showing the newest transactions.')
+        cursor = None
+        transactions, next_cursor = keyset_page(query, Transaction.timestamp, Transaction.id, None, MANAGER_PAGE_SIZE)
+    total = query.order_by(None).count() if request.args.get('count') == '1' else None
+    # Filters to carry over into the pager links
+    page_args = {k: v for k, v in request.args.items() if k not in ('cursor', 'count')}
+    return {
+        'transactions': transactions,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
+        'total': total,
+        'page_args': page_args,
+    }
+
+@app.route('/api/users/search')
+@login_required
+@manager_required
+@limiter.limit("60 per minute")
+def search_users():
+    """Autocomplete for user pickers: prefix match on username or account number"""
+    term = request.args.get('q', '').strip()
+    if len(term) < 2:
+        return jsonify([])
+    users = User.query.filter(
+        db.or_(User.username.startswith(term, autoescape=True), User.account_number.startswith(term, autoescape=True))
+    ).order_by(User.username).limit(10).all()
+    return jsonify([{
+        'id': u.id,
+        'username': u.username,
+        'account_number': u.account_number,
+        'role': 'manager' if u.is_manager else 'admin' if u.is_admin else 'user'
+    } for u in users])
 
 @app.route('/manager/admin_transactions')
 @login_required
 @manager_required
+@read_only
 def admin_transactions():
     # Get all admin users except managers
     admins = User.query.filter(User.is_admin.is_(True), User.is_manager.is_(False)).all()
@@ -989,41 +1205,7 @@ def admin_transactions():
     # Apply search if provided
     search_term = request.args.get('search', '').strip()
     if search_term:
-        # Build list of transaction IDs that match search criteria
-        matching_transaction_ids = []
-        
-        # If search term is a number, check transaction ID
-        if search_term.isdigit():
-            matching_transaction_ids.extend([t.id for t in Transaction.query.filter(Transaction.id == int(search_term)).all()])
-        
-        # Search by sender username
-        sender_matches = Transaction.query.join(
-            User, Transaction.sender_id == User.id
-        ).filter(
-            User.username.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in sender_matches])
-        
-        # Search by receiver username
-        receiver_matches = Transaction.query.join(
-            User, Transaction.receiver_id == User.id
-        ).filter(
-            User.username.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in receiver_matches])
-        
-        # Search in transaction details
-        detail_matches = Transaction.query.filter(
-            Transaction.details.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in detail_matches])
-        
-        # Filter original query to only include matching transactions
-        if matching_transaction_ids:
-            query = query.filter(Transaction.id.in_(set(matching_transaction_ids)))
-        else:
-            # If no matches, return empty result
-            query = query.filter(Transaction.id == -1)  # Impossible condition to return empty set
+        query = query.filter(transaction_search.search_filter(search_term, transaction_search.ADMIN_FIELDS))
     
     # Apply filters
     transaction_type = request.args.get('type')
@@ -1047,17 +1229,15 @@ def admin_transactions():
             )
         )
     
-    # Get sorted results
-    transactions = query.order_by(Transaction.timestamp.desc()).all()
-    
     return render_template('manager/admin_transactions.html', 
                          title='Admin Transactions', 
-                         transactions=transactions,
-                         admins=admins)
+                         admins=admins,
+                         **_manager_page(query))
 
 @app.route('/manager/transfers')
 @login_required
 @manager_required
+@read_only
 def manager_transfers():
     # Base query - only get transfer transactions
     query = Transaction.query.filter(Transaction.transaction_type == 'transfer')
@@ -1065,59 +1245,7 @@ def manager_transfers():
     # Apply search if provided
     search_term = request.args.get('search', '').strip()
     if search_term:
-        # Build list of transaction IDs that match search criteria
-        matching_transaction_ids = []
-        
-        # If search term is a number, check transaction ID
-        if search_term.isdigit():
-            matching_transaction_ids.extend([t.id for t in Transaction.query.filter(Transaction.id == int(search_term)).all()])
-        
-        # Search by sender username
-        sender_matches = Transaction.query.join(
-            User, Transaction.sender_id == User.id
-        ).filter(
-            User.username.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in sender_matches])
-        
-        # Search by receiver username
-        receiver_matches = Transaction.query.join(
-            User, Transaction.receiver_id == User.id
-        ).filter(
-            User.username.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in receiver_matches])
-        
-        # Search by sender account number
-        sender_account_matches = Transaction.query.join(
-            User, Transaction.sender_id == User.id
-        ).filter(
-            User.account_number.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in sender_account_matches])
-        
-        # Search by receiver account number
-        receiver_account_matches = Transaction.query.join(
-            User, Transaction.receiver_id == User.id
-        ).filter(
-            User.account_number.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in receiver_account_matches])
-        
-        # Search by amount (if search term can be converted to float)
-        try:
-            amount = float(search_term)
-            amount_matches = Transaction.query.filter(Transaction.amount == amount).all()
-            matching_transaction_ids.extend([t.id for t in amount_matches])
-        except ValueError:
-            pass
-            
-        # Filter original query to only include matching transactions
-        if matching_transaction_ids:
-            query = query.filter(Transaction.id.in_(set(matching_transaction_ids)))
-        else:
-            # If no matches, return empty result
-            query = query.filter(Transaction.id == -1)  # Impossible condition to return empty set
+        query = query.filter(transaction_search.search_filter(search_term, transaction_search.TRANSFER_FIELDS))
     
     # Apply date range filter if provided
     from_date = request.args.get('from_date')
@@ -1176,13 +1304,27 @@ def manager_transfers():
                 )
             )
     
-    # Get all users for filter dropdown
-    users = User.query.all()
-    
-    # Get sorted results
-    transactions = query.order_by(Transaction.timestamp.desc()).all()
+    # Only the selected user is loaded for the filter; others come from /api/users/search
+    filter_user = db.session.get(User, user_id) if isinstance(user_id, int) else None
     
     return render_template('manager/transfers.html', 
                          title='Transfer Transactions', 
-                         transactions=transactions,
-                         users=users)
\ No newline at end of file
+                         filter_user=filter_user,
+                         **_manager_page(query))
+
+@app.route('/manager/api/metrics')
+@login_required
+@manager_required
+def manager_metrics():
+    """Operational counters for the transfer engine"""
+    return jsonify({
+        'transfers': transfer_engine.stats(),
+        'activity': activity_tracker.stats(),
+        'identity_cache': identity_cache.stats(),
+        'hashing': hashing_service.stats(),
+        'audit': audit_writer.stats(),
+        'rate_limit': lease_sync.stats(),
+        'pool': pool_stats(db.engine),
+        'replicas': dict(replica_router.stats(),
+                         pools={key: pool_stats(db.engines[key]) for key in replica_router.keys})
+    })
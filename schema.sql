@@ -39,6 +39,48 @@ CREATE TABLE IF NOT EXISTS `audit_log` (
 
 -- Data exporting was unselected.
 
+-- Dumping structure for table simple_banking.balance_checkpoint
+CREATE TABLE IF NOT EXISTS `balance_checkpoint` (
+  `user_id` int(11) NOT NULL,
+  `balance` bigint(20) NOT NULL DEFAULT 0,
+  `last_entry_id` int(11) NOT NULL DEFAULT 0,
+  `updated_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`user_id`),
+  CONSTRAINT `balance_checkpoint_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Data exporting was unselected.
+
+-- Dumping structure for table simple_banking.balance_stripe
+CREATE TABLE IF NOT EXISTS `balance_stripe` (
+  `user_id` int(11) NOT NULL,
+  `stripe` smallint(6) NOT NULL,
+  `balance` bigint(20) NOT NULL DEFAULT 0,
+  `last_entry_id` int(11) NOT NULL DEFAULT 0,
+  `updated_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`user_id`,`stripe`),
+  CONSTRAINT `balance_stripe_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Data exporting was unselected.
+
+-- Dumping structure for table simple_banking.ledger_entry
+CREATE TABLE IF NOT EXISTS `ledger_entry` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `transaction_id` varchar(36) NOT NULL,
+  `account_id` int(11) DEFAULT NULL,
+  `amount` bigint(20) NOT NULL,
+  `entry_type` varchar(6) NOT NULL,
+  `stripe` smallint(6) NOT NULL DEFAULT 0,
+  `created_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_ledger_entry_transaction_id` (`transaction_id`),
+  KEY `idx_ledger_account_entry` (`account_id`,`id`),
+  CONSTRAINT `ledger_entry_ibfk_1` FOREIGN KEY (`account_id`) REFERENCES `user` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Data exporting was unselected.
+
 -- Dumping structure for table simple_banking.login_attempt
 CREATE TABLE IF NOT EXISTS `login_attempt` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
@@ -92,6 +134,10 @@ CREATE TABLE IF NOT EXISTS `transaction` (
   KEY `idx_sender` (`sender_id`),
   KEY `idx_receiver` (`receiver_id`),
   KEY `idx_timestamp` (`timestamp`),
+  KEY `idx_sender_timestamp` (`sender_id`,`timestamp`),
+  KEY `idx_receiver_timestamp` (`receiver_id`,`timestamp`),
+  KEY `idx_type_timestamp` (`transaction_type`,`timestamp`),
+  KEY `idx_amount` (`amount`),
   KEY `idx_status` (`status`),
   CONSTRAINT `transaction_ibfk_1` FOREIGN KEY (`sender_id`) REFERENCES `user` (`id`),
   CONSTRAINT `transaction_ibfk_2` FOREIGN KEY (`receiver_id`) REFERENCES `user` (`id`)
@@ -120,6 +166,7 @@ CREATE TABLE IF NOT EXISTS `user` (
   `password_hash` varchar(128) NOT NULL,
   `account_number` varchar(10) NOT NULL,
   `balance` float DEFAULT 1000,
+  `balance_stripes` int(11) DEFAULT 0,
   `status` varchar(20) DEFAULT 'pending',
   `is_admin` tinyint(1) DEFAULT 0,
   `is_manager` tinyint(1) DEFAULT 0,
@@ -134,6 +181,7 @@ CREATE TABLE IF NOT EXISTS `user` (
   `is_2fa_enabled` tinyint(1) DEFAULT 0,
   `last_login` datetime DEFAULT NULL,
   `last_activity` datetime DEFAULT NULL,
+  `identity_updated_at` datetime DEFAULT NULL,
   `force_password_change` tinyint(1) DEFAULT 0,
   `pin_hash` varchar(128) DEFAULT NULL,
   `current_session_id` varchar(128) DEFAULT NULL,
@@ -144,7 +192,8 @@ CREATE TABLE IF NOT EXISTS `user` (
   KEY `idx_username` (`username`),
   KEY `idx_email` (`email`),
   KEY `idx_account_number` (`account_number`),
-  KEY `idx_status` (`status`)
+  KEY `idx_status` (`status`),
+  KEY `ix_user_identity_updated_at` (`identity_updated_at`)
 ) ENGINE=InnoDB AUTO_INCREMENT=9 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Data exporting was unselected.
@@ -0,0 +1,256 @@
+"""In-process trigram index for manager search.
+
+``LIKE '%term%'`` cannot use a B-tree index, so every manager search used to
+scan the whole ``user`` table (and ``transaction.details``). This module keeps
+an inverted index from lower-cased trigrams to row ids for usernames, account
+numbers and transaction details. A lookup intersects the posting sets of the
+term's trigrams and then confirms the substring against the indexed text.
+
+The index is built by a background thread one interval after the app
+starts; until it is ready, searches return None and callers use SQL.
+Searches only read memory; the same thread catches up every interval
+(``SEARCH_INDEX_SYNC_INTERVAL``). It is kept in sync three ways:
+  * rows written through the ORM in this process are applied when their
+    session commits;
+  * transactions written elsewhere (other workers, bulk INSERTs) are pulled
+    in by id. Ids skipped over are remembered for ``GAP_SECONDS`` and fetched
+    again, since with concurrent writers a lower id can commit after a
+    higher one;
+  * users are pulled in by ``identity_updated_at``, which is set whenever a
+    username or account number changes. Each pass also re-reads the
+    ``USER_SAFETY_WINDOW`` before the previous one, to catch changes that
+    committed late or were stamped by a worker with a slower clock.
+
+So a change made by another worker shows up in search within one interval;
+one that commits more than those windows late is missed until the next
+rebuild (``reset``). Terms shorter than three characters return None
+and callers fall back to SQL.
+"""
+import datetime
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import event, or_, select
+from sqlalchemy.orm import Session
+from background import PeriodicWorker
+from extensions import db
+from models import User, Transaction
+
+# Rows loaded per round trip while building or catching up
+LOAD_BATCH_SIZE = 5000
+
+# Seconds a skipped transaction id is looked for again before it is taken as rolled back
+GAP_SECONDS = 120
+
+# Most skipped ids remembered (the highest); older holes are deleted rows or id allocator jumps
+MAX_GAPS = 1000
+
+# How far before the previous pass each pass looks again for user changes
+USER_SAFETY_WINDOW = datetime.timedelta(minutes=2)
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class TrigramIndex:
+    """Substring index over short strings keyed by row id"""
+
+    def __init__(self):
+        self._postings = defaultdict(set)
+        self._texts = {}
+
+    def __len__(self):
+        return len(self._texts)
+
+    def add(self, row_id, text):
+        self.discard(row_id)
+        if not text:
+            return
+        text = text.lower()
+        self._texts[row_id] = text
+        for gram in trigrams(text):
+            self._postings[gram].add(row_id)
+
+    def discard(self, row_id):
+        text = self._texts.pop(row_id, None)
+        if text is None:
+            return
+        for gram in trigrams(text):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(row_id)
+                if not posting:
+                    del self._postings[gram]
+
+    def search(self, term):
+        """Ids whose text contains ``term`` (case-insensitive), or None if ``term`` is too short"""
+        term = term.lower()
+        if len(term) < 3:
+            return None
+        # Intersect from the rarest trigram up so the working set stays small
+        postings = sorted((self._postings.get(gram, ()) for gram in trigrams(term)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        return {row_id for row_id in candidates if term in self._texts[row_id]}
+
+class SearchIndex:
+    """Trigram indexes for the fields manager search looks at"""
+
+    def __init__(self):
+        self.enabled = True
+        self.usernames = TrigramIndex()
+        self.account_numbers = TrigramIndex()
+        self.details = TrigramIndex()
+        self._lock = threading.RLock()
+        self._ready = False
+        self._users_synced_at = None
+        self._last_transaction_id = 0
+        self._gaps = {}
+        self._listening = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SEARCH_INDEX_ENABLED', True)
+        if self.enabled and not self._listening:
+            event.listen(User, 'after_insert', self._on_user_write)
+            event.listen(User, 'after_update', self._on_user_write)
+            event.listen(Transaction, 'after_insert', self._on_transaction_write)
+            event.listen(Transaction, 'after_update', self._on_transaction_write)
+            event.listen(Session, 'after_commit', self._on_commit)
+            event.listen(Session, 'after_rollback', self._on_rollback)
+            self._listening = True
+
+    @property
+    def ready(self):
+        """True once the index has been built"""
+        return self.enabled and self._ready
+
+    def user_ids(self, term, fields):
+        """Ids of users whose username and/or account number contain ``term``; None if unusable"""
+        if not self.ready or len(term) < 3:
+            return None
+        with self._lock:
+            ids = set()
+            if 'username' in fields:
+                ids |= self.usernames.search(term)
+            if 'account_number' in fields:
+                ids |= self.account_numbers.search(term)
+            return ids
+
+    def transaction_ids(self, term):
+        """Ids of transactions whose details contain ``term``; None if unusable"""
+        if not self.ready or len(term) < 3:
+            return None
+        with self._lock:
+            return self.details.search(term)
+
+    def catch_up(self):
+        """Index rows written since the last call (the first call builds the index)"""
+        with self._lock:
+            self._catch_up_users()
+            self._catch_up_transactions()
+            self._ready = True
+
+    def reset(self):
+        """Drop everything; the next ``catch_up`` rebuilds from the database"""
+        with self._lock:
+            self.usernames = TrigramIndex()
+            self.account_numbers = TrigramIndex()
+            self.details = TrigramIndex()
+            self._ready = False
+            self._users_synced_at = None
+            self._last_transaction_id = 0
+            self._gaps = {}
+
+    def _catch_up_users(self):
+        started = datetime.datetime.utcnow()
+        query = select(User.id, User.username, User.account_number)
+        if self._users_synced_at is not None:
+            query = query.where(User.identity_updated_at >= self._users_synced_at - USER_SAFETY_WINDOW)
+        for row in self._load(query, User.id):
+            self._index_user(row.id, row.username, row.account_number)
+        self._users_synced_at = started
+
+    def _catch_up_transactions(self):
+        now = time.monotonic()
+        self._gaps = {row_id: seen for row_id, seen in self._gaps.items() if now - seen < GAP_SECONDS}
+        condition = Transaction.id > self._last_transaction_id
+        if self._gaps:
+            condition = or_(condition, Transaction.id.in_(list(self._gaps)))
+        for row in self._load(select(Transaction.id, Transaction.details).where(condition), Transaction.id):
+            if row.id > self._last_transaction_id:
+                # Ids passed over may belong to transactions that have not committed yet
+                for missing in range(max(self._last_transaction_id + 1, row.id - MAX_GAPS), row.id):
+                    self._gaps[missing] = now
+                self._last_transaction_id = row.id
+            self._gaps.pop(row.id, None)
+            if row.details:
+                self._index_details(row.id, row.details)
+        if len(self._gaps) > MAX_GAPS:
+            self._gaps = {row_id: self._gaps[row_id] for row_id in sorted(self._gaps)[-MAX_GAPS:]}
+
+    def _load(self, query, id_column):
+        result = db.session.execute(
+            query.order_by(id_column).execution_options(stream_results=True, yield_per=LOAD_BATCH_SIZE)
+        )
+        try:
+            yield from result
+        finally:
+            result.close()
+
+    def _index_user(self, user_id, username, account_number):
+        self.usernames.add(user_id, username)
+        self.account_numbers.add(user_id, account_number)
+
+    def _index_details(self, transaction_id, details):
+        self.details.add(transaction_id, details)
+
+    # Writes are buffered on the session and only applied once they commit
+
+    def _pending(self, target):
+        session = Session.object_session(target)
+        return session.info.setdefault('search_index_pending', []) if session is not None else None
+
+    def _on_user_write(self, mapper, connection, target):
+        # Most user updates (last activity, balance) leave the indexed fields alone
+        state = db.inspect(target)
+        if state.attrs.username.history.has_changes() or state.attrs.account_number.history.has_changes():
+            pending = self._pending(target)
+            if pending is not None:
+                pending.append((self._index_user, target.id, target.username, target.account_number))
+
+    def _on_transaction_write(self, mapper, connection, target):
+        pending = self._pending(target)
+        if pending is not None and target.details:
+            pending.append((self._index_details, target.id, target.details))
+
+    def _on_commit(self, session):
+        pending = session.info.pop('search_index_pending', None)
+        if pending:
+            with self._lock:
+                for apply, *args in pending:
+                    apply(*args)
+
+    def _on_rollback(self, session):
+        session.info.pop('search_index_pending', None)
+
+class SearchIndexSync(PeriodicWorker):
+    """Background thread that builds the search index and keeps it caught up"""
+
+    name = 'search-index-sync'
+
+    def __init__(self, index, interval=5):
+        super().__init__(interval)
+        self.index = index
+
+    def init_app(self, app, start=True):
+        self.interval = app.config.get('SEARCH_INDEX_SYNC_INTERVAL', self.interval)
+        super().init_app(app, start and self.index.enabled)
+
+    def run_once(self):
+        self.index.catch_up()
+
+# Shared index instance
+search_index = SearchIndex()
+search_index_sync = SearchIndexSync(search_index)
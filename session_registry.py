@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Load environment variables
+load_dotenv()
+
+# Used until init_app() reads PERMANENT_SESSION_LIFETIME
+DEFAULT_TTL = 30 * 60
+
+# Stored in Redis for revoked logins so a check does not fall back to the database
+REVOKED = ''
+
+class CommitHook:
+    """Holds registry writes made in a database transaction until it commits.
+
+    ``register``/``revoke`` go through ``after_commit`` so that a rolled back
+    login or logout never leaves the registry out of step with the
+    current_session_id column.
+    """
+
+    _listening = False
+
+    def listen(self):
+        if not self._listening:
+            event.listen(Session, 'after_commit', self._on_commit)
+            event.listen(Session, 'after_rollback', self._on_rollback)
+            self._listening = True
+
+    def after_commit(self, session, method, *args):
+        """Call ``getattr(self, method)(*args)`` once ``session`` commits"""
+        session.info.setdefault('session_registry_pending', []).append((method, args))
+
+    def _on_commit(self, session):
+        for method, args in session.info.pop('session_registry_pending', ()):
+            try:
+                getattr(self, method)(*args)
+            except Exception as e:
+                # The column is committed; validate falls back to it for a missing entry
+                print(f"session-registry: {method} failed: {e}")
+
+    def _on_rollback(self, session):
+        session.info.pop('session_registry_pending', None)
+
+class MemorySessionRegistry(CommitHook):
+    """In-process cache of sessions known to be dead.
+
+    Other workers can log a user in or out without this process hearing about
+    it, so the registry never vouches for a session: ``validate`` only answers
+    False for sessions this process has seen revoked or rejected by the
+    current_session_id column, and None (ask the column) otherwise. Session
+    ids are never reused, so a dead one stays dead; entries expire after
+    ``ttl`` seconds, matching the inactivity timeout.
+    """
+
+    shared = False
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._dead = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + 60
+
+    def init_app(self, app):
+        self.ttl = int(app.config['PERMANENT_SESSION_LIFETIME'].total_seconds())
+        self.listen()
+
+    def register(self, user_id, session_id):
+        """Nothing to record: only dead sessions are cached"""
+
+    def revoke(self, user_id, session_id=None):
+        """Remember that ``session_id`` of ``user_id`` is no longer valid"""
+        if session_id:
+            with self._lock:
+                self._dead[(user_id, session_id)] = time.monotonic() + self.ttl
+
+    def seed(self, user_id, session_id, current_session_id):
+        """Record the column's answer for ``session_id``"""
+        if session_id != current_session_id:
+            self.revoke(user_id, session_id)
+
+    def validate(self, user_id, session_id):
+        """False if ``session_id`` is known to be dead, otherwise None"""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            expires_at = self._dead.get((user_id, session_id))
+            if expires_at is not None and expires_at > now:
+                return False
+            return None
+
+    def _sweep(self, now):
+        expired = [key for key, expires_at in self._dead.items() if expires_at <= now]
+        for key in expired:
+            del self._dead[key]
+        self._next_sweep = now + 60
+
+class RedisSessionRegistry(CommitHook):
+    """Session registry shared by all workers through Redis (GETEX slides the TTL).
+
+    Every login and logout passes through it, so its answer is authoritative;
+    the column is only read when it has no entry (e.g. after an expiry).
+    """
+
+    shared = True
+
+    def __init__(self, url, ttl=DEFAULT_TTL, prefix='session:'):
+        import redis  # Optional dependency, only needed when REDIS_URL is set
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def init_app(self, app):
+        self.ttl = int(app.config['PERMANENT_SESSION_LIFETIME'].total_seconds())
+        self.listen()
+
+    def register(self, user_id, session_id):
+        self.client.set(f'{self.prefix}{user_id}', session_id, ex=self.ttl)
+
+    def revoke(self, user_id, session_id=None):
+        self.register(user_id, REVOKED)
+
+    def seed(self, user_id, session_id, current_session_id):
+        """Store the column's current session for ``user_id``"""
+        self.register(user_id, current_session_id or REVOKED)
+
+    def validate(self, user_id, session_id):
+        stored = self.client.getex(f'{self.prefix}{user_id}', ex=self.ttl)
+        if stored is None:
+            return None
+        return stored.decode('utf-8') == session_id
+
+def create_registry(url=None):
+    """Pick the Redis registry for redis:// URLs, otherwise the in-process registry"""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisSessionRegistry(url)
+    return MemorySessionRegistry()
+
+# Shared registry, backed by the same REDIS_URL as the rate limiter
+session_registry = create_registry(os.environ.get('REDIS_URL'))
@@ -0,0 +1,58 @@
+"""Manager transaction search.
+
+A search term is compiled into a single SQL predicate instead of one query
+per field: the user-name and account-number matches become a sub-select of
+user ids (``sender_id IN (...) OR receiver_id IN (...)``), and the ID,
+amount and details matches are plain column comparisons, all ORed together.
+Substring matches are looked up in the trigram index (``search_index``)
+where possible, which turns them into short id lists instead of
+leading-wildcard LIKE scans. The listings apply the predicate to a
+keyset-paginated query ordered by ``(timestamp, id)``, so the database stops
+scanning as soon as a page of matches is found, however many rows match in
+total.
+"""
+from sqlalchemy import select, or_, false
+from models import User, Transaction
+from search_index import search_index
+
+# Above this many index hits an IN list stops paying off and SQL does the matching
+MAX_INDEX_IDS = 5000
+
+# Fields each manager listing searches
+TRANSFER_FIELDS = ('id', 'username', 'account_number', 'amount')
+ADMIN_FIELDS = ('id', 'username', 'details')
+
+def search_filter(term, fields):
+    """Predicate matching transactions where ``term`` appears in any of ``fields``"""
+    predicates = []
+
+    if 'id' in fields and term.isdigit():
+        predicates.append(Transaction.id == int(term))
+
+    user_predicates = []
+    if 'username' in fields:
+        user_predicates.append(User.username.contains(term, autoescape=True))
+    if 'account_number' in fields:
+        user_predicates.append(User.account_number.contains(term, autoescape=True))
+    if user_predicates:
+        parties = search_index.user_ids(term, fields)
+        if parties is None or len(parties) > MAX_INDEX_IDS:
+            parties = select(User.id).where(or_(*user_predicates))
+        if parties != set():
+            predicates.append(Transaction.sender_id.in_(parties))
+            predicates.append(Transaction.receiver_id.in_(parties))
+
+    if 'amount' in fields:
+        try:
+            predicates.append(Transaction.amount == float(term))
+        except ValueError:
+            pass
+
+    if 'details' in fields:
+        matches = search_index.transaction_ids(term)
+        if matches is None or len(matches) > MAX_INDEX_IDS:
+            predicates.append(Transaction.details.contains(term, autoescape=True))
+        elif matches:
+            predicates.append(Transaction.id.in_(matches))
+
+    return or_(*predicates) if predicates else false()
@@ -0,0 +1,388 @@
+import datetime
+import random
+import threading
+import time
+import uuid
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from background import PeriodicWorker
+from extensions import db
+from models import User, Transaction
+import ledger
+
+# MySQL error codes that mean the whole transaction can safely be run again
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+
+# How often each worker re-reads which accounts are striped
+STRIPE_REFRESH_SECONDS = 30
+
+class TransferEngine:
+    """Posts money movements to the ledger with ordered locking and deadlock retry.
+
+    Postings are insert-only (see ``ledger``): a debit locks the payer's
+    balance checkpoint, checks the ledger balance and appends a debit entry;
+    a credit takes a shared lock on the payee's checkpoint and appends a
+    credit entry. ``user`` rows are never updated on this path, so a popular
+    recipient is not a point of contention. Checkpoints are locked in
+    ascending account id order so two transfers between the same accounts
+    always lock in the same order.
+
+    Credits to hot accounts (``balance_stripes > 0``, such as merchants) lock
+    a random ``BalanceStripe`` of the payee instead of its checkpoint; see
+    ``enable_striping`` and ``StripeCompactor``.
+    """
+
+    def __init__(self, max_retries=5, base_backoff=0.01, max_backoff=0.5):
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._stripes = {}
+        self._stripes_loaded_at = None
+        self.reset_stats()
+
+    def init_app(self, app):
+        """Read retry settings from the app config"""
+        self.max_retries = app.config.get('TRANSFER_MAX_RETRIES', self.max_retries)
+        self.base_backoff = app.config.get('TRANSFER_BASE_BACKOFF', self.base_backoff)
+        self.max_backoff = app.config.get('TRANSFER_MAX_BACKOFF', self.max_backoff)
+
+    def transfer(self, sender_id, recipient_id, amount):
+        """Move ``amount`` from sender to recipient and commit.
+
+        Returns True if the transfer was committed and False if the sender
+        does not have enough funds.
+        """
+        # Rounded once here so the ledger entries and the Transaction row agree
+        amount = ledger.round_amount(amount)
+        if amount <= 0 or sender_id == recipient_id:
+            self._count('rejected')
+            return False
+        return self._run(self._apply_transfer, sender_id, recipient_id, amount)
+
+    def _apply_transfer(self, sender_id, recipient_id, amount):
+        transaction_id = str(uuid.uuid4())
+        minor = ledger.to_minor(amount)
+        # Lock in a fixed (ascending id) order to avoid lock-order deadlocks
+        for account_id in sorted((sender_id, recipient_id)):
+            if account_id == sender_id:
+                if not self._debit(sender_id, minor):
+                    return False
+            else:
+                stripes = self._lock_credits([recipient_id])
+
+        ledger.append([
+            (transaction_id, sender_id, -minor),
+            (transaction_id, recipient_id, minor),
+        ], stripes)
+        db.session.add(Transaction(
+            transaction_id=transaction_id,
+            sender_id=sender_id,
+            receiver_id=recipient_id,
+            amount=amount,
+            transaction_type='transfer',
+            timestamp=datetime.datetime.utcnow()
+        ))
+        return True
+
+    def deposit(self, account_id, amount, admin_id):
+        """Credit an over-the-counter deposit recorded as coming from ``admin_id``.
+
+        The debit leg goes to the bank's cash account, not to the admin.
+        """
+        amount = ledger.round_amount(amount)
+        if amount <= 0:
+            self._count('rejected')
+            return False
+        return self._run(self._apply_deposit, account_id, amount, admin_id)
+
+    def _apply_deposit(self, account_id, amount, admin_id):
+        transaction_id = str(uuid.uuid4())
+        minor = ledger.to_minor(amount)
+        stripes = self._lock_credits([account_id])
+        ledger.append([
+            (transaction_id, ledger.CASH_ACCOUNT, -minor),
+            (transaction_id, account_id, minor),
+        ], stripes)
+        db.session.add(Transaction(
+            transaction_id=transaction_id,
+            sender_id=admin_id,
+            receiver_id=account_id,
+            amount=amount,
+            transaction_type='deposit',
+            timestamp=datetime.datetime.utcnow()
+        ))
+        return True
+
+    def transfer_batch(self, sender_id, payments):
+        """Apply a list of ``(account_number, amount)`` payments in one transaction.
+
+        Recipients are resolved with a single ``IN`` query, the sender's
+        balance is checked once for the total, and all ledger entries and
+        ``Transaction`` rows are written with one bulk INSERT each. Either
+        every payment is posted or none is.
+
+        Returns ``(True, total)`` on success or ``(False, error_message)``.
+        """
+        if not payments:
+            return False, 'No payments to process.'
+        payments = [(account_number, ledger.round_amount(amount)) for account_number, amount in payments]
+
+        account_numbers = {account_number for account_number, _ in payments}
+        rows = db.session.execute(
+            select(User.id, User.account_number, User.status, User.is_admin, User.is_manager)
+            .where(User.account_number.in_(account_numbers))
+        ).all()
+        recipients = {row.account_number: row for row in rows}
+
+        for account_number, amount in payments:
+            recipient = recipients.get(account_number)
+            if recipient is None:
+                return False, f'Account {account_number} not found.'
+            if recipient.id == sender_id:
+                return False, 'You cannot transfer money to yourself.'
+            if recipient.status != 'active' and not recipient.is_admin and not recipient.is_manager:
+                return False, f'Account {account_number} is not active.'
+            if amount <= 0:
+                return False, f'Amount for account {account_number} must be greater than 0.'
+
+        total = ledger.to_major(sum(ledger.to_minor(amount) for _, amount in payments))
+        postings = [(recipients[account_number].id, amount) for account_number, amount in payments]
+        if not self._run(self._apply_batch, sender_id, postings):
+            return False, 'Insufficient funds for this batch.'
+        return True, total
+
+    def _apply_batch(self, sender_id, postings):
+        # Same ascending id lock order as single transfers: lower ids, sender, higher ids
+        recipient_ids = {recipient_id for recipient_id, _ in postings}
+        lower = [a for a in recipient_ids if a < sender_id]
+        higher = [a for a in recipient_ids if a > sender_id]
+
+        stripes = self._lock_credits(lower)
+        if not self._debit(sender_id, sum(ledger.to_minor(amount) for _, amount in postings)):
+            return False
+        stripes.update(self._lock_credits(higher))
+
+        now = datetime.datetime.utcnow()
+        entries, transactions = [], []
+        for recipient_id, amount in postings:
+            transaction_id = str(uuid.uuid4())
+            minor = ledger.to_minor(amount)
+            entries.append((transaction_id, sender_id, -minor))
+            entries.append((transaction_id, recipient_id, minor))
+            transactions.append({
+                'transaction_id': transaction_id,
+                'sender_id': sender_id,
+                'receiver_id': recipient_id,
+                'amount': amount,
+                'transaction_type': 'transfer',
+                'timestamp': now
+            })
+        ledger.append(entries, stripes)
+        db.session.execute(Transaction.__table__.insert(), transactions)
+        return True
+
+    def _debit(self, account_id, minor):
+        """Lock the payer and check the ledger balance; False if funds are short.
+
+        The caller appends the debit entry while still holding the lock.
+        """
+        ledger.lock_accounts([account_id], exclusive=True)
+        return ledger.balance_of(account_id) >= minor
+
+    def _lock_credits(self, account_ids):
+        """Take the shared locks for crediting ``account_ids``.
+
+        Plain accounts lock their checkpoints; striped ones lock a random
+        stripe. Returns ``{account_id: stripe}`` for the latter, for
+        ``ledger.append``.
+        """
+        plain, stripes = [], {}
+        for account_id in sorted(account_ids):
+            count = self.stripe_count(account_id)
+            number = random.randint(1, count) if count else 0
+            # The stripe may have been removed since the striped accounts were read
+            if number and ledger.lock_stripe(account_id, number):
+                stripes[account_id] = number
+            else:
+                plain.append(account_id)
+        ledger.lock_accounts(plain, exclusive=False)
+        return stripes
+
+    def stripe_count(self, account_id):
+        """Number of stripes for an account (0 if it is not striped)"""
+        now = time.monotonic()
+        if self._stripes_loaded_at is None or now - self._stripes_loaded_at > STRIPE_REFRESH_SECONDS:
+            self.refresh_striped_accounts()
+        return self._stripes.get(account_id, 0)
+
+    def refresh_striped_accounts(self):
+        """Reload the set of striped accounts from the database"""
+        rows = db.session.execute(
+            select(User.id, User.balance_stripes).where(User.balance_stripes > 0)
+        ).all()
+        self._stripes = {row.id: row.balance_stripes for row in rows}
+        self._stripes_loaded_at = time.monotonic()
+        return dict(self._stripes)
+
+    def enable_striping(self, account_id, stripes):
+        """Spread future credits to ``account_id`` over ``stripes`` balance stripes"""
+        if stripes < 1:
+            raise ValueError('stripes must be at least 1')
+        self.disable_striping(account_id)
+        self._run(ledger.add_stripes, account_id, stripes, stat=False)
+        self.refresh_striped_accounts()
+
+    def disable_striping(self, account_id):
+        """Move an account's stripes into its checkpoint and remove them"""
+        self._run(ledger.drain_stripes, account_id, stat=False)
+        self.refresh_striped_accounts()
+
+    def compact(self):
+        """Fold new entries into the stripes of every striped account; returns stripes folded"""
+        compacted = 0
+        for account_id, count in self.refresh_striped_accounts().items():
+            folded = sum(self._run(ledger.fold_stripe, account_id, number, stat=False) for number in range(1, count + 1))
+            if folded:
+                self._run(ledger.materialize, account_id, stat=False)
+            compacted += folded
+        db.session.commit()
+        self._count('compactions', compacted)
+        return compacted
+
+    def checkpoint(self, limit=500):
+        """Fold new ledger entries into balance checkpoints; returns accounts folded"""
+        folded = 0
+        for account_id in ledger.accounts_behind_checkpoint(limit):
+            if self._run(ledger.fold_checkpoint, account_id, stat=False):
+                folded += 1
+        db.session.commit()
+        self._count('checkpoints', folded)
+        return folded
+
+    def _begin(self):
+        """Start a fresh transaction for one attempt.
+
+        On MySQL the attempt runs at READ COMMITTED so that balance reads made
+        after taking a checkpoint lock see every posting committed before it.
+        The commit only ends the caller's read transaction: pending changes
+        would be committed with the posting (and again on a retry), so they
+        are refused instead.
+        """
+        if db.session.new or db.session.dirty or db.session.deleted:
+            raise RuntimeError('Commit or roll back pending changes before posting to the ledger')
+        db.session.commit()
+        if db.session.get_bind().dialect.name == 'mysql':
+            db.session.connection(execution_options={'isolation_level': 'READ COMMITTED'})
+
+    def _run(self, work, *args, stat=True):
+        """Run ``work`` in its own transaction, retrying on deadlock/lock timeout.
+
+        ``work`` returns True to commit or False to roll back. ``stat=False``
+        keeps housekeeping work out of the committed/rejected counters.
+        """
+        attempt = 0
+        while True:
+            try:
+                self._begin()
+                ok = work(*args)
+                if ok:
+                    db.session.commit()
+                else:
+                    db.session.rollback()
+                if stat:
+                    self._count('committed' if ok else 'rejected')
+                return ok
+            except OperationalError as e:
+                db.session.rollback()
+                reason = self._retry_reason(e)
+                if reason is None or attempt >= self.max_retries:
+                    self._count('failed')
+                    raise
+                attempt += 1
+                self._count('retries')
+                self._count(reason)
+                time.sleep(self._backoff(attempt))
+
+    def _retry_reason(self, error):
+        """Return the counter name for a retryable error, or None"""
+        code = error.orig.args[0] if error.orig is not None and error.orig.args else None
+        if code == ER_LOCK_DEADLOCK:
+            return 'deadlocks'
+        if code == ER_LOCK_WAIT_TIMEOUT:
+            return 'lock_timeouts'
+        # SQLite reports writer contention as a string error
+        if 'database is locked' in str(error.orig):
+            return 'lock_timeouts'
+        return None
+
+    def _backoff(self, attempt):
+        """Exponential backoff with full jitter"""
+        ceiling = min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset_stats(self):
+        """Zero all counters and restart the throughput clock"""
+        with self._lock:
+            self._counters = {
+                'committed': 0,
+                'rejected': 0,
+                'failed': 0,
+                'retries': 0,
+                'deadlocks': 0,
+                'lock_timeouts': 0,
+                'checkpoints': 0,
+                'compactions': 0,
+            }
+            self._started = time.monotonic()
+
+    def stats(self):
+        """Snapshot of the counters plus committed transfers per second"""
+        with self._lock:
+            stats = dict(self._counters)
+            elapsed = time.monotonic() - self._started
+        stats['uptime_seconds'] = round(elapsed, 3)
+        stats['throughput_per_second'] = round(stats['committed'] / elapsed, 3) if elapsed > 0 else 0.0
+        return stats
+
+class CheckpointWriter(PeriodicWorker):
+    """Background thread that folds new ledger entries into balance checkpoints"""
+
+    name = 'checkpoint-writer'
+
+    def __init__(self, engine, interval=5):
+        super().__init__(interval)
+        self.engine = engine
+
+    def init_app(self, app, start=True):
+        self.interval = app.config.get('LEDGER_CHECKPOINT_INTERVAL', self.interval)
+        super().init_app(app, start)
+
+    def run_once(self):
+        self.engine.checkpoint()
+
+class StripeCompactor(PeriodicWorker):
+    """Background thread that folds new ledger entries into hot-account stripes"""
+
+    name = 'stripe-compactor'
+
+    def __init__(self, engine, interval=5):
+        super().__init__(interval)
+        self.engine = engine
+
+    def init_app(self, app, start=True):
+        self.interval = app.config.get('STRIPE_COMPACT_INTERVAL', self.interval)
+        super().init_app(app, start)
+
+    def run_once(self):
+        self.engine.compact()
+
+# Shared engine instance
+transfer_engine = TransferEngine()
+checkpoint_writer = CheckpointWriter(transfer_engine)
+stripe_compactor = StripeCompactor(transfer_engine)